@@ -0,0 +1,54 @@
+import pytest
+from pathlib import Path
+from bbor_client import BBORClient
+from mockserver import MockData, serve, MOCK_USERNAME, MOCK_PASSWORD
+
+pytest.importorskip('pytest_benchmark')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('bbor_client mock server')
+    group.addoption('--mock-studies', type=int, default=5, help='Number of studies of the mock server')
+    group.addoption('--mock-trials', type=int, default=200, help='Number of trials of each study')
+    group.addoption('--mock-refines', type=int, default=3, help='Number of refines of each trial')
+    group.addoption('--mock-phases', type=int, default=1, help='Number of phases of each study')
+    group.addoption('--mock-latency', type=float, default=0., help='Seconds added to every response')
+
+
+@pytest.fixture(scope='session')
+def mock_url(pytestconfig):
+    data = MockData(
+        n_studies = pytestconfig.getoption('--mock-studies'),
+        n_trials = pytestconfig.getoption('--mock-trials'),
+        n_refines = pytestconfig.getoption('--mock-refines'),
+        n_phases = pytestconfig.getoption('--mock-phases'),
+    )
+    with serve(data, latency=pytestconfig.getoption('--mock-latency')) as url:
+        yield url
+
+
+@pytest.fixture(scope='session')
+def client(mock_url) -> BBORClient:
+    return BBORClient(MOCK_USERNAME, MOCK_PASSWORD, server=mock_url)
+
+
+@pytest.fixture(scope='session')
+def study(client) -> dict:
+    return client.find_studies(return_dict=True)[0]
+
+
+@pytest.fixture(scope='session')
+def trial(client, study) -> dict:
+    return client.find_trials({'parent_study.$id': study['_id']}, return_dict=True)[0]
+
+
+@pytest.fixture(scope='session')
+def input_files(tmp_path_factory) -> dict[str, Path]:
+    directory = tmp_path_factory.mktemp('inputs')
+    measurement = directory / 'measurement.csv'
+    measurement.write_text('\n'.join(f'{10 + 0.01*i:.2f},{1000 + (i*37) % 500}' for i in range(9000)))
+    prm = directory / 'bench.instprm'
+    prm.write_text('#GSAS-II instrument parameter file\nType:PXC\n')
+    cif = directory / 'bench.cif'
+    cif.write_text('data_bench\n_cell_length_a 5.64\n')
+    return {'measurement': measurement, 'prm': prm, 'cif': cif}
@@ -0,0 +1,605 @@
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from socketserver import ThreadingMixIn
+from typing import Optional, Callable, Iterator
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+from bbor_client.query import match, project, get_value
+from bbor_client.aggregate import histogram
+
+# A local stand-in of the BBO-Rietveld API server for tests and benchmarks.
+# It implements the endpoints used by BBORClient with synthetic studies, trials, and refines kept in memory.
+#
+#   with serve(MockData(n_studies=10, n_trials=1000)) as url:
+#       client = BBORClient('user', 'password', server=url)
+
+MOCK_USERNAME = 'mockuser'
+MOCK_PASSWORD = 'mockpassword'
+MOCK_TOKEN = 'mock-token'
+
+FILE_KINDS = ('prm', 'cif', 'seq')
+PHASE_NAMES = ('NaCl', 'Y2O3', 'Si', 'CeO2', 'LaB6', 'Al2O3', 'ZnO', 'TiO2')
+
+
+def _oid(rng: random.Random) -> str:
+    return '%024x' % rng.getrandbits(96)
+
+
+def _link(collection: str, id: str) -> dict:
+    return {'collection': collection, 'id': id}
+
+
+def _refinable(rng: random.Random, value: float) -> dict:
+    return {'value': value * rng.uniform(0.95, 1.05), 'sig': abs(value) * 1e-3, 'refine': rng.random() < 0.5}
+
+
+def _constrainable(rng: random.Random, value: float) -> dict:
+    return _refinable(rng, value) | {'is_constrained': False}
+
+
+class MockData:
+    '''
+    Synthetic documents of the server.
+
+    Args:
+        n_studies: Number of studies.
+        n_trials: Number of trials of each study.
+        n_refines: Number of refines of each trial.
+        n_phases: Number of phases of each study.
+        n_atoms: Number of atoms of each phase.
+        seed: Seed of the random numbers. The same seed gives the same documents.
+    '''
+    def __init__(
+            self,
+            n_studies: int = 3,
+            n_trials: int = 100,
+            n_refines: int = 3,
+            n_phases: int = 1,
+            n_atoms: int = 2,
+            seed: int = 0,
+    ):
+        self.n_trials = n_trials
+        self.n_refines = n_refines
+        self.n_phases = n_phases
+        self.n_atoms = n_atoms
+        self._rng = random.Random(seed)
+        self.user_id = _oid(self._rng)
+        self.group_id = _oid(self._rng)
+        self.start_at = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.studies: dict[str, dict] = {}
+        self.trials: dict[str, dict] = {}
+        self.refines: dict[str, dict] = {}
+        self.files: dict[str, list[str]] = {
+            'prm': ['XC-BB.instprm'],
+            'cif': ['NaCl.cif'],
+            'seq': ['default', 'fast'],
+        }
+        for i in range(n_studies):
+            self.add_study(f'study{i:04d}', n_trials=n_trials)
+
+    def user(self) -> dict:
+        return {
+            'id': self.user_id,
+            'name': MOCK_USERNAME,
+            'group': {'id': self.group_id, 'abbr': 'mock'},
+            'disabled': False,
+            'created_at': self.start_at.isoformat(),
+            'updated_at': self.start_at.isoformat(),
+        }
+
+    def _phase_names(self) -> list[str]:
+        return self._rng.sample(PHASE_NAMES, k=min(self.n_phases, len(PHASE_NAMES)))
+
+    def _phase_parameters(self) -> dict:
+        rng = self._rng
+        a = rng.uniform(3, 10)
+        return {
+            'LP': {
+                'a': _constrainable(rng, a),
+                'b': _constrainable(rng, a),
+                'c': _constrainable(rng, a),
+                'alpha': _constrainable(rng, 90.),
+                'beta': _constrainable(rng, 90.),
+                'gamma': _constrainable(rng, 90.),
+                'volume': {'value': a**3, 'sig': 1e-3},
+            },
+            'atoms': {
+                f'X{i}': {
+                    'x': _constrainable(rng, rng.random()),
+                    'y': _constrainable(rng, rng.random()),
+                    'z': _constrainable(rng, rng.random()),
+                    'frac': _refinable(rng, 1.),
+                    'adp_model': 'isotropic',
+                    'Uiso': _refinable(rng, 0.01),
+                }
+                for i in range(self.n_atoms)
+            },
+            'HAP': {
+                'frac': {'phase_scale': _refinable(rng, 1.)},
+                'size': {'model': 'isotropic', 'size': _refinable(rng, 1.), 'LGmix': _refinable(rng, 1.)},
+                'mustrain': {'model': 'isotropic', 'strain': _refinable(rng, 1000.), 'LGmix': _refinable(rng, 1.)},
+            },
+        }
+
+    def _refine_base(self, sequence_index: int, phase_names: list[str], rwp: float) -> dict:
+        rng = self._rng
+        return {
+            'sequence_index': sequence_index,
+            'SP': {
+                'type': 'DS',
+                'Scale': _refinable(rng, 1.),
+                'Absorption': _refinable(rng, 0.5),
+                'DisplaceX': _refinable(rng, 0.),
+                'DisplaceY': _refinable(rng, 0.),
+            },
+            'IP': {
+                'type': 'PXC',
+                **{name: _refinable(rng, value) for name, value in (
+                    ('X', 1.), ('Y', 1.), ('Z', 0.), ('Zero', 0.), ('U', 2.), ('V', -2.), ('W', 5.),
+                    ('Polariz.', 0.5), ('SH/L', 0.002), ('I(L2)/I(L1)', 0.5),
+                )},
+            },
+            'phases': {name: self._phase_parameters() for name in phase_names},
+            'BP': {
+                'polynomial': {
+                    'func': 'chebyschev',
+                    'coeffs': {'values': [rng.uniform(-10, 10) for _ in range(6)], 'sigs': [], 'refine': True},
+                },
+            },
+            'RP': {
+                'algorithm': 'LM',
+                'converged_ifdMM_lt': 1e-4,
+                'max_cycles': 10,
+                'SVD_zero_tolerance': 1e-6,
+                'upper_limit': 1e10,
+                'lower_limit': -1e10,
+                'constraints': {},
+                'restraints': {},
+                'rigid_bodies': {},
+            },
+            'Rval': {
+                'aborted': False,
+                'converged': rng.random() < 0.8,
+                'Rwp': rwp,
+                'GOF': rwp / rng.uniform(3, 6),
+                'chi2': rwp**2,
+                'message': None,
+                'SVD0': 0,
+                'SVDvars': [],
+                'maxlam': None,
+                'strongly_correlated_pairs': [],
+                'Nvar': 20,
+                'Nobs': 5000,
+                'Nvarholded': [],
+                'cycles': rng.randint(1, 10),
+            },
+        }
+
+    def add_study(
+            self,
+            study_name: str,
+            n_trials: Optional[int] = None,
+            n_startup_trials: int = 10,
+            random_seed: int = 0,
+            sequence: str = 'default',
+            status: str = 'COMPLETED',
+            tags: list[str] = [],
+    ) -> str:
+        '''Adds a study with n_trials trials and their refines. Returns the study id.'''
+        rng = self._rng
+        n_trials = self.n_trials if n_trials is None else n_trials
+        study_id = _oid(rng)
+        phase_names = self._phase_names()
+        start_at = self.start_at + timedelta(hours=len(self.studies))
+        trial_entries = []
+        best = None
+        for num in range(n_trials):
+            trial_id = _oid(rng)
+            refine_ids = [_oid(rng) for _ in range(self.n_refines)]
+            rwps = sorted((rng.uniform(3, 40) for _ in range(self.n_refines)), reverse=True)
+            for index, (refine_id, rwp) in enumerate(zip(refine_ids, rwps), start=1):
+                self.refines[refine_id] = self._refine_base(index, phase_names, rwp) | {
+                    '_id': refine_id,
+                    'parent_trial': _link('trial', trial_id),
+                    'group': _link('group', self.group_id),
+                    'start_at': (start_at + timedelta(seconds=num)).isoformat(),
+                    'time_to_complete': 1.5,
+                }
+            result_refine = self._refine_base(self.n_refines, phase_names, rwps[-1]) if rwps else None
+            self.trials[trial_id] = {
+                '_id': trial_id,
+                'parent_study': _link('study', study_id),
+                'group': _link('group', self.group_id),
+                'refines': [_link('refine', i) for i in refine_ids],
+                'result_refine': result_refine,
+                'trial_num': num,
+                'is_randomly_sampled': num < n_startup_trials,
+                'seed': rng.randrange(10000),
+                'start_at': (start_at + timedelta(seconds=num)).isoformat(),
+                'time_to_complete': 1.5 * self.n_refines,
+                'processed_by': 'mock',
+            }
+            trial_entries.append({'num': num, 'trial': _link('trial', trial_id)})
+            if result_refine is not None and (best is None or rwps[-1] < best[1]):
+                best = (num, rwps[-1], trial_id, result_refine['Rval']['GOF'])
+        self.studies[study_id] = {
+            '_id': study_id,
+            'status': status,
+            'trials': trial_entries,
+            'study_name': study_name,
+            'user': _link('user', self.user_id),
+            'group': _link('group', self.group_id),
+            'resumables': [],
+            'start_at': start_at.isoformat(),
+            'updated_at': start_at.isoformat(),
+            'n_trials_total': max(n_trials, 1),
+            'n_startup_trials': n_startup_trials,
+            'random_seed': random_seed,
+            'random_seed_fix': random_seed,
+            'sequence_version_fix': sequence,
+            'measurements': [{
+                'measurement_file': f'{study_name}.csv',
+                'instrument': {'name': 'mock'},
+                'type': 'PXC-DS',
+                'sample_form': 'powder',
+                'method': 'CW',
+                'geometry': 'Debye-Scherrer',
+                'beam': {'type': 'x-ray', 'structure': 'continuous', 'wave_lengths': [1.5406, 1.5444]},
+                'bank': 1,
+                'gonio_radius': 200.,
+            }],
+            'samples': [{'phases': [
+                {'name': name, 'space_group': 'F m -3 m', 'crystal_system': 'cubic'} for name in phase_names
+            ]}],
+            'path_in_obs': f'/mock/{study_id}',
+            'best_trials': [] if best is None else [{
+                'approach': 'lowestRwp',
+                'trial_num': best[0],
+                'trial': _link('trial', best[2]),
+                'Rwp': best[1],
+                'GOF': best[3],
+            }],
+            'tags': list(tags),
+        }
+        return study_id
+
+    def study_trials(self, study: dict) -> list[dict]:
+        return [self.trials[entry['trial']['id']] for entry in study['trials']]
+
+    def optunadf(self, study: dict) -> str:
+        '''The trials dataframe of the study as the server returns: a JSON string of the orient='columns' JSON.'''
+        trials = self.study_trials(study)
+        start = int(datetime.fromisoformat(study['start_at']).timestamp() * 1000)
+        columns = {
+            'number': {str(i): t['trial_num'] for i, t in enumerate(trials)},
+            'value': {str(i): get_value(t, 'result_refine.Rval.Rwp') for i, t in enumerate(trials)},
+            'datetime_start': {str(i): start + 1500 * i for i in range(len(trials))},
+            'datetime_complete': {str(i): start + 1500 * (i + 1) for i in range(len(trials))},
+            'duration': {str(i): 1500 for i in range(len(trials))},
+            'params_scale': {str(i): 0.5 + (t['seed'] % 100) / 100 for i, t in enumerate(trials)},
+            'state': {str(i): 'COMPLETE' for i in range(len(trials))},
+        }
+        return json.dumps(json.dumps(columns))
+
+
+class _Request:
+    def __init__(self, environ: dict):
+        self.method = environ['REQUEST_METHOD']
+        self.path = environ.get('PATH_INFO', '/')
+        self.query = parse_qs(environ.get('QUERY_STRING', ''))
+        self.headers = {
+            key[5:].replace('_', '-').lower(): value for key, value in environ.items() if key.startswith('HTTP_')
+        }
+        self.content_type = environ.get('CONTENT_TYPE', '')
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        self.body = environ['wsgi.input'].read(length) if length > 0 else b''
+
+    def param(self, name: str, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def json(self):
+        return json.loads(self.body) if self.body else {}
+
+    def form(self) -> tuple[dict[str, list[str]], list[tuple[str, str, bytes]]]:
+        '''Returns the form fields and the files (field name, filename, content).'''
+        if self.content_type.startswith('application/x-www-form-urlencoded'):
+            return parse_qs(self.body.decode()), []
+        if not self.content_type.startswith('multipart/form-data'):
+            return {}, []
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {self.content_type}\r\n\r\n'.encode() + self.body
+        )
+        fields: dict[str, list[str]] = {}
+        files = []
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            content = part.get_payload(decode=True) or b''
+            if filename is None:
+                fields.setdefault(name, []).append(content.decode())
+            else:
+                files.append((name, filename, content))
+        return fields, files
+
+
+class MockServer:
+    '''
+    WSGI application of the mock API server.
+
+    Args:
+        data: The synthetic documents.
+        latency: Seconds added to every response to simulate the network and the server.
+        token_ttl: Seconds until the tokens expire. The tokens are JWTs with the exp claim (not signed) if given,
+            and MOCK_TOKEN otherwise.
+        task_time: Seconds until a posted study is completed. Posted studies stay queuing if None.
+        group_queries: Whether the find endpoints count the documents for the group query parameter.
+            The parameter is ignored as by an older server if False.
+    '''
+    def __init__(
+            self,
+            data: Optional[MockData] = None,
+            latency: float = 0.,
+            token_ttl: Optional[float] = None,
+            task_time: Optional[float] = None,
+            group_queries: bool = True,
+    ):
+        self.data = data or MockData()
+        self.task_time = task_time
+        self.group_queries = group_queries
+        self._posted_at: dict[str, float] = {}  # study id -> time posted
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.n_requests = 0
+        self.n_logins = 0
+        self._tokens: dict[str, float] = {}  # token -> expiry
+        self._lock = threading.Lock()
+        self._routes: list[tuple[str, re.Pattern, Callable]] = [
+            ('POST', re.compile(r'/token'), self._token),
+            ('POST', re.compile(r'/user'), self._create_user),
+            ('GET', re.compile(r'/user/me'), self._me),
+            ('GET', re.compile(r'/file/(prm|cif|seq)'), self._list_files),
+            ('POST', re.compile(r'/file/(prm|cif|seq)'), self._upload_files),
+            ('DELETE', re.compile(r'/file/(prm|cif|seq)'), self._delete_files),
+            ('POST', re.compile(r'/task/study'), self._post_study),
+            ('GET', re.compile(r'/task/status'), self._task_status),
+            ('GET', re.compile(r'/study'), self._get_study),
+            ('DELETE', re.compile(r'/study'), self._delete_study),
+            ('POST', re.compile(r'/studies'), self._find('studies')),
+            ('GET', re.compile(r'/study/([^/]+)/optunadf'), self._optunadf),
+            ('GET', re.compile(r'/trial'), self._get('trials', 'trial_id')),
+            ('POST', re.compile(r'/trials'), self._find('trials')),
+            ('GET', re.compile(r'/refine'), self._get('refines', 'refine_id')),
+            ('POST', re.compile(r'/refines'), self._find('refines')),
+        ]
+
+    def __call__(self, environ: dict, start_response):
+        request = _Request(environ)
+        with self._lock:
+            self.n_requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        status, body = 404, {'detail': 'Not Found'}
+        for method, pattern, handler in self._routes:
+            matched = pattern.fullmatch(request.path)
+            if matched and method == request.method:
+                if handler not in (self._token, self._create_user) and not self._authorized(request):
+                    status, body = 401, {'detail': 'Not authenticated'}
+                else:
+                    with self._lock:
+                        status, body = handler(request, *matched.groups())
+                break
+            elif matched:
+                status, body = 405, {'detail': 'Method Not Allowed'}
+        content = body if isinstance(body, bytes) else json.dumps(body).encode()
+        headers = [('Content-Type', 'application/json')]
+        if request.method == 'GET' and status == 200:
+            # Conditional requests with ETag
+            etag = f'"{hashlib.sha1(content).hexdigest()}"'
+            headers.append(('ETag', etag))
+            if request.headers.get('if-none-match') == etag:
+                status, content = 304, b''
+        start_response(f'{status} {_REASONS.get(status, "")}', headers + [('Content-Length', str(len(content)))])
+        return [content]
+
+    def _authorized(self, request: _Request) -> bool:
+        authorization = request.headers.get('authorization', '')
+        if not authorization.startswith('Bearer '):
+            return False
+        with self._lock:
+            return self._tokens.get(authorization[len('Bearer '):], 0.) > time.time()
+
+    def expire_tokens(self):
+        '''Invalidates all the tokens issued, as if they expired.'''
+        with self._lock:
+            self._tokens.clear()
+
+    ### Accounts ###
+    def _token(self, request: _Request):
+        fields, _ = request.form()
+        if fields.get('username') == [MOCK_USERNAME] and fields.get('password') == [MOCK_PASSWORD]:
+            self.n_logins += 1
+            if self.token_ttl is None:
+                token, expiry = MOCK_TOKEN, math.inf
+            else:
+                expiry = time.time() + self.token_ttl
+                token = '.'.join(
+                    base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip('=')
+                    for part in ({'alg': 'none'}, {'sub': MOCK_USERNAME, 'exp': int(expiry), 'jti': self.n_logins})
+                ) + '.'
+            self._tokens[token] = expiry
+            return 200, {'access_token': token, 'token_type': 'bearer'}
+        return 401, {'detail': 'Incorrect username or password'}
+
+    def _create_user(self, request: _Request):
+        return 200, {'name': request.param('name')}
+
+    def _me(self, request: _Request):
+        return 200, self.data.user()
+
+    ### Files ###
+    def _list_files(self, request: _Request, kind: str):
+        return 200, self.data.files[kind]
+
+    def _upload_files(self, request: _Request, kind: str):
+        _, files = request.form()
+        names = [filename for _, filename, _ in files]
+        for name in names:
+            if name not in self.data.files[kind]:
+                self.data.files[kind].append(name)
+        return 200, {'uploaded': names}
+
+    def _delete_files(self, request: _Request, kind: str):
+        names = request.query.get('filenames', [])
+        self.data.files[kind] = [name for name in self.data.files[kind] if name not in names]
+        return 200, {'deleted': names}
+
+    ### Tasks ###
+    def _post_study(self, request: _Request):
+        fields, files = request.form()
+        study_name = fields.get('study_name', [''])[0]
+        if not study_name:
+            return 422, {'detail': 'study_name is required'}
+        study_id = self.data.add_study(
+            study_name,
+            n_trials = 0,
+            n_startup_trials = int(fields.get('n_startup_trials', ['10'])[0]),
+            random_seed = int(fields.get('random_seed', ['0'])[0]),
+            sequence = fields.get('sequence', ['default'])[0],
+            status = 'QUEUING',
+            tags = fields.get('tags', []),
+        )
+        self._posted_at[study_id] = time.monotonic()
+        return 202, {'study_id': study_id, 'study_name': study_name, 'n_files': len(files)}
+
+    def _complete_tasks(self):
+        if self.task_time is None:
+            return
+        now = time.monotonic()
+        for study_id, posted_at in list(self._posted_at.items()):
+            if now - posted_at >= self.task_time:
+                if study_id in self.data.studies:
+                    self.data.studies[study_id]['status'] = 'COMPLETED'
+                del self._posted_at[study_id]
+
+    def _task_status(self, request: _Request):
+        self._complete_tasks()
+        study_id = request.param('study_id')
+        queuing = [id for id, study in self.data.studies.items() if study['status'] == 'QUEUING']
+        if study_id is not None:
+            if study_id not in self.data.studies:
+                return 404, {'detail': 'Study not found'}
+            return 200, {'study_id': study_id, 'status': self.data.studies[study_id]['status']}
+        return 200, {'n_queuing': len(queuing), 'queuing': queuing}
+
+    ### Documents ###
+    def _get_study(self, request: _Request):
+        study = self.data.studies.get(request.param('study_id'))
+        if study is None:
+            return 404, {'detail': 'Study not found'}
+        return 200, study
+
+    def _delete_study(self, request: _Request):
+        study_name = request.param('study_name')
+        for id, study in list(self.data.studies.items()):
+            if study['study_name'] == study_name:
+                del self.data.studies[id]
+                return 200, {'deleted': study_name}
+        return 404, {'detail': 'Study not found'}
+
+    def _optunadf(self, request: _Request, study_name: str):
+        for study in self.data.studies.values():
+            if study['study_name'] == study_name:
+                return 200, self.data.optunadf(study).encode()
+        return 404, {'detail': 'Study not found'}
+
+    def _get(self, collection: str, id_param: str):
+        def handler(request: _Request):
+            document = getattr(self.data, collection).get(request.param(id_param))
+            if document is None:
+                return 404, {'detail': 'Not found'}
+            return 200, document
+        return handler
+
+    @staticmethod
+    def _group(documents: list[dict], group: dict) -> list[dict]:
+        '''Counts of the documents of each value of 'by' in the bins of 'boundaries' of the value at 'bucket'.'''
+        edges = group['boundaries']
+        by = group['by'].replace('.$id', '.id')
+        values: dict[str, list[float]] = {}
+        for document in documents:
+            value = get_value(document, group['bucket'])
+            if isinstance(value, (int, float)):
+                values.setdefault(get_value(document, by), []).append(value)
+        return [{'_id': key, 'counts': histogram(vs, edges)} for key, vs in values.items()]
+
+    def _find(self, collection: str):
+        '''Filter with the projection, sort, and limit query parameters as the server supports.'''
+        def handler(request: _Request):
+            query = request.json()
+            documents = [d for d in getattr(self.data, collection).values() if match(d, query)]
+            sort = request.param('sort')
+            if sort:
+                for path, order in reversed(json.loads(sort)):
+                    present = [d for d in documents if get_value(d, path) is not None]
+                    missing = [d for d in documents if get_value(d, path) is None]
+                    present.sort(key=lambda d: get_value(d, path), reverse=order < 0)
+                    documents = present + missing
+            limit = request.param('limit')
+            if limit is not None:
+                documents = documents[:int(limit)]
+            group = request.param('group')
+            if group and self.group_queries:
+                return 200, self._group(documents, json.loads(group))
+            projection = request.param('projection')
+            if projection:
+                documents = [project(d, list(json.loads(projection))) for d in documents]
+            return 200, documents
+        return handler
+
+
+_REASONS = {200: 'OK', 202: 'Accepted', 304: 'Not Modified', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed', 422: 'Unprocessable Entity'}
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def serve(
+        data: Optional[MockData] = None,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.,
+        token_ttl: Optional[float] = None,
+        task_time: Optional[float] = None,
+        group_queries: bool = True,
+) -> Iterator[str]:
+    '''
+    Runs the mock server in a background thread and yields its URL, which can be given to BBORClient as server.
+    A free port is chosen with port=0.
+    '''
+    app = MockServer(data, latency=latency, token_ttl=token_ttl, task_time=task_time, group_queries=group_queries)
+    httpd = make_server(host, port, app, server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://{host}:{httpd.server_port}'
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
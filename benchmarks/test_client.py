@@ -0,0 +1,173 @@
+import pytest
+from bbor_client import BBORClient
+from mockserver import MOCK_USERNAME, MOCK_PASSWORD
+
+# Benchmarks of the BBORClient methods against the local mock server.
+# Run with e.g. `pytest benchmarks --mock-trials 2000 --benchmark-group-by=func`.
+
+
+### Accounts ###
+def test_get_token(benchmark, mock_url):
+    client = BBORClient(server=mock_url)
+    benchmark(client.get_token, MOCK_USERNAME, MOCK_PASSWORD)
+    assert client.token is not None
+
+
+def test_create_user(benchmark, mock_url):
+    client = BBORClient(server=mock_url)
+    benchmark(client.create_user, MOCK_USERNAME, MOCK_PASSWORD, 'a'*24)
+
+
+def test_update_client_params(benchmark, client):
+    benchmark(client.update_client_params)
+
+
+### Files ###
+@pytest.mark.parametrize('kind', ['prm', 'cif', 'sequence'])
+def test_get_file_list(benchmark, client, kind):
+    method = {'prm': client.get_prm_list, 'cif': client.get_cif_list, 'sequence': client.get_sequence_list}[kind]
+    assert len(benchmark(method)) > 0
+
+
+def test_upload_prm(benchmark, client, input_files):
+    benchmark(client.upload_prm, input_files['prm'], overwrite=True)
+
+
+def test_upload_cif(benchmark, client, input_files):
+    benchmark(client.upload_cif, input_files['cif'], overwrite=True)
+
+
+def test_delete_prm(benchmark, client, input_files):
+    benchmark.pedantic(
+        client.delete_prm,
+        args = (input_files['prm'].name,),
+        setup = lambda: client.upload_prm(input_files['prm'], overwrite=True),
+        rounds = 20,
+    )
+
+
+def test_delete_cif(benchmark, client, input_files):
+    benchmark.pedantic(
+        client.delete_cif,
+        args = (input_files['cif'].name,),
+        setup = lambda: client.upload_cif(input_files['cif'], overwrite=True),
+        rounds = 20,
+    )
+
+
+### Tasks ###
+@pytest.mark.parametrize('encoding', ['csv', 'csv.gz', 'float32'])
+def test_post_bborietveld_study_task(benchmark, client, input_files, encoding):
+    client.measurement_encoding = encoding
+    try:
+        response = benchmark(
+            client.post_bborietveld_study_task,
+            study_name_base = 'bench',
+            measurementfile = input_files['measurement'],
+            prmfile = input_files['prm'],
+            ciffiles = input_files['cif'],
+            n_trials_total = 10,
+            n_startup_trials = 5,
+            random_seed = 0,
+            sequence = 'default',
+            deduplicate = False,
+            return_response = True,
+        )
+    finally:
+        client.measurement_encoding = 'csv'
+    assert response.status_code == 202
+
+
+def test_ask_task_queue_status(benchmark, client):
+    benchmark(client.ask_task_queue_status)
+
+
+### Studies ###
+def test_get_study(benchmark, client, study):
+    benchmark(client.get_study, study['_id'])
+
+
+def test_find_studies(benchmark, client):
+    assert len(benchmark(client.find_studies)) > 0
+
+
+def test_find_my_studies(benchmark, client):
+    assert len(benchmark(client.find_my_studies)) > 0
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'numpy', 'arrow'])
+def test_get_optuna_study(benchmark, client, study, backend):
+    if backend == 'pandas':
+        pytest.importorskip('pandas')
+    elif backend == 'arrow':
+        pytest.importorskip('pyarrow')
+    else:
+        pytest.importorskip('numpy')
+    benchmark(client.get_optuna_study, study['study_name'], backend=backend)
+
+
+def test_delete_study(benchmark, client):
+    names = iter(range(1000000))
+
+    def setup():
+        # A study to be deleted, added without uploading files
+        name = f'delete{next(names)}'
+        client._send_api(
+            endpoint = '/task/study',
+            method = 'post',
+            data = {'study_name': name},
+            authorization = True,
+        )
+        return (name,), {}
+
+    benchmark.pedantic(client.delete_study, setup=setup, rounds=20)
+
+
+### Trials ###
+def test_get_trial(benchmark, client, trial):
+    benchmark(client.get_trial, trial['_id'])
+
+
+@pytest.mark.parametrize('return_dict', [False, True], ids=['models', 'dicts'])
+def test_get_study_trials(benchmark, client, study, return_dict):
+    trials = benchmark(client.get_study_trials, study['_id'], return_dict=return_dict)
+    assert len(trials) == len(study['trials'])
+
+
+def test_get_study_trials_projected(benchmark, client, study):
+    benchmark(client.get_study_trials, study['_id'], fields=['trial_num', 'result_refine.Rval.Rwp'])
+
+
+def test_find_trials(benchmark, client, study):
+    query = {'parent_study.$id': study['_id'], 'result_refine.Rval.converged': True}
+    benchmark(client.find_trials, query)
+
+
+def test_get_best_trials(benchmark, client, study):
+    benchmark(client.get_best_trials, study['_id'])
+
+
+def test_top_trials(benchmark, client, study):
+    assert len(benchmark(client.top_trials, study['_id'], n=20)) > 0
+
+
+def test_rwp_distribution(benchmark, client):
+    study_ids = [study['_id'] for study in client.find_studies(return_dict=True)]
+    benchmark(client.rwp_distribution, study_ids, bins=50)
+
+
+### Refines ###
+def test_get_refine(benchmark, client, trial):
+    benchmark(client.get_refine, trial['refines'][0]['id'])
+
+
+def test_find_refines(benchmark, client, study):
+    trial_ids = [entry['trial']['id'] for entry in study['trials']]
+    benchmark(client.find_refines, {'parent_trial.$id': {'$in': trial_ids}})
+
+
+### Export ###
+@pytest.mark.parametrize('format', ['parquet', 'csv'])
+def test_export_study(benchmark, client, study, tmp_path, format):
+    pytest.importorskip('pyarrow')
+    benchmark(client.export_study, study['_id'], tmp_path, format=format)
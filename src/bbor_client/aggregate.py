@@ -0,0 +1,88 @@
+import heapq
+import math
+from bisect import bisect_right
+from typing import Iterable, Iterator, Optional
+from .query import get_value
+
+# Result keys of trials and their paths. Lower is better for all of them.
+TRIAL_KEYS = {
+    'Rwp': 'result_refine.Rval.Rwp',
+    'GOF': 'result_refine.Rval.GOF',
+}
+
+
+def key_path(key: str) -> str:
+    if key in TRIAL_KEYS:
+        return TRIAL_KEYS[key]
+    if '.' in key:
+        return key
+    raise ValueError(f'Unknown key "{key}". Choose from {tuple(TRIAL_KEYS)} or give a dotted path.')
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+        return None
+    return value
+
+
+def numbers(
+        documents: Iterable[dict],
+        path: str,
+) -> Iterator[float]:
+    '''Numbers at the path of the documents, skipping the others.'''
+    for document in documents:
+        value = _number(get_value(document, path))
+        if value is not None:
+            yield value
+
+
+def top_k(
+        documents: Iterable[dict],
+        n: int,
+        path: str,
+) -> list[dict]:
+    '''
+    Returns the n documents with the smallest values at the path, in ascending order.
+    The documents are consumed as a stream with a heap of size n. Documents without a number at the path are skipped.
+    '''
+    keyed = (
+        (value, i, document)
+        for i, document in enumerate(documents)
+        if (value := _number(get_value(document, path))) is not None
+    )
+    return [document for _, _, document in heapq.nsmallest(n, keyed)]
+
+
+def histogram_edges(
+        values: Iterable[float],
+        bins: int,
+        limits: Optional[tuple[float, float]] = None,
+) -> list[float]:
+    '''Equal-width bin edges over the limits, or over the min and max of the values.'''
+    if limits is None:
+        values = list(values)
+        limits = (min(values), max(values)) if values else (0., 1.)
+    low, high = limits
+    if high <= low:
+        low, high = low - 0.5, low + 0.5
+    width = (high - low) / bins
+    return [low + i*width for i in range(bins)] + [high]
+
+
+def histogram(
+        values: Iterable[float],
+        edges: list[float],
+        counts: Optional[list[int]] = None,
+) -> list[int]:
+    '''
+    Counts of the values in the bins, as numpy.histogram does: the last bin includes the right edge.
+    The values are added to counts if given, so that a stream of values can be counted in chunks.
+    '''
+    if counts is None:
+        counts = [0] * (len(edges) - 1)
+    for value in values:
+        if value < edges[0] or value > edges[-1]:
+            continue
+        i = min(bisect_right(edges, value) - 1, len(counts) - 1)
+        counts[i] += 1
+    return counts
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Optional, Literal, Union, Any
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+CassetteMode = Literal['record', 'replay']
+
+INDEX_NAME = 'index.json'
+BODY_DIR = 'bodies'
+FORMAT_VERSION = 1
+
+# Fields left out of the request keys, so that credentials are not stored even as hashes
+# and the recorded logins are replayed for any account
+CREDENTIAL_FIELDS = ('username', 'password', 'pwd', 'pwd2')
+
+# Fields of the response bodies replaced with REDACTED_TOKEN, so that the archives can be shared
+SECRET_FIELDS = ('access_token', 'refresh_token', 'id_token')
+# Replayed instead of the recorded tokens. Not a JWT, so it is never renewed for expiry.
+REDACTED_TOKEN = 'cassette-token'
+
+# Response headers kept in the archive. Authorization, cookies, and other headers are never stored.
+KEPT_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+def _files_key(files: Optional[list[tuple]]) -> list:
+    '''Only the field and file names of the uploads are used for matching.'''
+    keys = []
+    for field, file in files or []:
+        if isinstance(file, tuple):
+            keys.append([field, file[0]])
+        else:
+            keys.append([field, Path(getattr(file, 'name', '')).name])
+    return keys
+
+
+def _redact(value: Any) -> tuple[Any, bool]:
+    '''Replaces the values of SECRET_FIELDS in a decoded JSON body. Returns the value and whether anything was replaced.'''
+    if isinstance(value, dict):
+        redacted, changed = {}, False
+        for k, v in value.items():
+            if k in SECRET_FIELDS and isinstance(v, str):
+                redacted[k], changed = REDACTED_TOKEN, True
+            else:
+                redacted[k], c = _redact(v)
+                changed = changed or c
+        return redacted, changed
+    if isinstance(value, list):
+        items = [_redact(v) for v in value]
+        return [v for v, _ in items], any(c for _, c in items)
+    return value, False
+
+
+def redact_body(body: bytes) -> bytes:
+    '''The body with the tokens of SECRET_FIELDS replaced, or the body as is if it is not JSON or has no tokens.'''
+    try:
+        decoded = json.loads(body)
+    except ValueError:
+        return body
+    redacted, changed = _redact(decoded)
+    return json.dumps(redacted).encode() if changed else body
+
+
+def request_key(
+        method: str,
+        endpoint: str,
+        params: Optional[dict] = None,
+        data: Optional[dict] = None,
+        json_body: Optional[Union[dict, list]] = None,
+        files: Optional[list[tuple]] = None,
+) -> str:
+    '''A hash identifying a request by its method, endpoint, query parameters, and body.'''
+    data = {k: v for k, v in (data or {}).items() if k not in CREDENTIAL_FIELDS}
+    params = {k: v for k, v in (params or {}).items() if k not in CREDENTIAL_FIELDS}
+    canonical = json.dumps(
+        [method.upper(), endpoint, params, data, json_body, _files_key(files)],
+        sort_keys = True,
+        default = str,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class Cassette:
+    '''
+    Records responses of the API server into a compact archive and replays them.
+    Credentials are left out of the request keys and the tokens in the responses are redacted,
+    so a replayed login gives REDACTED_TOKEN.
+
+    The archive is a zip file of an index of the requests and the deflated response bodies,
+    deduplicated by their hashes. The same request recorded several times is replayed in the recorded order,
+    and the last response is repeated after that.
+
+    Args:
+        path: Path of the archive.
+        mode: 'record' to send the requests and record the responses, 'replay' to serve the recorded responses.
+        latency: Seconds to wait before a replayed response, which simulates the time to the first byte.
+        bandwidth: Bytes per second of the simulated transfer of replayed bodies. None for no limit.
+    '''
+    def __init__(
+            self,
+            path: Union[str, Path],
+            mode: CassetteMode = 'replay',
+            latency: float = 0.,
+            bandwidth: Optional[float] = None,
+    ):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown cassette mode "{mode}". Choose from "record" or "replay".')
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._entries: dict[str, list[dict]] = {}
+        self._bodies: dict[str, bytes] = {}
+        self._played: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._archive: Optional[zipfile.ZipFile] = None
+        if mode == 'replay':
+            self._archive = zipfile.ZipFile(self.path, 'r')
+            index = json.loads(self._archive.read(INDEX_NAME))
+            if index.get('version') != FORMAT_VERSION:
+                raise ValueError(f'Unsupported cassette version {index.get("version")}')
+            self._entries = index['entries']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(len(responses) for responses in self._entries.values())
+
+    def record(
+            self,
+            key: str,
+            method: str,
+            endpoint: str,
+            response: Response,
+    ):
+        body = redact_body(response.content)
+        digest = hashlib.sha256(body).hexdigest()
+        entry = {
+            'method': method.upper(),
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS},
+            'body': digest,
+            'elapsed': response.elapsed.total_seconds(),
+        }
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self._bodies.setdefault(digest, body)
+
+    def _body(self, digest: str) -> bytes:
+        with self._lock:
+            if digest not in self._bodies:
+                assert self._archive is not None
+                self._bodies[digest] = self._archive.read(f'{BODY_DIR}/{digest}')
+            return self._bodies[digest]
+
+    def play(
+            self,
+            key: str,
+            method: str,
+            endpoint: str,
+            url: str,
+    ) -> Response:
+        '''
+        Returns the recorded response to the request after the simulated latency.
+        The body is "transferred" by transfer().
+        '''
+        with self._lock:
+            responses = self._entries.get(key)
+            if not responses:
+                raise KeyError(f'No recorded response for {method.upper()} {endpoint} in {self.path}')
+            index = self._played.get(key, 0)
+            self._played[key] = index + 1
+            entry = responses[min(index, len(responses) - 1)]
+        if self.latency > 0:
+            time.sleep(self.latency)
+        response = Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.url = url
+        response.encoding = 'utf-8'
+        response._content = self._body(entry['body'])
+        return response
+
+    def transfer(self, response: Response):
+        '''Waits for the simulated transfer of the body.'''
+        if self.bandwidth:
+            time.sleep(len(response.content) / self.bandwidth)
+
+    def close(self):
+        if self.mode == 'record':
+            self.save()
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def save(self):
+        '''Writes the recorded responses to the archive.'''
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(INDEX_NAME, json.dumps({'version': FORMAT_VERSION, 'entries': self._entries}))
+                for digest, body in self._bodies.items():
+                    archive.writestr(f'{BODY_DIR}/{digest}', body)
@@ -0,0 +1,129 @@
+import threading
+import time
+from typing import Literal, Any
+import requests
+
+CircuitState = Literal['closed', 'open', 'half_open']
+
+# Consecutive failures opening the circuit of an endpoint group
+FAILURE_THRESHOLD = 5
+# Seconds the circuit stays open before probing the server
+RECOVERY_TIME = 30.
+# Requests let through at a time while probing
+HALF_OPEN_REQUESTS = 1
+
+# Endpoints sharing a circuit, by the first segment of the path
+GROUP_ALIASES = {
+    'studies': 'study',
+    'trials': 'trial',
+    'refines': 'refine',
+}
+
+
+def endpoint_group(endpoint: str) -> str:
+    '''The group of an endpoint, e.g. 'study' for /study, /studies, and /study/{study_name}/optunadf.'''
+    segment = endpoint.strip('/').split('/')[0]
+    return GROUP_ALIASES.get(segment, segment)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    '''Raised instead of sending a request while the circuit of its endpoint group is open.'''
+
+
+class _Circuit:
+    def __init__(self):
+        self.state: CircuitState = 'closed'
+        self.failures = 0
+        self.opened_at = 0.
+        self.probes = 0
+        self.opened = 0  # times opened
+        self.rejected = 0  # requests failed fast
+
+
+class CircuitBreaker:
+    '''
+    Fails fast while the API server is down, per endpoint group.
+
+    A circuit opens after failure_threshold consecutive failures (connection errors, timeouts, and 5xx responses)
+    and requests of the group raise CircuitOpenError without being sent.
+    Timeouts cut short by the deadline of the caller (deadline.deadline()) are not failures of the server.
+    After recovery_time seconds, half_open_requests requests are let through as probes:
+    the circuit closes if a probe succeeds and opens again if it fails.
+    '''
+    def __init__(
+            self,
+            failure_threshold: int = FAILURE_THRESHOLD,
+            recovery_time: float = RECOVERY_TIME,
+            half_open_requests: int = HALF_OPEN_REQUESTS,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_requests = half_open_requests
+        self._circuits: dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def _circuit(self, group: str) -> _Circuit:
+        if group not in self._circuits:
+            self._circuits[group] = _Circuit()
+        return self._circuits[group]
+
+    def state(self, group: str) -> CircuitState:
+        with self._lock:
+            return self._circuit(group).state
+
+    def before(self, group: str):
+        '''Called before sending a request. Raises CircuitOpenError if the request is not let through.'''
+        with self._lock:
+            circuit = self._circuit(group)
+            if circuit.state == 'open' and time.monotonic() - circuit.opened_at >= self.recovery_time:
+                circuit.state = 'half_open'
+                circuit.probes = 0
+            if circuit.state == 'half_open' and circuit.probes < self.half_open_requests:
+                circuit.probes += 1
+                return
+            if circuit.state != 'closed':
+                circuit.rejected += 1
+                retry_in = max(self.recovery_time - (time.monotonic() - circuit.opened_at), 0.)
+                raise CircuitOpenError(f'The server is unavailable for "{group}" requests. Retrying in {retry_in:.1f} s.')
+
+    def success(self, group: str):
+        with self._lock:
+            circuit = self._circuit(group)
+            circuit.state = 'closed'
+            circuit.failures = 0
+            circuit.probes = 0
+
+    def failure(self, group: str):
+        with self._lock:
+            circuit = self._circuit(group)
+            circuit.failures += 1
+            if circuit.state == 'half_open' or circuit.failures >= self.failure_threshold:
+                if circuit.state != 'open':
+                    circuit.opened += 1
+                circuit.state = 'open'
+                circuit.opened_at = time.monotonic()
+                circuit.probes = 0
+
+    def release(self, group: str):
+        '''Called when a request let through ended without a result from the server, e.g. by a local error.'''
+        with self._lock:
+            circuit = self._circuit(group)
+            if circuit.state == 'half_open' and circuit.probes > 0:
+                circuit.probes -= 1
+
+    def reset(self):
+        with self._lock:
+            self._circuits.clear()
+
+    def to_dict(self) -> dict[str, dict[str, Any]]:
+        '''{group: {'state', 'failures', 'opened', 'rejected'}}'''
+        with self._lock:
+            return {
+                group: {
+                    'state': circuit.state,
+                    'failures': circuit.failures,
+                    'opened': circuit.opened,
+                    'rejected': circuit.rejected,
+                }
+                for group, circuit in self._circuits.items()
+            }
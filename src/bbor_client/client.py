@@ -1,19 +1,121 @@
+import copy
+import io
 import json
+import math
+import re
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, time_ns
 from pydantic import FilePath
-from typing import Optional, Literal, Union
+from typing import Optional, Literal, Union, Callable, TYPE_CHECKING
 from pathlib import Path
 import requests
 from requests.models import Response
-import pandas as pd
-from io import StringIO
 from .params.post_study.client import PostStudyClientParams
 from .params.post_study.server import PostStudyServerParams
 from .models.user import UserResponse as User
 from .models.study import Study
+from .models.base import Link
 from .models.trial import Trial, Refine
-from .conf import VERIFY_CERT
+from .conf import VERIFY_CERT, CONNECT_TIMEOUT, READ_TIMEOUT
 from .util import api_url, require_token, validate_id
 from .parsers import selector
+from .parsers.interface import ParserInterface, map_file
+from .parsers.selector import SNIFF_BYTES
+from .parsers.encoding import MeasurementEncoding, CONTENT_TYPES
+from . import optunadf
+from .export import ExportFormat, TableWriter, flatten, table_path
+from .query import projection, project, get_value
+from .aggregate import key_path, numbers, top_k, histogram_edges, histogram
+from .metrics import RequestInfo, MetricsCollector, HookEvent, Hook, HOOK_EVENTS
+from .tracing import Tracer, Span, SpanExporter, traced
+from .transport import timed_session, take_connect_time
+from .cassette import Cassette, CassetteMode, request_key
+from .singleflight import SingleFlight, FlightTimeout
+from .httpcache import ConditionalCache, http_date
+from .tokencache import TokenCache
+from . import deadline
+from .deadline import Timeout, request_timeout
+from .circuit import CircuitBreaker, endpoint_group
+from .fingerprint import TAG_PREFIX, SubmissionIndex, buffer_digest, file_digest, study_fingerprint, fingerprint_tag
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+# Ids in endpoints, replaced in the route labels of the metrics
+ID_PATTERN = re.compile(r'(?<=/)[a-fA-F0-9]{24}(?=/|$)')
+
+# Endpoints of POST requests which only look up documents, coalesced like GET requests
+LOOKUP_ENDPOINTS = ('/studies', '/trials', '/refines')
+
+# Fields of the documents used as Last-Modified when the server sends no validators
+MODIFIED_FIELDS = {'/study': 'updated_at'}
+
+# Collection names of Links and the collections resolved by BBORClient.resolve
+LINK_COLLECTIONS = {
+    'study': 'studies',
+    'studies': 'studies',
+    'trial': 'trials',
+    'trials': 'trials',
+    'refine': 'refines',
+    'refines': 'refines',
+}
+
+
+@dataclass
+class PreparedStudy:
+    '''Arguments of post_bborietveld_study_task validated, with the measurement parsed and encoded.'''
+    params: PostStudyClientParams
+    m_parser: Optional[ParserInterface] = None
+    n_histograms: int = 1
+    fingerprints: list[Optional[str]] = field(default_factory=list)
+    existing: list[Optional[str]] = field(default_factory=list)  # ids of the studies already posted
+    find_existing: bool = False  # whether to look for the studies already posted
+    encoded: dict[int, tuple[str, bytes]] = field(default_factory=dict)  # scan index -> (encoding, content)
+
+
+class UploadedFiles:
+    '''
+    Files uploaded in a batch, shared by the threads uploading the files of its studies.
+
+    A file is recorded only after its upload succeeded, so a failed upload is tried again by the next study.
+    A thread uploading a file being uploaded by another thread waits for it and receives its outcome.
+    '''
+    def __init__(self):
+        self._done: set[tuple[str, bool]] = set()
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: tuple[str, bool]) -> bool:
+        with self._lock:
+            return key in self._done
+
+    def upload(
+            self,
+            key: tuple[str, bool],
+            func: Callable[[], bool],
+    ) -> bool:
+        '''Calls func to upload the file of key (path, overwrite) unless it is uploaded. func returns whether it succeeded.'''
+        if key in self:
+            return True
+        ok, _ = self._flights.do(key, lambda: self._upload(key, func))
+        return ok
+
+    def _upload(
+            self,
+            key: tuple[str, bool],
+            func: Callable[[], bool],
+    ) -> bool:
+        # Uploaded by a flight which finished before this one started
+        if key in self:
+            return True
+        ok = func()
+        if ok:
+            with self._lock:
+                self._done.add(key)
+        return ok
 
 
 class BBORClient:
@@ -21,21 +123,61 @@ class BBORClient:
             self,
             username: Optional[str] = None,
             password: Optional[str] = None,
-            server: Literal['mdx', 'local', 'docker', 'dev'] = 'mdx',
+            server: Union[Literal['mdx', 'local', 'docker', 'dev'], str] = 'mdx',
+            measurement_encoding: MeasurementEncoding = 'csv',
+            token_cache: Union[bool, str, Path, TokenCache, None] = None,
+            timeout: Timeout = (CONNECT_TIMEOUT, READ_TIMEOUT),
             _dp = None,
     ):
+        '''
+        Args:
+            timeout: (connect, read) timeouts of the requests in seconds, or one value for both.
+                Overridden in a block by deadline.timeouts() and cut by deadline.deadline().
+            token_cache: True, a file path, or a TokenCache to reuse the tokens of other clients and processes
+                from the file (~/.cache/bbor_client/tokens.json with True) instead of logging in every time.
+        '''
         # Initialization
         self.server = server
         self._dp = _dp
+        self.measurement_encoding: MeasurementEncoding = measurement_encoding
+        self.timeout = timeout
         self.history: list = []
+        # Fingerprints of the posted studies, looked up before the tags on the server. See post_bborietveld_study_task
+        self.submission_index: Optional[SubmissionIndex] = None
+        self.hooks: dict[str, list[Hook]] = {event: [] for event in HOOK_EVENTS}
+        self.metrics = MetricsCollector()
+        # Fails fast while the server is down. None to disable
+        self.circuit_breaker: Optional[CircuitBreaker] = CircuitBreaker()
+        self.metrics.circuit_breaker = self.circuit_breaker
+        self.tracer = Tracer()
+        self._session = timed_session()
+        self.cassette: Optional[Cassette] = None
+        # Concurrent identical lookups share one request
+        self.coalesce = True
+        self._flights = SingleFlight()
+        # GET requests are sent with the validators of the last responses and 304 is served from the cache
+        self.conditional = True
+        self.conditional_cache = ConditionalCache()
         self.prmlist = []
         self.ciflist = []
         self.seqlist = []
+        # Guards token, me, history, and the file lists shared by the threads using this client
+        self._lock = threading.RLock()
+        if token_cache is True:
+            token_cache = TokenCache()
+        elif isinstance(token_cache, (str, Path)):
+            token_cache = TokenCache(token_cache)
+        self.token_cache: Optional[TokenCache] = token_cache or None
+        # Kept to log in again when the token is rejected
+        self._credentials: Optional[tuple[str, str]] = None
+        self.token = None
 
 
         if username is not None and password is not None:
-            self.get_token(username, password)
-        elif username is not None and password is not None:
+            self._credentials = (username, password)
+            if not self._load_cached_token(username):
+                self.get_token(username, password)
+        elif username is not None or password is not None:
             print('Both username and password are required for token generation')
             print('Token is not generated')
             self.token = None
@@ -52,27 +194,295 @@ class BBORClient:
             files: Optional[list[tuple]] = None,
             header: Optional[dict] = None,
             authorization: bool = False,
+            route: Optional[str] = None,
     ) -> Response:
+        '''
+        Sends a request to the API server.
+
+        route is the label of the endpoint in the metrics, e.g. '/study/{study_name}/optunadf'.
+        Ids in the endpoint are replaced with {id} by default.
+
+        With self.coalesce, identical GET and lookup requests (same endpoint, parameters, and token)
+        sent concurrently from several threads are sent once and all the callers receive the same response.
+        With self.conditional, GET requests are conditional on the ETag or Last-Modified of the last response,
+        and 304 Not Modified is returned as the cached response with the status code 200.
+        When the server rejects the token with 401, the client logs in again and resends the request once.
+        '''
         if not endpoint.startswith('/'):
             endpoint = '/' + endpoint
         url = api_url(self.server, self._dp) + endpoint
+        token = None
         if authorization:
-            if self.token is None:
+            token = self.token
+            if token is None:
                 raise ValueError('Token is empty')
-            if header:
-                header.update({'Authorization': f'Bearer {self.token}'})
+        route = route or ID_PATTERN.sub('{id}', endpoint)
+        if method not in ('get', 'post', 'delete', 'put'):
+            raise ValueError(f'Unsupported method "{method}"')
+
+        def send(token: Optional[str]) -> Response:
+            headers = header
+            if token is not None:
+                headers = (header or {}) | {'Authorization': f'Bearer {token}'}
+            if self.coalesce and not files and (method == 'get' or (method == 'post' and endpoint in LOOKUP_ENDPOINTS)):
+                key = (url, token, request_key(method, endpoint, params, data, json))
+                try:
+                    response, shared = self._flights.do(
+                        key,
+                        lambda: self._request(endpoint, url, method, route, params, data, json, files, headers),
+                        timeout = deadline.remaining(),
+                    )
+                except FlightTimeout:
+                    raise deadline.DeadlineExceeded(f'Deadline exceeded while waiting for {method.upper()} {route} in flight') from None
+                if shared:
+                    self.metrics.record_coalesced(method.upper(), route)
+                    # A response of its own, so that the content decoded by this caller is not shared with the others
+                    response = self._copy_response(response)
+                return response
+            return self._request(endpoint, url, method, route, params, data, json, files, headers)
+
+        response = send(token)
+        if response.status_code == 401 and token is not None and self._reauthenticate(token):
+            for _, file in files or []:
+                content = file[1] if isinstance(file, tuple) else file
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+            response = send(self.token)
+        return response
+
+    def _request(
+            self,
+            endpoint: str,
+            url: str,
+            method: str,
+            route: str,
+            params: Optional[dict],
+            data: Optional[dict],
+            json: Optional[dict],
+            files: Optional[list[tuple]],
+            header: Optional[dict],
+    ) -> Response:
+        '''Sends a request, or replays it from the cassette, with the hooks, metrics, and timings.'''
+        info = RequestInfo(
+            method = method.upper(),
+            endpoint = endpoint,
+            route = route,
+            url = url,
+        )
+        self.tracer.add_request(info)
+        for hook in self.hooks['before_request']:
+            hook(info)
+        cassette = self.cassette
+        if cassette is not None:
+            key = request_key(method, endpoint, params, data, json, files)
+        cached = None
+        if self.conditional and cassette is None and method == 'get':
+            cache_key = (url, (header or {}).get('Authorization'), request_key(method, endpoint, params))
+            cached = self.conditional_cache.get(cache_key)
+            if cached is not None:
+                header = (header or {}) | cached.conditions()
+        breaker = self.circuit_breaker
+        group = endpoint_group(endpoint)
+        let_through = False
+        timeout = request_timeout(self.timeout)
+        # A timeout is not a failure of the server if the deadline of the caller cut it short
+        cut_by_deadline = timeout != request_timeout(self.timeout, cut=False)
+        take_connect_time()
+        info.start_ns = time_ns()
+        start = perf_counter()
+        try:
+            deadline.check(f'{method.upper()} {endpoint}')
+            if breaker is not None:
+                breaker.before(group)
+                let_through = True
+            if cassette is not None and cassette.mode == 'replay':
+                response = cassette.play(key, method, endpoint, url)
+                headers_at = perf_counter()
+                cassette.transfer(response)
+            else:
+                # Streamed to separate the time to the response headers from the transfer of the body
+                response = self._session.request(
+                    method.upper(),
+                    url,
+                    params = params,
+                    data = data if method!='get' else None,
+                    json = json if method=='post' else None,
+                    files = files,
+                    headers = header,
+                    verify = VERIFY_CERT,
+                    timeout = timeout,
+                    stream = True,
+                )
+                headers_at = perf_counter()
+                _ = response.content
+        except Exception as e:
+            if let_through:
+                if isinstance(e, requests.RequestException) and not (cut_by_deadline and isinstance(e, requests.Timeout)):
+                    breaker.failure(group) # type: ignore
+                else:
+                    breaker.release(group) # type: ignore
+            info.timings['request'] = perf_counter() - start
+            info.error = e
+            self.metrics.record_request(info)
+            for hook in self.hooks['on_error']:
+                hook(info, e)
+            raise
+        end = perf_counter()
+        if breaker is not None:
+            if response.status_code >= 500:
+                breaker.failure(group)
             else:
-                header = {'Authorization': f'Bearer {self.token}'}
-        if method=='get':
-            response = requests.get(url, params=params, files=files, headers=header, verify=VERIFY_CERT)
-        elif method=='post':
-            response = requests.post(url, params=params, data=data, json=json, files=files, headers=header, verify=VERIFY_CERT)
-        elif method=='delete':
-            response = requests.delete(url, data=data, params=params, files=files, headers=header, verify=VERIFY_CERT)
-        elif method=='put':
-            response = requests.put(url, data=data, params=params, files=files, headers=header, verify=VERIFY_CERT)
+                breaker.success(group)
+        connect = take_connect_time()
+        info.timings |= {
+            'request': end - start,
+            'connect': connect,
+            'ttfb': headers_at - start - connect,
+            'transfer': end - headers_at,
+        }
+        info.phase_starts |= {
+            'connect': info.start_ns,
+            'ttfb': info.start_ns + int(connect * 1e9),
+            'transfer': info.start_ns + int((headers_at - start) * 1e9),
+        }
+        if cassette is not None and cassette.mode == 'record':
+            cassette.record(key, method, endpoint, response)
+        info.status_code = response.status_code
+        info.bytes_in = len(response.content)
+        info.bytes_out = len(response.request.body or b'') if response.request is not None else 0
+        response.request_info = info # type: ignore
+        self.metrics.record_request(info)
+        for hook in self.hooks['after_response']:
+            hook(info, response)
+        if response.status_code >= 400:
+            error = requests.HTTPError(f'{response.status_code} for {method.upper()} {endpoint}', response=response)
+            for hook in self.hooks['on_error']:
+                hook(info, error)
+        if self.conditional and cassette is None and method == 'get':
+            if response.status_code == 304 and cached is not None:
+                response = self.conditional_cache.hit(cached)
+                response.request_info = info # type: ignore
+            elif response.status_code == 200:
+                self.conditional_cache.store(cache_key, response, self._last_modified(endpoint, response))
         return response
 
+    def _last_modified(self, endpoint: str, response: Response) -> Optional[str]:
+        '''Last-Modified from the document, e.g. Study.updated_at, when the server sends no validators.'''
+        field = MODIFIED_FIELDS.get(endpoint)
+        if field is None or 'ETag' in response.headers or 'Last-Modified' in response.headers:
+            return None
+        try:
+            value = self._decode(response).get(field)
+            return http_date(value) if value else None
+        except ValueError:
+            return None
+
+    @contextmanager
+    def use_cassette(
+            self,
+            path: Union[str, Path],
+            mode: CassetteMode = 'replay',
+            latency: float = 0.,
+            bandwidth: Optional[float] = None,
+    ):
+        '''
+        Records the responses of the server into an archive, or replays them without the server.
+
+        In the replay mode, latency (seconds) and bandwidth (bytes per second) simulate the network,
+        so that the decoding, validation, and analyses can be profiled deterministically offline.
+        The archive is written when the block exits in the record mode.
+        '''
+        cassette = Cassette(path, mode=mode, latency=latency, bandwidth=bandwidth)
+        previous, self.cassette = self.cassette, cassette
+        try:
+            yield cassette
+        finally:
+            self.cassette = previous
+            cassette.close()
+
+    ### Instrumentation ###
+    def add_hook(
+            self,
+            event: HookEvent,
+            hook: Hook,
+    ):
+        '''
+        Adds a hook called on every API request.
+
+        before_request(info) is called before sending,
+        after_response(info, response) after receiving a response,
+        and on_error(info, error) when the request raises an exception or the status code is 400 or larger.
+        info is a RequestInfo with the route, status code, bytes, and timings of the request.
+        '''
+        if event not in HOOK_EVENTS:
+            raise ValueError(f'Unknown hook event "{event}". Choose from {HOOK_EVENTS}.')
+        self.hooks[event].append(hook)
+
+    def remove_hook(
+            self,
+            event: HookEvent,
+            hook: Hook,
+    ):
+        self.hooks[event].remove(hook)
+
+    def add_span_exporter(
+            self,
+            exporter: SpanExporter,
+    ):
+        '''
+        Adds an exporter of the spans of get_*/find_* calls,
+        e.g. tracing.OTLPJsonExporter for an OpenTelemetry collector or tracing.JsonlSpanExporter for a file.
+        The spans are exported in batches from a background thread. tracer.flush() waits for the queued spans.
+        '''
+        self.tracer.exporters.append(exporter)
+
+    @property
+    def last_trace(self) -> Optional[Span]:
+        '''
+        The span of the last get_*/find_* call of this thread with its HTTP requests.
+        span.timings() gives the seconds of connect, ttfb, transfer, decode, and validate.
+        '''
+        return self.tracer.last
+
+    def _record_phase(self, response: Response, phase: str, seconds: float):
+        info: Optional[RequestInfo] = getattr(response, 'request_info', None)
+        if info is None:
+            return
+        info.phase_starts.setdefault(phase, time_ns() - int(seconds * 1e9))
+        info.timings[phase] = info.timings.get(phase, 0.) + seconds
+        self.metrics.record_phase(info, phase, seconds)
+
+    @staticmethod
+    def _copy_response(response: Response) -> Response:
+        '''A copy of a response without its decoded content, for a caller of a coalesced request.'''
+        clone = copy.copy(response)
+        clone.request_info = getattr(response, 'request_info', None) # type: ignore
+        return clone
+
+    def _decode(self, response: Response):
+        '''
+        response.json() timed as the decode phase of the request.
+        The content is decoded once per response. Each caller of a coalesced request has its own response.
+        '''
+        content = getattr(response, 'decoded', None)
+        if content is not None:
+            return content
+        start = perf_counter()
+        content = response.json()
+        self._record_phase(response, 'decode', perf_counter() - start)
+        response.decoded = content # type: ignore
+        return content
+
+    def _validate(self, response: Response, model, content):
+        '''Validates a document or a list of documents, timed as the validate phase of the request.'''
+        start = perf_counter()
+        if isinstance(content, list):
+            validated = [model.model_validate(document) for document in content]
+        else:
+            validated = model.model_validate(content)
+        self._record_phase(response, 'validate', perf_counter() - start)
+        return validated
+
     ### Update instance parameters ###
     @require_token
     def _get_me(
@@ -86,14 +496,17 @@ class BBORClient:
             authorization = True,
         )
         if response.status_code == 200:
-            self.me = User.model_validate(response.json())
+            me = self._validate(response, User, self._decode(response))
+            with self._lock:
+                self.me = me
             if return_dict:
-                return response.json()
+                return self._decode(response)
             else:
-                return User.model_validate(response.json())
+                return self._validate(response, User, self._decode(response))
         else:
             print('Request failed', response.content)
-            self.me = None
+            with self._lock:
+                self.me = None
             if return_response:
                 return response
 
@@ -116,15 +529,12 @@ class BBORClient:
             _ = self.get_sequence_list()
 
     ### Accont managements ###
-    def get_token(
+    def _login(
         self,
         username: str,
         password: str,
-        return_response: bool = False,
-    ) -> Optional[Response]:
-        '''
-        Get a token from the server. Also, get me, prmlist, ciflist.
-        '''
+    ) -> Response:
+        '''Sends the credentials to /token, and keeps and caches the token received.'''
         response = self._send_api(
             endpoint = '/token',
             method = 'post',
@@ -134,11 +544,88 @@ class BBORClient:
             },
         )
         if response.status_code == 200:
-            self.token = response.json()['access_token']
+            token = self._decode(response)['access_token']
+            with self._lock:
+                self.token = token
+                self._credentials = (username, password)
+            if self.token_cache is not None:
+                self.token_cache.save(api_url(self.server, self._dp), username, token)
+        return response
+
+    def _load_cached_token(
+        self,
+        username: str,
+    ) -> bool:
+        '''Uses a valid token of the token cache. Returns whether a token was found.'''
+        if self.token_cache is None:
+            return False
+        token = self.token_cache.load(api_url(self.server, self._dp), username)
+        if token is None:
+            return False
+        with self._lock:
+            self.token = token
+        print('Token loaded from the cache')
+        self.update_client_params()
+        return True
+
+    def _reauthenticate(
+        self,
+        rejected_token: str,
+    ) -> bool:
+        '''
+        Logs in again after the server rejected a token with 401. Returns whether the token was renewed.
+        Concurrent requests rejected with the same token wait for a single login,
+        and a token renewed by another process is taken from the token cache.
+        '''
+        if self._credentials is None:
+            return False
+        renewed, _ = self._flights.do(('token', rejected_token), lambda: self._renew_token(rejected_token))
+        return renewed
+
+    def _renew_token(
+        self,
+        rejected_token: str,
+    ) -> bool:
+        with self._lock:
+            if self.token != rejected_token:
+                # Renewed by another thread in the meantime
+                return self.token is not None
+            username, password = self._credentials # type: ignore
+        server_url = api_url(self.server, self._dp)
+        with self.token_cache.locked() if self.token_cache is not None else nullcontext():
+            if self.token_cache is not None:
+                self.token_cache.discard(server_url, username, rejected_token)
+                token = self.token_cache.load(server_url, username)
+                if token is not None:
+                    with self._lock:
+                        self.token = token
+                    return True
+            response = self._login(username, password)
+        if response.status_code == 200:
+            print('Token renewed')
+            return True
+        print('Failed in renewing the token')
+        print(f'{response.status_code}: {response.content.decode()}')
+        return False
+
+    def get_token(
+        self,
+        username: str,
+        password: str,
+        return_response: bool = False,
+    ) -> Optional[Response]:
+        '''
+        Get a token from the server. Also, get me, prmlist, ciflist.
+        The token is saved to the token cache if the client has one,
+        and the credentials are kept to log in again when the token expires.
+        '''
+        response = self._login(username, password)
+        if response.status_code == 200:
             print('Token received successfully')
             self.update_client_params()
         else:
-            self.token = None
+            with self._lock:
+                self.token = None
             print('Failed in getting a token')
             print(f'{response.status_code}: {response.content.decode()}')
         if return_response:
@@ -173,6 +660,7 @@ class BBORClient:
 
     ### Instrprm files ###
     @require_token
+    @traced
     def get_prm_list(
         self,
         return_response: bool = False,
@@ -183,10 +671,11 @@ class BBORClient:
             authorization = True,
         )
         if response.status_code==200:
-            self.prmlist = json.loads(response.content)
-            PostStudyServerParams.prm_file_list = self.prmlist
+            prmlist = json.loads(response.content)
+            with self._lock:
+                self.prmlist = prmlist
             print('prmlist updated')
-            return self.prmlist
+            return prmlist
         else:
             if return_response:
                 return response
@@ -246,6 +735,7 @@ class BBORClient:
 
     ### CIF files ###
     @require_token
+    @traced
     def get_cif_list(
         self,
         return_response: bool = False,
@@ -256,10 +746,11 @@ class BBORClient:
             authorization = True,
         )
         if response.status_code==200:
-            self.ciflist = json.loads(response.content)
-            PostStudyServerParams.cif_file_list = self.ciflist
+            ciflist = json.loads(response.content)
+            with self._lock:
+                self.ciflist = ciflist
             print('ciflist updated')
-            return self.ciflist
+            return ciflist
         else:
             if return_response:
                 return response
@@ -320,6 +811,7 @@ class BBORClient:
 
     ### Sequence files ###
     @require_token
+    @traced
     def get_sequence_list(
         self,
         return_response: bool = False,
@@ -330,10 +822,11 @@ class BBORClient:
             authorization = True,
         )
         if response.status_code==200:
-            self.seqlist = json.loads(response.content)
+            seqlist = json.loads(response.content)
+            with self._lock:
+                self.seqlist = seqlist
             print('seqlist updated')
-            PostStudyServerParams.sequence_list = self.seqlist
-            return json.loads(response.content)
+            return seqlist
         else:
             if return_response:
                 return response
@@ -393,37 +886,90 @@ class BBORClient:
 
 
     ### BBO-Rietveld ###
-    @require_token
-    def _post_study_task(
+    def _parse_measurement(
         self,
         **kwargs,
-    ) -> Response:
-        ''' Used internally from client and from the web app'''
-        # Parse the measurement file if provided
+    ) -> Optional[ParserInterface]:
+        '''Parses the measurement file given either as a path or as a pair of filename and content'''
+        return self._read_measurement(**kwargs)[0]
+
+    def _read_measurement(
+        self,
+        digest: bool = False,
+        **kwargs,
+    ) -> tuple[Optional[ParserInterface], Optional[str]]:
+        '''
+        Parses the measurement file as _parse_measurement, and with digest=True also returns SHA-256 of
+        the content of the measurement file given as a path (None otherwise).
+        '''
         if kwargs.get('gpxfile'):
-            m_parser = None
+            return None, None
         elif kwargs.get('measurementfile'):
-            parser = selector(
-                filename = kwargs['measurementfile'].name,
-            )
-            m_parser = parser(filepath=kwargs['measurementfile'])
+            # The file is read only once through the memory map for sniffing, parsing, and hashing
+            with map_file(kwargs['measurementfile']) as buffer:
+                parser = selector(
+                    filename = kwargs['measurementfile'].name,
+                    head = buffer[:SNIFF_BYTES],
+                )
+                m_parser = parser(
+                    filename = kwargs['measurementfile'].name,
+                    filecontent = buffer,
+                )
+                return m_parser, buffer_digest(buffer) if digest else None
         elif kwargs.get('measurement_filename') and kwargs.get('measurement_filecontent'):
             parser = selector(
                 filename = kwargs['measurement_filename'],
+                head = kwargs['measurement_filecontent'][:SNIFF_BYTES],
             )
             m_parser = parser(
                 filename=kwargs['measurement_filename'],
                 filecontent = kwargs['measurement_filecontent'],
             )
+            return m_parser, None
         else:
-            m_parser = None
+            return None, None
+
+    def _validation_context(self) -> dict[str, list[str]]:
+        '''Snapshot of the file lists of this client, passed to PostStudyServerParams as the validation context.'''
+        with self._lock:
+            return dict(
+                prm_file_list = list(self.prmlist),
+                cif_file_list = list(self.ciflist),
+                sequence_list = list(self.seqlist),
+            )
 
-        # Validate the arguments with Server Parameter model
+    @require_token
+    def _post_study_task(
+        self,
+        m_parser: Optional[ParserInterface] = None,
+        histogram_index: int = 0,
+        encoded: Optional[tuple[str, bytes]] = None,
+        **kwargs,
+    ) -> Response:
+        '''
+        Used internally from client and from the web app
+
+        An already parsed measurement can be passed as m_parser to avoid parsing the file again,
+        and histogram_index chooses the scan to be analyzed in a multi-scan measurement file.
+        encoded is (encoding, content) of the scan already encoded, used if the encoding is still the client's.
+        '''
+        # Parse the measurement file if provided
+        if m_parser is None:
+            m_parser = self._parse_measurement(**kwargs)
+        encoding = self.measurement_encoding
+        if encoded is not None and encoded[0] == encoding:
+            filecontent = io.BufferedReader(io.BytesIO(encoded[1]))
+        else:
+            filecontent = m_parser._to_upload_bytesio(histogram_index, encoding) if m_parser else None
+
+        # Validate the arguments with Server Parameter model against the file lists of this client
         server_side_arg_model = PostStudyServerParams.model_validate(
             kwargs | dict( #Overwrite the following keys in kwargs
-                measurement_filecontent = m_parser._to_csv_bytesio() if m_parser else None,
-                measurement_filename = m_parser.csvname if m_parser else None,
-            )
+                measurement_filecontent = filecontent,
+                measurement_filename = m_parser.upload_filename(histogram_index, encoding) if m_parser else None,
+                measurement_encoding = encoding if m_parser and encoding != 'csv' else None,
+            ),
+            context = self._validation_context(),
         )
 
         # From Server Parameter model to request parameters
@@ -432,7 +978,7 @@ class BBORClient:
         files = []
         if s.measurement_filecontent:
             files.append(
-                ('files', (s.measurement_filename, s.measurement_filecontent))
+                ('files', (s.measurement_filename, s.measurement_filecontent, CONTENT_TYPES[encoding]))
             )
 
         response = self._send_api(
@@ -442,43 +988,242 @@ class BBORClient:
             files = files,
             authorization = True,
         )
+
+        # Fall back to plain CSV if the server does not accept the compact encoding
+        if s.measurement_encoding is not None and self._rejects_encoding(response):
+            print(f'The server does not accept the measurement encoding "{encoding}". Falling back to "csv".')
+            with self._lock:
+                self.measurement_encoding = 'csv'
+            return self._post_study_task(
+                m_parser = m_parser,
+                histogram_index = histogram_index,
+                **kwargs,
+            )
+        return response
+
+    @staticmethod
+    def _rejects_encoding(
+        response: Response,
+    ) -> bool:
+        '''
+        Whether a response to /task/study rejects the measurement encoding: 415,
+        or 422 whose detail is about the encoding or the content type, not about other parameters.
+        '''
+        if response.status_code == 415:
+            return True
+        if response.status_code != 422:
+            return False
+        detail = response.content.decode(errors='replace').lower()
+        return any(word in detail for word in ('measurement_encoding', 'encoding', 'content type', 'content-type', 'media type'))
+
+    def _study_fingerprints(
+        self,
+        c: PostStudyClientParams,
+        n_histograms: int,
+        measurement: Optional[str],
+    ) -> list[Optional[str]]:
+        '''
+        Fingerprints of the inputs of the study of each scan,
+        given SHA-256 of the measurement file. None without a measurement file.
+        '''
+        if measurement is None:
+            return [None] * n_histograms
+        prm = file_digest(c.prmfile) if c.prmfile else c.prm_filename
+        cifs = [file_digest(file) for file in c.ciffiles] if c.ciffiles else c.cif_filenames
+        return [
+            study_fingerprint(
+                measurement = measurement,
+                histogram_index = index,
+                prm = prm,
+                cifs = cifs,
+                sequence = c.sequence,
+                n_trials_total = c.n_trials_total,
+                n_startup_trials = c.n_startup_trials,
+                random_seed = c.random_seed,
+            )
+            for index in range(n_histograms)
+        ]
+
+    def _find_posted_studies(
+        self,
+        fingerprints: list[Optional[str]],
+    ) -> list[Optional[str]]:
+        '''
+        Ids of your studies posted with the same fingerprints (None if not posted),
+        found by the fingerprint tags and the ids of the submission index in one query.
+        '''
+        wanted = [fp for fp in fingerprints if fp is not None]
+        if len(wanted) == 0:
+            return [None] * len(fingerprints)
+        indexed = {}
+        if self.submission_index is not None:
+            indexed = {fp: study_id for fp in wanted if (study_id := self.submission_index.get(fp)) is not None}
+        query: dict = {'tags': {'$in': [fingerprint_tag(fp) for fp in wanted]}}
+        if indexed:
+            query = {'$or': [query, {'_id': {'$in': sorted(set(indexed.values()))}}]}
+        studies = self.find_studies(query, scope='account', fields=['_id', 'tags'])
+        if studies is None:
+            return [None] * len(fingerprints)
+        found: dict[str, str] = {}
+        ids = set()
+        for study in studies:
+            ids.add(study['_id']) # type: ignore
+            for tag in study.get('tags') or []: # type: ignore
+                if tag.startswith(TAG_PREFIX):
+                    found.setdefault(tag[len(TAG_PREFIX):], study['_id']) # type: ignore
+        for fp, study_id in indexed.items():
+            if study_id in ids:
+                found[fp] = study_id
+            else:
+                # Deleted from the server
+                self.submission_index.discard(fp) # type: ignore
+        return [found.get(fp) if fp is not None else None for fp in fingerprints]
+
+    @staticmethod
+    def _existing_study_response(
+        study_id: str,
+        study_name: str,
+    ) -> Response:
+        '''Response returned instead of posting a study already posted, with the status code 200.'''
+        response = Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response._content = json.dumps({'study_id': study_id, 'study_name': study_name, 'existing': True}).encode()
         return response
 
     @require_token
     def post_bborietveld_study_task(
         self,
         return_response: bool = False,
+        deduplicate: bool = True,
         **kwargs,
-    ) -> Optional[Response]:
-        '''Used from client'''
+    ) -> Union[Response, list[Response], None]:
+        '''
+        Used from client
+
+        When the measurement file contains multiple scans (e.g. time-resolved XRDML),
+        a study is posted for each scan with the study name suffixed by the scan index, e.g. study_name_scan002.
+        The PRM and CIF files are uploaded only once, and the measurement file is parsed only once.
+        A list of responses is returned with return_response=True in that case.
+
+        With deduplicate=True, the studies are tagged with a fingerprint of the measurement, PRM and CIF files
+        (their contents, or names of the files on the server), sequence, n_trials_total, n_startup_trials,
+        and random_seed. A study of the same fingerprint already posted is not posted again, and
+        a response of the status code 200 with {'study_id', 'study_name', 'existing': True} is returned instead.
+        Specify random_seed for the fingerprint to match, as it is random by default:
+        without it, the fingerprints are not computed and the studies are neither looked for nor tagged.
+        '''
+        prepared = self._prepare_study(deduplicate=deduplicate, **kwargs)
+        self._upload_study_files(prepared)
+        responses = self._post_prepared_study(prepared)
+        if return_response:
+            return responses[0] if prepared.n_histograms == 1 else responses
+
+    def _prepare_study(
+        self,
+        deduplicate: bool = True,
+        encode: bool = False,
+        **kwargs,
+    ) -> PreparedStudy:
+        '''
+        The local part of post_bborietveld_study_task: validates the arguments, parses the measurement file,
+        and computes the fingerprints. The scans are also encoded with encode=True.
+        '''
         # Validate with Client Parameter model and do some preprocessing
         client_interface_arg_model = PostStudyClientParams.model_validate(kwargs)
         c = client_interface_arg_model
 
+        # A random seed drawn for this call cannot match a study posted before
+        find_existing = deduplicate and 'random_seed' in kwargs
+
+        # Parse the measurement file once for all the scans, hashing it from the same buffer if needed
+        m_parser, measurement = self._read_measurement(digest=find_existing, measurementfile=c.measurementfile)
+        n_histograms = m_parser.n_histograms if m_parser else 1
+        prepared = PreparedStudy(
+            params = c,
+            m_parser = m_parser,
+            n_histograms = n_histograms,
+            fingerprints = self._study_fingerprints(c, n_histograms, measurement) if find_existing else [None] * n_histograms,
+            existing = [None] * n_histograms,
+            find_existing = find_existing,
+        )
+        if encode and m_parser is not None:
+            encoding = self.measurement_encoding
+            for index in range(n_histograms):
+                prepared.encoded[index] = (encoding, m_parser._to_upload_bytesio(index, encoding).read())
+        return prepared
+
+    def _upload_study_files(
+        self,
+        prepared: PreparedStudy,
+        uploaded: Optional[UploadedFiles] = None,
+    ):
+        '''
+        Finds the studies already posted with the same inputs, and uploads the PRM and CIF files if necessary.
+        Files already uploaded to uploaded are not uploaded again, and the files uploaded successfully are added to it.
+        '''
+        c = prepared.params
+        if prepared.find_existing:
+            prepared.existing = self._find_posted_studies(prepared.fingerprints)
+        if all(prepared.existing):
+            return
+
+        def upload(file, upload_file: Callable[..., Optional[Response]], overwrite: bool):
+            def func() -> bool:
+                response = upload_file(file, overwrite=overwrite, return_response=True)
+                return response is not None and response.status_code == 200
+            if uploaded is None:
+                func()
+            else:
+                uploaded.upload((str(Path(file).resolve()), overwrite), func)
+
         # Upload files if necessary
         if c.prmfile:
-            self.upload_prm(c.prmfile, overwrite=c.overwrite_prmfile)
+            upload(c.prmfile, self.upload_prm, c.overwrite_prmfile)
         if c.ciffiles:
             for ciffile in c.ciffiles:
-                self.upload_cif(ciffile, overwrite=c.overwrite_ciffiles)
+                upload(ciffile, self.upload_cif, c.overwrite_ciffiles)
 
-        # Post the study task
-        response = self._post_study_task(
-            **c.model_dump(),
-            measurement_filecontent = c.measurementfile.read_bytes() if c.measurementfile else None,
-            measurement_filename = c.measurementfile.name if c.measurementfile else None,
-        )
+    def _post_prepared_study(
+        self,
+        prepared: PreparedStudy,
+    ) -> list[Response]:
+        '''Posts the study task of each scan, or returns the responses of the existing studies.'''
+        c = prepared.params
+        responses = []
+        for index in range(prepared.n_histograms):
+            params = c.model_dump()
+            if prepared.n_histograms > 1:
+                params['study_name'] = f'{c.study_name}_scan{index:03d}'
+            existing = prepared.existing[index] if prepared.existing else None
+            if existing is not None:
+                print(f'{params["study_name"]} skipped: a study of the same inputs exists ({existing})')
+                responses.append(self._existing_study_response(existing, params['study_name']))
+                continue
+            fingerprint = prepared.fingerprints[index]
+            if fingerprint is not None:
+                params['tags'] = params['tags'] + [fingerprint_tag(fingerprint)]
+            response = self._post_study_task(
+                m_parser = prepared.m_parser,
+                histogram_index = index,
+                encoded = prepared.encoded.get(index),
+                **params,
+            )
 
-        if response.status_code == 202:
-            # print('Request successful')
-            print(f'{response.json()}')
-            study_id = response.json()['study_id']
-            self.history.append(study_id)
-        else:
-            print('Request failed')
-            print(f'{response.status_code}: {response.content.decode()}')
-        if return_response:
-            return response
+            if response.status_code == 202:
+                # print('Request successful')
+                print(f'{self._decode(response)}')
+                study_id = self._decode(response)['study_id']
+                with self._lock:
+                    self.history.append(study_id)
+                if fingerprint is not None and self.submission_index is not None:
+                    self.submission_index.add(fingerprint, study_id)
+            else:
+                print('Request failed')
+                print(f'{response.status_code}: {response.content.decode()}')
+            responses.append(response)
+        return responses
 
 
     ### Tasks ###
@@ -499,7 +1244,7 @@ class BBORClient:
             authorization = True,
         )
         if response.status_code==200:
-            return response.json()
+            return self._decode(response)
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -510,6 +1255,7 @@ class BBORClient:
 
     ### Get study results ###
     @require_token
+    @traced
     def get_study(
         self,
         id:str,
@@ -525,9 +1271,9 @@ class BBORClient:
         )
         if response.status_code==200:
             if return_dict:
-                return response.json()
+                return self._decode(response)
             else:
-                return Study.model_validate(response.json())
+                return self._validate(response, Study, self._decode(response))
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -535,26 +1281,37 @@ class BBORClient:
                 return response
 
     @require_token
+    @traced
     def find_studies(
         self,
         query: dict = {},
         scope: Literal['account', 'group'] = 'group',
         return_dict: bool = False,
         return_response: bool = False,
+        fields: Optional[list[str]] = None,
     ) -> Union[list[Study], list[dict], None, Response]:
+        '''
+        Args:
+            fields: Dotted paths to be returned, e.g. ['trial_num', 'result_refine.Rval.Rwp'].
+                Only the fields (and _id) are requested from the server and partial documents are returned as dicts.
+        '''
         if scope=='account':
-            query |= {'user.$id': self.me.id} # type: ignore
+            query = query | {'user.$id': self.me.id} # type: ignore
         response = self._send_api(
             endpoint = '/studies',
             method = 'post',
+            params = {'projection': json.dumps(projection(fields))} if fields else None,
             json = query,
             authorization = True,
         )
         if response.status_code==200:
-            if return_dict:
-                return response.json()
+            if fields:
+                # Projected again in case the server ignores the projection
+                return [project(study, fields) for study in self._decode(response)]
+            elif return_dict:
+                return self._decode(response)
             else:
-                return [Study.model_validate(study) for study in response.json()]
+                return self._validate(response, Study, self._decode(response))
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -562,38 +1319,52 @@ class BBORClient:
                 return response
 
     @require_token
+    @traced
     def find_my_studies(
         self,
         query: dict = {},
         return_dict: bool = False,
         return_response: bool = False,
+        fields: Optional[list[str]] = None,
     ) -> Union[list[Study], list[dict], None, Response]:
         return self.find_studies(
             query=query,
             scope = 'account',
             return_dict = return_dict,
+            fields = fields,
             return_response = return_response,
         )
     
     @require_token
+    @traced
     def get_optuna_study(
             self,
             study_name: str,
             return_json: bool = False,
             return_response: bool = False,
-    ) -> Union[pd.DataFrame, str, None, Response]:
+            backend: Literal['pandas', 'numpy', 'arrow'] = 'pandas',
+    ) -> Union['pd.DataFrame', dict, 'pa.Table', str, None, Response]:
+        '''
+        Gets the trials dataframe of the Optuna study.
+
+        The backend chooses the return type: a pandas.DataFrame, a dict of numpy arrays, or a pyarrow.Table.
+        The numpy and arrow backends do not require pandas.
+        '''
         response = self._send_api(
             endpoint = f'/study/{study_name}/optunadf',
+            route = '/study/{study_name}/optunadf',
             method = 'get',
             authorization = True,
         )
         if response.status_code==200:
-            json_received = response.content.decode()
-            json_return = json_received.replace('\\"', '"')[1:-1]
             if return_json:
-                return json_return
+                # The body is a JSON string of the dataframe JSON
+                return json.loads(response.content)
             else:
-                return pd.read_json(StringIO(json_return))
+                start = perf_counter()
+                table = optunadf.decode(response.content, backend=backend)
+                self._record_phase(response, 'decode', perf_counter() - start)
+                return table
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -624,6 +1395,7 @@ class BBORClient:
 
     ### Get trials ###
     @require_token
+    @traced
     def get_trial(
         self,
         id:str,
@@ -639,9 +1411,9 @@ class BBORClient:
         )
         if response.status_code==200:
             if return_dict:
-                return response.json()
+                return self._decode(response)
             else:
-                return Trial.model_validate(response.json())
+                return self._validate(response, Trial, self._decode(response))
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -649,23 +1421,45 @@ class BBORClient:
                 return response
 
     @require_token
+    @traced
     def find_trials(
         self,
         query: dict = {},
         return_dict: bool = False,
         return_response: bool = False,
+        fields: Optional[list[str]] = None,
+        sort: Optional[list[tuple[str, int]]] = None,
+        limit: Optional[int] = None,
     ) -> Union[list[Trial], list[dict], None, Response]:
+        '''
+        Args:
+            fields: Dotted paths to be returned. Partial documents are returned as dicts (see find_studies).
+            sort: list of (path, 1 or -1) to be sorted by on the server, e.g. [('result_refine.Rval.Rwp', 1)].
+            limit: Maximum number of trials returned by the server.
+                The server may ignore sort and limit. See top_trials for a method which does not rely on them.
+        '''
+        params = {}
+        if fields:
+            params['projection'] = json.dumps(projection(fields))
+        if sort:
+            params['sort'] = json.dumps([[path, order] for path, order in sort])
+        if limit is not None:
+            params['limit'] = int(limit)
         response = self._send_api(
             endpoint = '/trials',
             method = 'post',
+            params = params or None,
             json = query,
             authorization = True,
         )
         if response.status_code==200:
-            if return_dict:
-                return response.json()
+            if fields:
+                # Projected again in case the server ignores the projection
+                return [project(trial, fields) for trial in self._decode(response)]
+            elif return_dict:
+                return self._decode(response)
             else:
-                return [Trial.model_validate(trial) for trial in response.json()]
+                return self._validate(response, Trial, self._decode(response))
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -673,11 +1467,13 @@ class BBORClient:
                 return response
 
     @require_token
+    @traced
     def get_study_trials(
         self,
         study_id: str,
         return_dict: bool = False,
         return_response: bool = False,
+        fields: Optional[list[str]] = None,
     ) -> Union[list[Trial], list[dict], None, Response]:
         validate_id(study_id)
         query = {
@@ -686,10 +1482,12 @@ class BBORClient:
         return self.find_trials(
             query = query,
             return_dict = return_dict,
+            fields = fields,
             return_response = return_response
         )
 
     @require_token
+    @traced
     def get_best_trials(
         self,
         study_id: str,
@@ -702,18 +1500,166 @@ class BBORClient:
             # print(f'Study "{study_id}" not found')
             return None
         assert isinstance(study, Study)
-        best_trial_ids = [best.trial.id for best in study.best_trials]
+        links = [best.trial for best in study.best_trials]
+        resolved = self.resolve(links, return_dict=return_dict)
+        if resolved is None:
+            return None
         trials = []
-        for id in best_trial_ids:
-            trial = self.get_trial(id, return_dict=return_dict)
+        for link in links:
+            trial = resolved.get(link.id)
             if trial is None:
-                print(f'Trial {id} not found')
+                print(f'Trial {link.id} not found')
             trials.append(trial)
         return trials
 
+    @require_token
+    @traced
+    def top_trials(
+        self,
+        study_id: str,
+        n: int = 20,
+        key: str = 'Rwp',
+        return_dict: bool = False,
+    ) -> Union[list[Trial], list[dict], None]:
+        '''
+        Gets the n best trials of a study by key ('Rwp', 'GOF', or a dotted path), in ascending order.
+
+        The sort and limit are sent to the server with only trial_num and the key projected.
+        If the server ignores them, the best n are selected locally with a heap,
+        so that only the n best trials are downloaded in full in either case.
+        '''
+        validate_id(study_id)
+        path = key_path(key)
+        summaries = self.find_trials(
+            query = {'parent_study.$id': str(study_id), path: {'$ne': None}},
+            fields = ['trial_num', path],
+            sort = [(path, 1)],
+            limit = n,
+        )
+        if summaries is None:
+            return None
+        best = top_k(summaries, n, path) # type: ignore
+        if len(best) == 0:
+            return []
+        order = {summary['trial_num']: i for i, summary in enumerate(best)}
+        trials = self.find_trials(
+            query = {'parent_study.$id': str(study_id), 'trial_num': {'$in': list(order)}},
+            return_dict = True,
+        )
+        if trials is None:
+            return None
+        trials = sorted(trials, key=lambda trial: order[trial['trial_num']]) # type: ignore
+        if return_dict:
+            return trials
+        return [Trial.model_validate(trial) for trial in trials]
+
+    @require_token
+    @traced
+    def rwp_distribution(
+        self,
+        study_ids: Union[str, list[str]],
+        bins: Union[int, list[float]] = 20,
+        limits: Optional[tuple[float, float]] = None,
+        key: str = 'Rwp',
+        batch_size: int = 100,
+    ) -> Optional[tuple[list[float], dict[str, list[int]]]]:
+        '''
+        Histograms of Rwp (or GOF) of the trials of each study.
+
+        The trials are counted on the server, grouped by study into the bins (the group query parameter).
+        If the server ignores it, only the key of the trials is downloaded for each batch of studies,
+        and counted as each batch arrives without keeping the values.
+        With bins as a number and no limits, the min and max are found first by queries sorted by the key with limit 1.
+        Args:
+            bins: Number of equal-width bins, or the bin edges.
+            limits: (min, max) of the bins. The min and max over all the studies by default.
+        Returns:
+            (bin edges, {study_id: counts})
+        '''
+        if isinstance(study_ids, str):
+            study_ids = [study_ids]
+        for study_id in study_ids:
+            validate_id(study_id)
+        path = key_path(key)
+        ids = [str(study_id) for study_id in study_ids]
+        batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+        if isinstance(bins, int):
+            if limits is None:
+                limits = self._value_limits(batches, path)
+                if limits is None:
+                    return None
+            edges = histogram_edges((), bins, limits)
+        else:
+            edges = list(bins)
+        counts = {study_id: [0] * (len(edges) - 1) for study_id in ids}
+        for batch in batches:
+            if not self._count_buckets(batch, path, edges, counts):
+                return None
+        return edges, counts
+
+    def _value_limits(
+        self,
+        batches: list[list[str]],
+        path: str,
+    ) -> Optional[tuple[float, float]]:
+        '''(min, max) of the key of the trials of the studies. (0, 1) without values, and None if a request failed.'''
+        low, high = math.inf, -math.inf
+        for batch in batches:
+            query = {'parent_study.$id': {'$in': batch}, path: {'$ne': None}}
+            for order in (1, -1):
+                trials = self.find_trials(query=query, fields=[path], sort=[(path, order)], limit=1)
+                if trials is None:
+                    return None
+                values = list(numbers(trials, path)) # type: ignore
+                low, high = min([low, *values]), max([high, *values])
+                if len(trials) > 1:
+                    # The server ignored the limit and all the values are here
+                    break
+        return (low, high) if low <= high else (0., 1.)
+
+    def _count_buckets(
+        self,
+        study_ids: list[str],
+        path: str,
+        edges: list[float],
+        counts: dict[str, list[int]],
+    ) -> bool:
+        '''
+        Adds the counts of the key of the trials of the studies in the bins to counts. Returns False if the request failed.
+        The server returns [{'_id': study_id, 'counts': [...]}] for the group parameter,
+        or the projected trials if it does not support it.
+        '''
+        response = self._send_api(
+            endpoint = '/trials',
+            method = 'post',
+            params = {
+                'projection': json.dumps(projection(['parent_study', path])),
+                'group': json.dumps({'by': 'parent_study.$id', 'bucket': path, 'boundaries': edges}),
+            },
+            json = {'parent_study.$id': {'$in': study_ids}},
+            authorization = True,
+        )
+        if response.status_code != 200:
+            print('Request failed')
+            print(f'{response.status_code}: {response.content.decode()}')
+            return False
+        documents = self._decode(response)
+        for document in documents:
+            if isinstance(document.get('counts'), list) and 'parent_study' not in document:
+                # Counted on the server
+                study_counts = counts.get(str(document['_id']))
+                for i, count in enumerate(document['counts'][:len(edges) - 1]):
+                    if study_counts is not None:
+                        study_counts[i] += count
+            else:
+                study = get_value(document, 'parent_study.id')
+                if study in counts:
+                    histogram(numbers([document], path), edges, counts[study])
+        return True
 
     ### Get refines ###
     @require_token
+    @traced
     def get_refine(
         self,
         id:str,
@@ -729,9 +1675,9 @@ class BBORClient:
         )
         if response.status_code==200:
             if return_dict:
-                return response.json()
+                return self._decode(response)
             else:
-                return Refine.model_validate(response.json())
+                return self._validate(response, Refine, self._decode(response))
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -739,23 +1685,30 @@ class BBORClient:
                 return response
 
     @require_token
+    @traced
     def find_refines(
         self,
         query: dict = {},
         return_dict: bool = False,
         return_response: bool = False,
+        fields: Optional[list[str]] = None,
     ) -> Union[list[Refine], list[dict], None, Response]:
+        '''fields: Dotted paths to be returned. Partial documents are returned as dicts (see find_studies).'''
         response = self._send_api(
             endpoint = '/refines',
             method = 'post',
+            params = {'projection': json.dumps(projection(fields))} if fields else None,
             json = query,
             authorization = True,
         )
         if response.status_code==200:
-            if return_dict:
-                return response.json()
+            if fields:
+                # Projected again in case the server ignores the projection
+                return [project(refine, fields) for refine in self._decode(response)]
+            elif return_dict:
+                return self._decode(response)
             else:
-                return [Refine.model_validate(refine) for refine in response.json()]
+                return self._validate(response, Refine, self._decode(response))
         else:
             print('Request failed')
             print(f'{response.status_code}: {response.content.decode()}')
@@ -763,3 +1716,118 @@ class BBORClient:
                 return response
 
 
+    ### Resolve links ###
+    @require_token
+    @traced
+    def resolve(
+        self,
+        links: list[Union[Link, dict]],
+        return_dict: bool = False,
+        batch_size: int = 100,
+        max_workers: int = 4,
+    ) -> Optional[dict[str, Union[Study, Trial, Refine, dict]]]:
+        '''
+        Gets the documents referenced by Links, e.g. trial.refines or [best.trial for best in study.best_trials].
+
+        The links are grouped by collection and their ids de-duplicated,
+        then fetched by {'_id': {'$in': ids}} queries of batch_size ids with max_workers requests at a time.
+        Returns:
+            {id: Study, Trial, or Refine (dict with return_dict=True)}.
+            Ids not found on the server are left out. None if a request failed.
+        '''
+        ids: dict[str, dict[str, None]] = {}  # collection -> ordered set of ids
+        for link in links:
+            if not isinstance(link, Link):
+                link = Link.model_validate(link)
+            collection = LINK_COLLECTIONS.get(link.collection.lower())
+            if collection is None:
+                raise ValueError(f'Links of the collection "{link.collection}" cannot be resolved')
+            validate_id(link.id)
+            ids.setdefault(collection, {})[link.id] = None
+        finders = {
+            'studies': self.find_studies,
+            'trials': self.find_trials,
+            'refines': self.find_refines,
+        }
+        batches = [
+            (collection, list(collection_ids)[start:start + batch_size])
+            for collection, collection_ids in ids.items()
+            for start in range(0, len(collection_ids), batch_size)
+        ]
+        parent = self.tracer.current
+        expiry = deadline.expiry()
+
+        def fetch(batch: tuple[str, list[str]]):
+            collection, batch_ids = batch
+            with self.tracer.attach(parent), deadline.deadline(at=expiry):
+                return finders[collection](query={'_id': {'$in': batch_ids}}, return_dict=return_dict)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches) or 1))) as executor:
+            results = list(executor.map(fetch, batches))
+        resolved = {}
+        for documents in results:
+            if documents is None:
+                return None
+            for document in documents:
+                resolved[document['_id'] if isinstance(document, dict) else document.id] = document
+        return resolved
+
+
+    ### Export ###
+    @require_token
+    def export_study(
+        self,
+        study_id: str,
+        path: Union[str, Path],
+        format: ExportFormat = 'parquet',
+        batch_size: int = 100,
+    ) -> Optional[Path]:
+        '''
+        Exports the study, its trials, and their refines as flattened columnar tables.
+
+        study, trials, and refines tables are written in the directory of path,
+        e.g. path/trials.parquet, with one row per trial/refine and one column per parameter path
+        such as result_refine.Rval.Rwp.
+        Trials and their refines are downloaded and written batch by batch (one row group per batch),
+        so that the memory usage is bounded by batch_size regardless of the study size.
+        Requires pyarrow.
+        '''
+        validate_id(study_id)
+        study = self.get_study(study_id, return_dict=True)
+        if study is None:
+            return None
+        assert isinstance(study, dict)
+        directory = Path(path)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        with TableWriter(table_path(directory, 'study', format), format) as writer:
+            writer.write([flatten(study, exclude=('trials',))])
+
+        trial_nums = sorted(trial['num'] for trial in study['trials'])
+        with TableWriter(table_path(directory, 'trials', format), format) as trial_writer, \
+                TableWriter(table_path(directory, 'refines', format), format) as refine_writer:
+            for start in range(0, len(trial_nums), batch_size):
+                nums = trial_nums[start:start + batch_size]
+                trials = self.find_trials(
+                    query = {
+                        'parent_study.$id': str(study_id),
+                        'trial_num': {'$gte': nums[0], '$lte': nums[-1]},
+                    },
+                    return_dict = True,
+                )
+                if trials is None:
+                    raise RuntimeError(f'Failed in getting trials {nums[0]}-{nums[-1]} of {study_id}')
+                trial_ids = [trial['_id'] for trial in trials]
+                refines = self.find_refines(
+                    query = {'parent_trial.$id': {'$in': trial_ids}},
+                    return_dict = True,
+                ) if trial_ids else []
+                if refines is None:
+                    raise RuntimeError(f'Failed in getting refines of trials {nums[0]}-{nums[-1]} of {study_id}')
+                trial_writer.write([flatten(trial) for trial in trials]) # type: ignore
+                refine_writer.write([flatten(refine) for refine in refines]) # type: ignore
+                del trials, refines
+            print(f'Exported {trial_writer.n_rows} trials and {refine_writer.n_rows} refines to {directory}')
+        return directory
+
+
@@ -21,3 +21,5 @@ API_URL_MDX = f'https://{SERVER_ADDRESS}'
 API_URL_LOCAL = 'http://localhost:8000'
 API_URL_DOCKER = 'http://bborapi:8000'
 VERIFY_CERT = True
+CONNECT_TIMEOUT: float = 10. # seconds
+READ_TIMEOUT: float = 60. # seconds between the bytes received
@@ -0,0 +1,114 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Union
+from .conf import CONNECT_TIMEOUT, READ_TIMEOUT
+
+Timeout = Union[float, tuple[float, float]]
+
+# Monotonic time by which the calls in the context must finish
+_deadline: ContextVar[Optional[float]] = ContextVar('bbor_client_deadline', default=None)
+# (connect, read) timeouts overriding those of the client in the context
+_timeouts: ContextVar[Optional[tuple[Optional[float], Optional[float]]]] = ContextVar('bbor_client_timeouts', default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def _pair(timeout: Timeout) -> tuple[float, float]:
+    if isinstance(timeout, tuple):
+        return timeout
+    return (timeout, timeout)
+
+
+@contextmanager
+def deadline(
+        seconds: Optional[float] = None,
+        at: Optional[float] = None,
+):
+    '''
+    Limits the time of the API calls in the block, e.g. with deadline(600): client.resolve(links).
+
+    Every request in the block is sent with its timeouts cut to the remaining time,
+    and raises DeadlineExceeded instead of being sent after the deadline.
+    at is a time.monotonic() value, e.g. remaining() of another thread added to its monotonic().
+    A nested deadline cannot extend the outer one.
+    '''
+    expiry = at if at is not None else time.monotonic() + (seconds if seconds is not None else float('inf'))
+    outer = _deadline.get()
+    if outer is not None:
+        expiry = min(expiry, outer)
+    token = _deadline.set(expiry)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def expiry() -> Optional[float]:
+    '''The time.monotonic() value of the current deadline, passed to deadline(at=...) in other threads.'''
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    '''Seconds until the current deadline, or None without a deadline.'''
+    expiry = _deadline.get()
+    if expiry is None:
+        return None
+    return expiry - time.monotonic()
+
+
+def check(action: str = 'the call'):
+    '''Raises DeadlineExceeded if the deadline has passed.'''
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f'Deadline exceeded before {action}')
+
+
+def sleep(seconds: float):
+    '''time.sleep for retry and poll loops, which raises DeadlineExceeded instead of sleeping past the deadline.'''
+    left = remaining()
+    if left is not None and left < seconds:
+        time.sleep(max(left, 0.))
+        raise DeadlineExceeded(f'Deadline exceeded while waiting {seconds} s')
+    time.sleep(seconds)
+
+
+@contextmanager
+def timeouts(
+        connect: Optional[float] = None,
+        read: Optional[float] = None,
+):
+    '''
+    Overrides the (connect, read) timeouts of the clients for the requests in the block,
+    e.g. with timeouts(read=300): client.export_study(...).
+    '''
+    current = _timeouts.get()
+    token = _timeouts.set((
+        connect if connect is not None else (current[0] if current else None),
+        read if read is not None else (current[1] if current else None),
+    ))
+    try:
+        yield
+    finally:
+        _timeouts.reset(token)
+
+
+def request_timeout(
+        default: Timeout = (CONNECT_TIMEOUT, READ_TIMEOUT),
+        cut: bool = True,
+) -> tuple[float, float]:
+    '''
+    (connect, read) timeouts of a request: those of timeouts() or the default,
+    cut to the time remaining until the deadline unless cut=False.
+    '''
+    connect, read = _pair(default)
+    override = _timeouts.get()
+    if override is not None:
+        connect = override[0] if override[0] is not None else connect
+        read = override[1] if override[1] is not None else read
+    left = remaining()
+    if cut and left is not None:
+        connect, read = min(connect, left), min(read, left)
+    return (connect, read)
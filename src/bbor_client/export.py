@@ -0,0 +1,160 @@
+import json
+from pathlib import Path
+from typing import Literal, Any
+
+ExportFormat = Literal['parquet', 'arrow', 'csv']
+FILE_SUFFIXES = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'csv': '.csv',
+}
+
+# Separator of the nested keys in the flattened column names, e.g. result_refine.Rval.Rwp
+SEP = '.'
+
+# Column collecting, as a JSON object, the values which do not fit the schema fixed by the first batch
+EXTRA_COLUMN = '_extra'
+
+
+def flatten(
+        document: dict,
+        prefix: str = '',
+        exclude: tuple[str, ...] = (),
+) -> dict[str, Any]:
+    '''
+    Flattens a nested document into a dict of column paths and scalar values.
+    Lists are stored as JSON strings, e.g. {'a': {'b': 1, 'c': [1, 2]}} -> {'a.b': 1, 'a.c': '[1, 2]'}.
+    '''
+    flat = {}
+    for key, value in document.items():
+        if key in exclude:
+            continue
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=path + SEP))
+        elif isinstance(value, list):
+            flat[path] = json.dumps(value)
+        else:
+            flat[path] = value
+    return flat
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class TableWriter:
+    '''
+    Writes flattened rows to a columnar file incrementally, one row group (record batch) per write().
+
+    The schema is fixed by the first batch: all the numbers are stored as float64, booleans as bool,
+    and the others as strings. Later values which do not fit the schema are kept in the _extra column.
+    '''
+    def __init__(
+            self,
+            path: Path,
+            format: ExportFormat = 'parquet',
+    ):
+        if format not in FILE_SUFFIXES:
+            raise ValueError(f'Unknown export format "{format}". Choose from {tuple(FILE_SUFFIXES)}.')
+        self.path = Path(path)
+        self.format = format
+        self.n_rows = 0
+        self._schema = None
+        self._writer = None
+        self._sink = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def _infer_schema(cls, rows: list[dict]):
+        import pyarrow as pa
+
+        values: dict[str, list] = {}
+        for row in rows:
+            for name, value in row.items():
+                if value is not None:
+                    values.setdefault(name, []).append(value)
+                else:
+                    values.setdefault(name, [])
+        fields = []
+        for name, column in values.items():
+            if len(column) > 0 and all(isinstance(v, bool) for v in column):
+                fields.append(pa.field(name, pa.bool_()))
+            elif len(column) > 0 and all(_is_number(v) for v in column):
+                fields.append(pa.field(name, pa.float64()))
+            else:
+                fields.append(pa.field(name, pa.string()))
+        fields.append(pa.field(EXTRA_COLUMN, pa.string()))
+        return pa.schema(fields)
+
+    def _open(self):
+        import pyarrow as pa
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        elif self.format == 'arrow':
+            self._sink = pa.OSFile(str(self.path), 'wb')
+            self._writer = pa.ipc.new_file(self._sink, self._schema)
+        elif self.format == 'csv':
+            import pyarrow.csv as pacsv
+            self._writer = pacsv.CSVWriter(str(self.path), self._schema)
+
+    def write(self, rows: list[dict]):
+        import pyarrow as pa
+
+        if len(rows) == 0:
+            return
+        if self._schema is None:
+            self._schema = self._infer_schema(rows)
+            self._open()
+        assert self._schema is not None and self._writer is not None
+
+        columns: dict[str, list] = {field.name: [] for field in self._schema}
+        for row in rows:
+            extra = {}
+            for field in self._schema:
+                if field.name == EXTRA_COLUMN:
+                    continue
+                value = row.get(field.name)
+                fits = (
+                    value is None
+                    or (field.type == pa.bool_() and isinstance(value, bool))
+                    or (field.type == pa.float64() and _is_number(value))
+                    or field.type == pa.string()
+                )
+                if not fits:
+                    extra[field.name] = value
+                    value = None
+                elif field.type == pa.string() and value is not None and not isinstance(value, str):
+                    value = json.dumps(value)
+                columns[field.name].append(value)
+            extra.update({name: value for name, value in row.items() if name not in columns})
+            columns[EXTRA_COLUMN].append(json.dumps(extra) if extra else None)
+
+        batch = pa.record_batch(
+            [pa.array(columns[field.name], type=field.type) for field in self._schema],
+            schema = self._schema,
+        )
+        self._writer.write_batch(batch)
+        self.n_rows += len(rows)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+def table_path(
+        directory: Path,
+        table: str,
+        format: ExportFormat,
+) -> Path:
+    return Path(directory) / f'{table}{FILE_SUFFIXES[format]}'
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Union
+from .parsers.interface import Buffer
+
+# Prefix of the tag of a study with the fingerprint of its inputs
+TAG_PREFIX = 'fingerprint:'
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    '''SHA-256 of the content of a file.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def buffer_digest(buffer: Buffer) -> str:
+    '''SHA-256 of the content of a file already read or memory-mapped, equal to file_digest of the file.'''
+    return hashlib.sha256(buffer).hexdigest()
+
+
+def study_fingerprint(
+        measurement: str,
+        histogram_index: int,
+        prm: Optional[str],
+        cifs: Optional[list[str]],
+        sequence: str,
+        n_trials_total: int,
+        n_startup_trials: Optional[int],
+        random_seed: int,
+) -> str:
+    '''
+    Identifies the inputs of a study, which give the same refinements when posted again.
+
+    Args:
+        measurement: SHA-256 of the measurement file.
+        histogram_index: Scan of a multi-scan measurement file.
+        prm, cifs: SHA-256 of the local files, or the names of the files on the server.
+    '''
+    canonical = json.dumps([
+        measurement,
+        histogram_index,
+        prm,
+        sorted(cifs or []),
+        sequence,
+        n_trials_total,
+        n_startup_trials,
+        random_seed,
+    ])
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def fingerprint_tag(fingerprint: str) -> str:
+    return TAG_PREFIX + fingerprint
+
+
+class SubmissionIndex:
+    '''
+    Local index of the fingerprints of the posted studies and their ids, saved to a JSON file if path is given.
+    Studies are looked up here before asking the server for the fingerprint tags.
+    '''
+    def __init__(
+            self,
+            path: Union[str, Path, None] = None,
+    ):
+        self.path = Path(path) if path is not None else None
+        self._lock = threading.Lock()
+        self._entries: dict[str, str] = {}
+        if self.path is not None and self.path.exists():
+            self._entries = json.loads(self.path.read_text())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            return self._entries.get(fingerprint)
+
+    def add(self, fingerprint: str, study_id: str):
+        with self._lock:
+            self._entries[fingerprint] = study_id
+            self._save()
+
+    def discard(self, fingerprint: str):
+        with self._lock:
+            if self._entries.pop(fingerprint, None) is not None:
+                self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        temp.write_text(json.dumps(self._entries))
+        os.replace(temp, self.path)
@@ -0,0 +1,111 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Optional, Hashable, Union
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+# Responses kept for the conditional requests
+MAX_ENTRIES = 256
+
+
+def http_date(value: Union[str, datetime]) -> str:
+    '''An ISO 8601 time (UTC if naive) in the HTTP-date format, e.g. for If-Modified-Since.'''
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+@dataclass
+class CachedResponse:
+    status_code: int
+    headers: dict
+    content: bytes
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditions(self) -> dict[str, str]:
+        '''Headers of a conditional request validated by this response.'''
+        if self.etag:
+            return {'If-None-Match': self.etag}
+        if self.last_modified:
+            return {'If-Modified-Since': self.last_modified}
+        return {}
+
+    def replay(self) -> Response:
+        '''A new response with the cached content, returned for 304 Not Modified.'''
+        response = Response()
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.url = self.url
+        response.encoding = 'utf-8'
+        response._content = self.content
+        return response
+
+
+class ConditionalCache:
+    '''
+    Last responses of GET requests with their validators (ETag or Last-Modified),
+    sent as If-None-Match or If-Modified-Since so that the server can answer 304 Not Modified without the body.
+    The least recently used responses are dropped beyond max_entries.
+    '''
+    def __init__(
+            self,
+            max_entries: int = MAX_ENTRIES,
+    ):
+        self.max_entries = max_entries
+        self.hits = 0
+        self._entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(
+            self,
+            key: Hashable,
+            response: Response,
+            last_modified: Optional[str] = None,
+    ):
+        '''
+        Keeps a response with an ETag or Last-Modified header.
+        last_modified is used when the response has neither, e.g. from Study.updated_at.
+        '''
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified') or last_modified
+        with self._lock:
+            if not etag and not last_modified:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = CachedResponse(
+                status_code = response.status_code,
+                headers = dict(response.headers),
+                content = response.content,
+                url = response.url,
+                etag = etag,
+                last_modified = last_modified,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def hit(self, entry: CachedResponse) -> Response:
+        with self._lock:
+            self.hits += 1
+        return entry.replay()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
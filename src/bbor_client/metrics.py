@@ -0,0 +1,227 @@
+import math
+import threading
+from collections import deque, Counter
+from dataclasses import dataclass, field
+from typing import Optional, Literal, Callable, Any, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .circuit import CircuitBreaker
+
+HookEvent = Literal['before_request', 'after_response', 'on_error']
+HOOK_EVENTS: tuple = ('before_request', 'after_response', 'on_error')
+Hook = Callable[..., None]
+
+# Phases of an API call timed by the client, in seconds
+# request: from sending the request to receiving the whole body, which consists of
+#   connect: TCP connection and TLS handshake (0 for a reused connection)
+#   ttfb: from sending the request to receiving the response headers
+#   transfer: reading the response body
+# decode: response.json()
+# validate: pydantic model_validate
+PHASES = ('request', 'connect', 'ttfb', 'transfer', 'decode', 'validate')
+TRANSPORT_PHASES = ('request', 'connect', 'ttfb', 'transfer')
+
+PERCENTILES = (50, 90, 99)
+
+# Values of the circuit state gauge
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+# Latency samples kept per route and phase for the percentiles
+MAX_SAMPLES = 10000
+
+
+@dataclass
+class RequestInfo:
+    '''
+    Information of an API call passed to the hooks.
+
+    before_request(info) is called before sending,
+    after_response(info, response) after receiving the response,
+    and on_error(info, exception) when the request raises an exception.
+    '''
+    method: str
+    endpoint: str
+    route: str  # endpoint with the variable parts replaced, used as the metrics label
+    url: str
+    status_code: Optional[int] = None
+    bytes_out: int = 0
+    bytes_in: int = 0
+    start_ns: int = 0  # Unix time of sending
+    timings: dict[str, float] = field(default_factory=dict)  # seconds of each phase
+    phase_starts: dict[str, int] = field(default_factory=dict)  # Unix time (ns) of the start of each phase
+    error: Optional[BaseException] = None
+
+
+def percentile(samples: list[float], q: float) -> float:
+    '''Nearest-rank percentile of sorted samples.'''
+    if len(samples) == 0:
+        return math.nan
+    rank = max(math.ceil(q / 100 * len(samples)), 1)
+    return samples[rank - 1]
+
+
+class _RouteMetrics:
+    def __init__(self, max_samples: int):
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.status = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = {phase: 0. for phase in PHASES}
+        self.counts = {phase: 0 for phase in PHASES}
+        self.samples = {phase: deque(maxlen=max_samples) for phase in PHASES}
+
+
+class MetricsCollector:
+    '''
+    Collects the number of requests, status codes, bytes in/out, and latencies of each phase per route.
+
+    to_dict() returns a snapshot, and to_prometheus() the Prometheus text exposition format.
+    circuits() returns the states of the circuit breaker of the client, also exported to Prometheus.
+    '''
+    def __init__(
+            self,
+            max_samples: int = MAX_SAMPLES,
+    ):
+        self.max_samples = max_samples
+        self._routes: dict[tuple[str, str], _RouteMetrics] = {}
+        self._lock = threading.Lock()
+        self.circuit_breaker: Optional['CircuitBreaker'] = None
+
+    def _route(self, method: str, route: str) -> _RouteMetrics:
+        key = (method, route)
+        if key not in self._routes:
+            self._routes[key] = _RouteMetrics(self.max_samples)
+        return self._routes[key]
+
+    def record_request(self, info: RequestInfo):
+        with self._lock:
+            metrics = self._route(info.method, info.route)
+            metrics.requests += 1
+            if info.error is not None:
+                metrics.errors += 1
+            else:
+                metrics.status[info.status_code] += 1
+            metrics.bytes_in += info.bytes_in
+            metrics.bytes_out += info.bytes_out
+            for phase in TRANSPORT_PHASES:
+                if phase in info.timings:
+                    metrics.seconds[phase] += info.timings[phase]
+                    metrics.counts[phase] += 1
+                    metrics.samples[phase].append(info.timings[phase])
+
+    def record_coalesced(self, method: str, route: str):
+        '''Counts a call which received the response of an identical request in flight instead of sending one.'''
+        with self._lock:
+            self._route(method, route).coalesced += 1
+
+    def record_phase(self, info: RequestInfo, phase: str, seconds: float):
+        with self._lock:
+            metrics = self._route(info.method, info.route)
+            metrics.seconds[phase] += seconds
+            metrics.counts[phase] += 1
+            metrics.samples[phase].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def to_dict(self) -> dict[str, dict[str, Any]]:
+        '''
+        Returns:
+            {'METHOD route': {'requests', 'errors', 'coalesced', 'status', 'bytes_in', 'bytes_out', 'seconds', 'counts', 'latency'}}
+            where coalesced is the number of calls served by an identical request in flight, seconds and counts are the totals of each phase,
+            and latency is {phase: {'p50', 'p90', 'p99', 'max'}} in seconds over the last max_samples calls.
+        '''
+        with self._lock:
+            snapshot = {}
+            for (method, route), metrics in self._routes.items():
+                latency = {}
+                for phase, samples in metrics.samples.items():
+                    if len(samples) == 0:
+                        continue
+                    ordered = sorted(samples)
+                    latency[phase] = {f'p{q}': percentile(ordered, q) for q in PERCENTILES} | {'max': ordered[-1]}
+                snapshot[f'{method} {route}'] = {
+                    'requests': metrics.requests,
+                    'errors': metrics.errors,
+                    'coalesced': metrics.coalesced,
+                    'status': dict(metrics.status),
+                    'bytes_in': metrics.bytes_in,
+                    'bytes_out': metrics.bytes_out,
+                    'seconds': dict(metrics.seconds),
+                    'counts': dict(metrics.counts),
+                    'latency': latency,
+                }
+            return snapshot
+
+    def circuits(self) -> dict[str, dict[str, Any]]:
+        '''{endpoint group: {'state', 'failures', 'opened', 'rejected'}} of the circuit breaker.'''
+        if self.circuit_breaker is None:
+            return {}
+        return self.circuit_breaker.to_dict()
+
+    def to_prometheus(
+            self,
+            prefix: str = 'bbor_client',
+    ) -> str:
+        '''Metrics in the Prometheus text exposition format. Latencies are exported as summaries.'''
+        snapshot = self.to_dict()
+        lines = []
+
+        def family(name: str, kind: str, help: str, samples: list[tuple[dict, float]]):
+            lines.append(f'# HELP {prefix}_{name} {help}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{prefix}_{name}{{{_labels(labels)}}} {value}')
+
+        def route_labels(key: str) -> dict[str, str]:
+            method, route = key.split(' ', 1)
+            return {'method': method, 'route': route}
+
+        family('requests_total', 'counter', 'API requests by status code.', [
+            (route_labels(key) | {'status': status}, count)
+            for key, m in snapshot.items() for status, count in m['status'].items()
+        ])
+        family('request_errors_total', 'counter', 'API requests failed without a response.', [
+            (route_labels(key), m['errors']) for key, m in snapshot.items()
+        ])
+        family('coalesced_requests_total', 'counter', 'API calls served by an identical request in flight.', [
+            (route_labels(key), m['coalesced']) for key, m in snapshot.items()
+        ])
+        family('response_bytes_total', 'counter', 'Bytes of the response bodies.', [
+            (route_labels(key), m['bytes_in']) for key, m in snapshot.items()
+        ])
+        family('request_bytes_total', 'counter', 'Bytes of the request bodies.', [
+            (route_labels(key), m['bytes_out']) for key, m in snapshot.items()
+        ])
+        lines.append(f'# HELP {prefix}_phase_seconds Latency of the phases of API calls.')
+        lines.append(f'# TYPE {prefix}_phase_seconds summary')
+        for key, m in snapshot.items():
+            for phase, latency in m['latency'].items():
+                labels = _labels(route_labels(key) | {'phase': phase})
+                for q in PERCENTILES:
+                    lines.append(f'{prefix}_phase_seconds{{{labels},quantile="{q / 100}"}} {latency[f"p{q}"]}')
+                lines.append(f'{prefix}_phase_seconds_sum{{{labels}}} {m["seconds"][phase]}')
+                lines.append(f'{prefix}_phase_seconds_count{{{labels}}} {m["counts"][phase]}')
+        circuits = self.circuits()
+        if circuits:
+            family('circuit_state', 'gauge', 'State of the circuit breaker: 0 closed, 1 half-open, 2 open.', [
+                ({'group': group}, CIRCUIT_STATES[c['state']]) for group, c in circuits.items()
+            ])
+            family('circuit_opened_total', 'counter', 'Times the circuit breaker opened.', [
+                ({'group': group}, c['opened']) for group, c in circuits.items()
+            ])
+            family('circuit_rejected_total', 'counter', 'Requests failed fast by the open circuit breaker.', [
+                ({'group': group}, c['rejected']) for group, c in circuits.items()
+            ])
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: dict) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
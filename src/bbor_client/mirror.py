@@ -0,0 +1,341 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Union, Optional, Literal, Iterable, Any
+from .models.study import Study
+from .models.trial import Trial, Refine
+from .query import match, flatten_elem_match, get_value, normalize_path
+
+Collection = Literal['studies', 'trials', 'refines']
+
+# Indexed columns of each collection: column name -> (SQL type, path in the document)
+COLUMNS: dict[str, dict[str, tuple[str, str]]] = {
+    'studies': {
+        'id': ('TEXT PRIMARY KEY', '_id'),
+        'name': ('TEXT', 'study_name'),
+        'user_id': ('TEXT', 'user.id'),
+        'group_id': ('TEXT', 'group.id'),
+        'status': ('TEXT', 'status'),
+        'start_at': ('TEXT', 'start_at'),
+        'updated_at': ('TEXT', 'updated_at'),
+    },
+    'trials': {
+        'id': ('TEXT PRIMARY KEY', '_id'),
+        'study_id': ('TEXT', 'parent_study.id'),
+        'trial_num': ('INTEGER', 'trial_num'),
+        'rwp': ('REAL', 'result_refine.Rval.Rwp'),
+        'gof': ('REAL', 'result_refine.Rval.GOF'),
+        'converged': ('INTEGER', 'result_refine.Rval.converged'),
+        'start_at': ('TEXT', 'start_at'),
+    },
+    'refines': {
+        'id': ('TEXT PRIMARY KEY', '_id'),
+        'trial_id': ('TEXT', 'parent_trial.id'),
+        'sequence_index': ('INTEGER', 'sequence_index'),
+        'rwp': ('REAL', 'Rval.Rwp'),
+        'gof': ('REAL', 'Rval.GOF'),
+        'converged': ('INTEGER', 'Rval.converged'),
+        'start_at': ('TEXT', 'start_at'),
+    },
+}
+
+INDEXES: dict[str, list[tuple[str, ...]]] = {
+    'studies': [('name',), ('user_id',), ('group_id',), ('status',), ('start_at',)],
+    'trials': [('study_id', 'trial_num'), ('rwp',), ('gof',), ('converged',)],
+    'refines': [('trial_id', 'sequence_index'), ('rwp',), ('gof',), ('converged',)],
+}
+
+# Paths of the phase names, which are indexed in the phases table
+# Studies have a list of phases in samples, trials and refines have phases as keys of a dict
+PHASE_PATHS = {
+    'studies': 'samples.phases.name',
+    'trials': 'result_refine.phases',
+    'refines': 'phases',
+}
+
+MODELS = {
+    'studies': Study,
+    'trials': Trial,
+    'refines': Refine,
+}
+
+# Operators translated into SQL on the indexed columns. The others are evaluated on the documents in Python.
+SQL_OPERATORS = {
+    '$eq': '=',
+    '$gt': '>',
+    '$gte': '>=',
+    '$lt': '<',
+    '$lte': '<=',
+}
+
+
+class LocalMirror:
+    '''
+    A local SQLite mirror of studies, trials, and refines downloaded from the server.
+
+    The same MongoDB-style filters as find_studies, find_trials, and find_refines can be used.
+    Conditions on the indexed fields (ids, trial_num, Rwp, GOF, converged, phase names, ...) are executed in SQLite with the indexes,
+    and the rest of the filter is evaluated on the candidate documents.
+    '''
+    def __init__(
+            self,
+            path: Union[str, Path] = ':memory:',
+    ):
+        self.path = str(path)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            for collection, columns in COLUMNS.items():
+                definitions = ', '.join(f'{name} {sqltype}' for name, (sqltype, _) in columns.items())
+                self._conn.execute(f'CREATE TABLE IF NOT EXISTS {collection} ({definitions}, doc TEXT NOT NULL)')
+                for index in INDEXES[collection]:
+                    self._conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS idx_{collection}_{"_".join(index)} ON {collection} ({", ".join(index)})'
+                    )
+            self._conn.execute('CREATE TABLE IF NOT EXISTS phases (collection TEXT, doc_id TEXT, name TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_phases_name ON phases (collection, name, doc_id)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_phases_doc ON phases (collection, doc_id)')
+
+    ### Populate ###
+    @classmethod
+    def _phase_names(cls, collection: Collection, document: dict) -> list[str]:
+        if collection == 'studies':
+            return [
+                phase['name']
+                for sample in document.get('samples', [])
+                for phase in sample.get('phases', [])
+            ]
+        phases = get_value(document, PHASE_PATHS[collection])
+        return list(phases) if isinstance(phases, dict) else []
+
+    def add(
+            self,
+            collection: Collection,
+            documents: Iterable[Union[dict, Study, Trial, Refine]],
+    ) -> int:
+        '''Inserts or replaces documents received with return_dict=True (or models). Returns the number of documents.'''
+        columns = COLUMNS[collection]
+        placeholders = ', '.join('?' for _ in range(len(columns) + 1))
+        rows = []
+        phases = []
+        for document in documents:
+            if not isinstance(document, dict):
+                document = document.to_document()
+            row = [get_value(document, path) for _, path in columns.values()]
+            rows.append(row + [json.dumps(document)])
+            phases.extend((collection, row[0], name) for name in self._phase_names(collection, document))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'DELETE FROM phases WHERE collection = ? AND doc_id = ?',
+                [(collection, row[0]) for row in rows],
+            )
+            self._conn.executemany(f'INSERT OR REPLACE INTO {collection} VALUES ({placeholders})', rows)
+            self._conn.executemany('INSERT INTO phases VALUES (?, ?, ?)', phases)
+        return len(rows)
+
+    def add_studies(self, studies: Iterable[Union[dict, Study]]) -> int:
+        return self.add('studies', studies)
+
+    def add_trials(self, trials: Iterable[Union[dict, Trial]]) -> int:
+        return self.add('trials', trials)
+
+    def add_refines(self, refines: Iterable[Union[dict, Refine]]) -> int:
+        return self.add('refines', refines)
+
+    def pull(
+            self,
+            client,
+            query: dict = {},
+            trials: bool = True,
+            refines: bool = False,
+            batch_size: int = 100,
+    ) -> dict[str, int]:
+        '''
+        Downloads the studies matching the query, and optionally their trials and refines, into the mirror.
+
+        Args:
+            client: A logged-in BBORClient.
+            query: Filter of find_studies.
+        Returns:
+            dict of the collection and the number of documents added.
+        '''
+        studies = client.find_studies(query, return_dict=True)
+        if studies is None:
+            raise RuntimeError('Failed in getting studies')
+        counts = {'studies': self.add_studies(studies), 'trials': 0, 'refines': 0}
+        if not trials:
+            return counts
+        study_ids = [study['_id'] for study in studies]
+        for start in range(0, len(study_ids), batch_size):
+            ids = study_ids[start:start + batch_size]
+            found = client.find_trials({'parent_study.$id': {'$in': ids}}, return_dict=True)
+            if found is None:
+                raise RuntimeError('Failed in getting trials')
+            counts['trials'] += self.add_trials(found)
+            if not refines:
+                continue
+            trial_ids = [trial['_id'] for trial in found]
+            for trial_start in range(0, len(trial_ids), batch_size):
+                batch = trial_ids[trial_start:trial_start + batch_size]
+                found_refines = client.find_refines({'parent_trial.$id': {'$in': batch}}, return_dict=True)
+                if found_refines is None:
+                    raise RuntimeError('Failed in getting refines')
+                counts['refines'] += self.add_refines(found_refines)
+        return counts
+
+    def count(self, collection: Collection) -> int:
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {collection}').fetchone()[0]
+
+    ### Query ###
+    @classmethod
+    def _column_of(cls, collection: Collection, path: str) -> Optional[str]:
+        path = normalize_path(path)
+        for column, (_, column_path) in COLUMNS[collection].items():
+            if path == column_path or (column == 'id' and path == 'id'):
+                return column
+        return None
+
+    @classmethod
+    def _sql_value(cls, value) -> Any:
+        return int(value) if isinstance(value, bool) else value
+
+    @classmethod
+    def _is_sql_value(cls, value) -> bool:
+        return isinstance(value, (str, int, float, bool))
+
+    @classmethod
+    def _translate(
+            cls,
+            collection: Collection,
+            path: str,
+            condition,
+    ) -> Optional[tuple[str, list]]:
+        '''Translates a condition on an indexed field into SQL. Returns None if not translatable.'''
+        if isinstance(condition, dict) and all(key.startswith('$') for key in condition) and len(condition) > 0:
+            operators = condition
+        elif isinstance(condition, dict):
+            return None
+        else:
+            operators = {'$eq': condition}
+
+        # Phase names
+        phase_path = PHASE_PATHS[collection]
+        if collection == 'studies' and normalize_path(path) == phase_path:
+            names = None
+            if list(operators) == ['$eq'] and isinstance(operators['$eq'], str):
+                names = [operators['$eq']]
+            elif list(operators) == ['$in'] and all(isinstance(v, str) for v in operators['$in']):
+                names = list(operators['$in'])
+            if names is None:
+                return None
+            placeholders = ', '.join('?' for _ in names)
+            return f'id IN (SELECT doc_id FROM phases WHERE collection = ? AND name IN ({placeholders}))', [collection, *names]
+        if collection != 'studies' and path.startswith(phase_path + '.') and path.count('.') == phase_path.count('.') + 1:
+            if list(operators) != ['$exists']:
+                return None
+            name = path.rsplit('.', 1)[-1]
+            negation = '' if operators['$exists'] else 'NOT '
+            return f'id {negation}IN (SELECT doc_id FROM phases WHERE collection = ? AND name = ?)', [collection, name]
+
+        # Indexed columns
+        column = cls._column_of(collection, path)
+        if column is None:
+            return None
+        clauses, params = [], []
+        for op, operand in operators.items():
+            if op in SQL_OPERATORS and cls._is_sql_value(operand):
+                clauses.append(f'{column} {SQL_OPERATORS[op]} ?')
+                params.append(cls._sql_value(operand))
+            elif op == '$eq' and operand is None:
+                clauses.append(f'{column} IS NULL')
+            elif op == '$ne' and cls._is_sql_value(operand):
+                clauses.append(f'({column} IS NULL OR {column} != ?)')
+                params.append(cls._sql_value(operand))
+            elif op == '$in' and len(operand) > 0 and all(cls._is_sql_value(v) for v in operand):
+                clauses.append(f'{column} IN ({", ".join("?" for _ in operand)})')
+                params.extend(cls._sql_value(v) for v in operand)
+            elif op == '$nin' and all(cls._is_sql_value(v) for v in operand):
+                clauses.append(f'({column} IS NULL OR {column} NOT IN ({", ".join("?" for _ in operand)}))')
+                params.extend(cls._sql_value(v) for v in operand)
+            else:
+                return None
+        return ' AND '.join(clauses), params
+
+    def find(
+            self,
+            collection: Collection,
+            query: dict = {},
+            sort: Optional[list[tuple[str, int]]] = None,
+            limit: Optional[int] = None,
+            return_dict: bool = False,
+    ) -> list:
+        '''
+        Finds documents with a MongoDB-style filter.
+
+        Args:
+            sort: list of (path, 1 or -1), e.g. [('result_refine.Rval.Rwp', 1)].
+                Sorting by indexed fields is done in SQLite.
+            limit: Maximum number of documents.
+        '''
+        clauses, params, residual = [], [], {}
+        for path, condition in flatten_elem_match(query).items():
+            translated = None if path.startswith('$') else self._translate(collection, path, condition)
+            if translated is None:
+                residual[path] = condition
+            else:
+                clauses.append(translated[0])
+                params.extend(translated[1])
+
+        sql = f'SELECT doc FROM {collection}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(f'({clause})' for clause in clauses)
+        sort_columns = [(self._column_of(collection, path), order) for path, order in (sort or [])]
+        sort_in_sql = all(column is not None for column, _ in sort_columns)
+        if sort and sort_in_sql:
+            # NULLs last as in ascending sorts of the server
+            sql += ' ORDER BY ' + ', '.join(
+                f'{column} IS NULL, {column} {"ASC" if order > 0 else "DESC"}' for column, order in sort_columns
+            )
+        if limit is not None and not residual and (not sort or sort_in_sql):
+            sql += f' LIMIT {int(limit)}'
+
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            documents = [json.loads(doc) for doc, in cursor]
+        if residual:
+            documents = [document for document in documents if match(document, residual)]
+        if sort and not sort_in_sql:
+            # Stable sorts from the last key, NULLs last
+            for path, order in reversed(sort):
+                present = [d for d in documents if get_value(d, path) is not None]
+                missing = [d for d in documents if get_value(d, path) is None]
+                present.sort(key=lambda d: get_value(d, path), reverse=order < 0)
+                documents = present + missing
+        if limit is not None:
+            documents = documents[:limit]
+        if return_dict:
+            return documents
+        return [MODELS[collection].model_validate(document) for document in documents]
+
+    def find_studies(self, query: dict = {}, return_dict: bool = False, **kwargs) -> list:
+        return self.find('studies', query, return_dict=return_dict, **kwargs)
+
+    def find_trials(self, query: dict = {}, return_dict: bool = False, **kwargs) -> list:
+        return self.find('trials', query, return_dict=return_dict, **kwargs)
+
+    def find_refines(self, query: dict = {}, return_dict: bool = False, **kwargs) -> list:
+        return self.find('refines', query, return_dict=return_dict, **kwargs)
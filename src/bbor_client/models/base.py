@@ -1,4 +1,6 @@
+from typing import Any
 from pydantic import BaseModel, ConfigDict
+from pydantic.fields import FieldInfo
 from os import linesep as br
 
 
@@ -24,6 +26,29 @@ def repr_value(value, depth) -> str:
         return repr(value)
 
 
+def wire_key(field: FieldInfo, name: str) -> str:
+    '''Key of a field in the documents of the server, e.g. '_id' and 'trial_num' of the fields with only a validation_alias.'''
+    if field.serialization_alias is None and field.alias is None and isinstance(field.validation_alias, str):
+        return field.validation_alias
+    return field.serialization_alias or field.alias or name
+
+
+def to_document(value: Any, dumped: Any) -> Any:
+    '''Renames the keys of model_dump(by_alias=True) of value to those of the documents of the server.'''
+    if isinstance(value, BaseModel) and isinstance(dumped, dict):
+        document = dict(dumped)
+        for name, field in type(value).model_fields.items():
+            key = field.serialization_alias or field.alias or name
+            if key in document:
+                document[wire_key(field, name)] = to_document(getattr(value, name), document.pop(key))
+        return document
+    if isinstance(value, (list, tuple)) and isinstance(dumped, list):
+        return [to_document(v, d) for v, d in zip(value, dumped)]
+    if isinstance(value, dict) and isinstance(dumped, dict):
+        return {k: to_document(v, d) for (k, d), v in zip(dumped.items(), value.values())}
+    return dumped
+
+
 class ClientModel(BaseModel):
     model_config = ConfigDict(
         serialize_by_alias = True,
@@ -40,6 +65,10 @@ class ClientModel(BaseModel):
 
     def keylist(self):
         return list(self.keys())
+
+    def to_document(self) -> dict:
+        '''JSON-compatible dict in the shape of the documents of the server (as received with return_dict=True).'''
+        return to_document(self, self.model_dump(mode='json', by_alias=True))
     # @classmethod
     # def model_validate(cls, value, *arg, **kwargs):
     #     #NOTE: To inherit the private attribute '_id'
@@ -0,0 +1,141 @@
+import json
+import re
+from typing import Literal, Union, Any
+
+# The server returns study.trials_dataframe().to_json() encoded once more as a JSON string,
+# i.e. a JSON document of {column: {index: value}}, with datetimes and durations in milliseconds.
+
+# Optuna trials_dataframe column names and prefixes
+DATETIME_COLUMNS = ('datetime_start', 'datetime_complete')
+TIMEDELTA_COLUMNS = ('duration',)
+INT_COLUMNS = ('number',)
+FLOAT_PREFIXES = ('value', 'values_')
+PARAMS_PREFIX = 'params_'
+
+# ISO 8601 duration written by pandas with date_format='iso', e.g. 'P0DT0H0M1.500S'
+ISO_DURATION = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?$')
+
+
+def loads(content: Union[bytes, str]) -> dict[str, list]:
+    '''
+    Decodes the response body into columns of the trials dataframe.
+
+    Returns:
+        dict of column name and list of values ordered by the trial index.
+    '''
+    table: Any = json.loads(content)
+    if isinstance(table, str):
+        # Double-encoded JSON: the outer document is a JSON string of the inner document
+        table = json.loads(table)
+    if isinstance(table, list):
+        # orient='records'
+        names = list(dict.fromkeys(key for record in table for key in record))
+        return {name: [record.get(name) for record in table] for name in names}
+    if len(table) == 0:
+        return {}
+    # orient='columns'
+    index = sorted(next(iter(table.values())).keys(), key=int)
+    return {name: [column.get(i) for i in index] for name, column in table.items()}
+
+
+def _is_numeric(values: list) -> bool:
+    return all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values)
+
+
+def _iso_duration_ms(value: str) -> float:
+    match_ = ISO_DURATION.match(value)
+    if match_ is None:
+        raise ValueError(f'Invalid duration: {value}')
+    days, hours, minutes, seconds = (float(g) if g else 0. for g in match_.groups())
+    return ((days*24 + hours)*60 + minutes)*60*1000 + seconds*1000
+
+
+def _object_array(values: list):
+    import numpy as np
+    # Assigned one by one so that list values are not expanded into another dimension
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def to_numpy(columns: dict[str, list]) -> dict:
+    '''
+    Converts the columns into numpy arrays with the dtypes of an Optuna trials dataframe.
+
+    datetime_* columns become datetime64[ms], duration becomes timedelta64[ms],
+    number becomes int64, value(s) and numeric params_* become float64,
+    and the others (user_attrs_*, system_attrs_*, state, categorical params_*) become object arrays.
+    '''
+    import numpy as np
+
+    arrays = {}
+    for name, values in columns.items():
+        if name in DATETIME_COLUMNS:
+            if _is_numeric(values):
+                arrays[name] = np.array(
+                    [np.datetime64(int(v), 'ms') if v is not None else np.datetime64('NaT') for v in values],
+                    dtype = 'datetime64[ms]',
+                )
+            else:
+                arrays[name] = np.array(
+                    [v.rstrip('Z') if v is not None else 'NaT' for v in values],
+                    dtype = 'datetime64[ms]',
+                )
+        elif name in TIMEDELTA_COLUMNS:
+            arrays[name] = np.array(
+                [
+                    np.timedelta64('NaT') if v is None
+                    else np.timedelta64(int(round(v if not isinstance(v, str) else _iso_duration_ms(v))), 'ms')
+                    for v in values
+                ],
+                dtype = 'timedelta64[ms]',
+            )
+        elif name in INT_COLUMNS and all(v is not None for v in values):
+            arrays[name] = np.array(values, dtype='int64')
+        elif (name.startswith(FLOAT_PREFIXES) or name.startswith(PARAMS_PREFIX)) and _is_numeric(values):
+            arrays[name] = np.array([np.nan if v is None else v for v in values], dtype='float64')
+        else:
+            arrays[name] = _object_array(values)
+    return arrays
+
+
+def to_pandas(columns: dict[str, list]):
+    '''Builds a pandas.DataFrame column-wise from the typed numpy arrays.'''
+    import pandas as pd
+    return pd.DataFrame(to_numpy(columns))
+
+
+def to_arrow(columns: dict[str, list]):
+    '''
+    Builds a pyarrow.Table from the typed numpy arrays.
+    Object columns which cannot be typed by pyarrow (e.g. params with mixed types) are stored as JSON strings.
+    '''
+    import pyarrow as pa
+
+    arrays = {}
+    for name, values in to_numpy(columns).items():
+        if values.dtype != object:
+            arrays[name] = pa.array(values)
+            continue
+        try:
+            arrays[name] = pa.array(values.tolist())
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays[name] = pa.array([None if v is None else json.dumps(v) for v in values.tolist()], type=pa.string())
+    return pa.table(arrays)
+
+
+def decode(
+        content: Union[bytes, str],
+        backend: Literal['pandas', 'numpy', 'arrow'] = 'pandas',
+):
+    '''Decodes the response body of /study/{study_name}/optunadf into the backend's table.'''
+    columns = loads(content)
+    if backend == 'pandas':
+        return to_pandas(columns)
+    elif backend == 'numpy':
+        return to_numpy(columns)
+    elif backend == 'arrow':
+        return to_arrow(columns)
+    else:
+        raise ValueError(f'Unknown backend "{backend}". Choose from "pandas", "numpy", or "arrow".')
@@ -1,8 +1,9 @@
 import json
-from pydantic import BaseModel, Field, StringConstraints, model_validator, field_validator, ConfigDict
-from typing import Annotated, Optional, BinaryIO, ClassVar
+from pydantic import BaseModel, Field, StringConstraints, model_validator, field_validator, ConfigDict, ValidationInfo
+from typing import Annotated, Optional, BinaryIO
 from io import BufferedReader
 from ...util import get_file_size_from_binaryio
+from ...parsers.encoding import MeasurementEncoding
 from ...conf import MAX_STUDY_NAME_LENGTH, MIN_STUDY_NAME_LENGTH, MAX_N_TRIALS_TOTAL, DEFAULT_N_TRIALS_TOTAL, MAX_RANDOM_SEED, MAX_FILE_NAME_LENGTH, MAX_FILE_SIZE, MAX_MEAS_FILESIZE
 
 StudyNameConstraints = StringConstraints(
@@ -26,6 +27,16 @@ FileNameConstraints = StringConstraints(
     # Allow alphanumeric, underscore, hyphen, dot, space, and CJK characters
 )
 
+def registered_files(info: ValidationInfo, name: str) -> Optional[list[str]]:
+    '''
+    The file list of the client given as the validation context, e.g.
+    PostStudyServerParams.model_validate(params, context={'prm_file_list': [...]}).
+    None without the context, in which case the names are not checked here but by the server.
+    '''
+    if info.context and name in info.context:
+        return info.context[name]
+    return None
+
 class StudyName(BaseModel):
     study_name: Annotated[str, StudyNameConstraints] = Field()
 
@@ -76,6 +87,7 @@ class GPXFile(BaseModel):
 class MeasurementFile(BaseModel):
     measurement_filecontent: Optional[BufferedReader] = Field(None, exclude=True)
     measurement_filename: Optional[Annotated[str, FileNameConstraints]] = None
+    measurement_encoding: Optional[MeasurementEncoding] = None # None for plain CSV
     model_config = ConfigDict(
         arbitrary_types_allowed=True,
     )
@@ -100,24 +112,24 @@ class MeasurementFile(BaseModel):
 
 class PRMFile(BaseModel):
     prm_filename: Optional[Annotated[str, FileNameConstraints]] = None
-    prm_file_list: ClassVar[list[str]] = [] # Dynamically populated at runtime
 
     @field_validator('prm_filename', mode='after')
-    def check_if_prm_file_exists_on_server(cls, filename):
-        if filename is not None and filename not in cls.prm_file_list:
+    def check_if_prm_file_exists_on_server(cls, filename, info: ValidationInfo):
+        prm_file_list = registered_files(info, 'prm_file_list')
+        if filename is not None and prm_file_list is not None and filename not in prm_file_list:
             raise ValueError(f'{filename} does not exist on the server. You need to upload it first.')
         return filename
 
 class CIFFile(BaseModel):
     cif_filenames: Optional[list[Annotated[str, FileNameConstraints]]] = None
-    cif_file_list: ClassVar[list[str]] = [] # Dynamically populated at runtime
 
     @field_validator('cif_filenames', mode='after')
-    def check_if_cif_file_exists_on_server(cls, filenames):
-        if filenames is None:
+    def check_if_cif_file_exists_on_server(cls, filenames, info: ValidationInfo):
+        cif_file_list = registered_files(info, 'cif_file_list')
+        if filenames is None or cif_file_list is None:
             return filenames
         for filename in filenames:
-            if filename not in cls.cif_file_list:
+            if filename not in cif_file_list:
                 raise ValueError(f'{filename} does not exist on the server. You need to upload it first.')
         return filenames
 
@@ -156,11 +168,11 @@ class InputFiles(
 class Sequence(BaseModel):
     sequence: str
     # sequence_args_json: Optional[str] = Field(None)
-    sequence_list: ClassVar[list[str]] = [] # Dynamically populated at runtime
 
     @field_validator('sequence', mode='after')
-    def check_if_sequence_in_list(cls, sequence):
-        if sequence not in cls.sequence_list:
+    def check_if_sequence_in_list(cls, sequence, info: ValidationInfo):
+        sequence_list = registered_files(info, 'sequence_list')
+        if sequence_list is not None and sequence not in sequence_list:
             raise ValueError(f'{sequence} is not a valid sequence. Please choose from the available sequences.')
         return sequence
     
@@ -1,9 +1,18 @@
-import io
+import re
 import pandas as pd
-from .interface import ParserInterface, ParsedData
+from .interface import ParserInterface, ParsedData, Buffer, as_stream
+
+# Two space-separated numeric columns, e.g. '10.00 1234'
+NUMERIC = r'[\+\-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][\+\-]?\d+)?'
+DPATTERN = re.compile(rf'^{NUMERIC} {NUMERIC}$')
 
 
 class Parser(ParserInterface):
+    @classmethod
+    def sniff(cls, head: str) -> bool:
+        lines = [line for line in head.splitlines()[:-1] if line] # The last line may be truncated
+        return len(lines) > 0 and all(DPATTERN.match(line) for line in lines)
+
     @classmethod
     def _validate(cls, df):
         if (df.dtypes==float).all() is False:
@@ -11,7 +20,10 @@ class Parser(ParserInterface):
 
 
     def _parse(self, content:str) -> ParsedData:
-        df = pd.read_csv(io.StringIO(content), sep=' ', header=None)
+        return self._parse_buffer(content.encode('utf-8'))
+
+    def _parse_buffer(self, buffer: Buffer) -> ParsedData:
+        df = pd.read_csv(as_stream(buffer), sep=' ', header=None)
         header = ''
         twotheta = df[0]
         counts = df[1]
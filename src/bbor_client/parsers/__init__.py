@@ -1,6 +1,10 @@
-from .selector import selector
+from .selector import selector, register_parser, get_parser
+from .parallel import parse_many, ParseResult
 
 __all__ = [
     selector.__name__,
+    register_parser.__name__,
+    get_parser.__name__,
+    parse_many.__name__,
+    ParseResult.__name__,
 ]
-
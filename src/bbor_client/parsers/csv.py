@@ -1,6 +1,6 @@
-import io, re
+import re
 import pandas as pd
-from .interface import ParserInterface, ParsedData
+from .interface import ParserInterface, ParsedData, Buffer, iter_lines, as_stream
 
 # Text pattern for the main count data part
 SEP = r'[,\s]'
@@ -20,6 +20,9 @@ MIN_MATCHING_LINES = 10
 # Maximum number of lines to read in detecting the start of the main part
 MAX_READ_LINES = 200 # 
 
+# Minimum number of lines that must match the pattern in sniffing the head of the file
+MIN_SNIFF_LINES = 2
+
 class Parser(ParserInterface):
 
     @classmethod
@@ -27,6 +30,11 @@ class Parser(ParserInterface):
         if (df.dtypes==float).all() is False:
             raise ValueError
 
+    @classmethod
+    def sniff(cls, head: str) -> bool:
+        lines = head.splitlines()[:-1] # The last line may be truncated
+        return sum(DPATTERN.match(line) is not None for line in lines) >= MIN_SNIFF_LINES
+
     @classmethod
     def _sep_selector(cls, sep_string: str) -> str:
         if ',' in sep_string:
@@ -40,15 +48,19 @@ class Parser(ParserInterface):
         return sep # type: ignore
 
     @classmethod
-    def _detect_header_separator(cls, content: str) -> tuple[str, int, str]:
+    def _detect_header_separator(cls, buffer: Buffer) -> tuple[str, int, str]:
+        '''Returns the header, the byte offset of the main part, and the separator string.'''
         count_dlines = 0
-        for i,line in enumerate(content.splitlines()):
+        offsets = [] # Byte offsets of the lines read
+        for i,(offset,line) in enumerate(iter_lines(buffer)):
+            offsets.append(offset)
             if match_ := DPATTERN.match(line):
                 if count_dlines >= MIN_MATCHING_LINES:
                     header_count = i - count_dlines
-                    header = '\n'.join(content.splitlines()[:header_count])
+                    data_offset = offsets[header_count]
+                    header = '\n'.join(buffer[:data_offset].decode('utf-8').splitlines())
                     sep = match_.group(1)
-                    return header, header_count, sep
+                    return header, data_offset, sep
                 count_dlines += 1
             elif i < MAX_READ_LINES:
                 continue
@@ -57,12 +69,15 @@ class Parser(ParserInterface):
         raise ValueError('Maybe measurement file too short?')
 
     def _parse(self, content: str) -> ParsedData:
-        header, skiprows, sep_string = self._detect_header_separator(content)
+        return self._parse_buffer(content.encode('utf-8'))
+
+    def _parse_buffer(self, buffer: Buffer) -> ParsedData:
+        # Only the header part is decoded. The main part is read by pandas directly from the buffer.
+        header, data_offset, sep_string = self._detect_header_separator(buffer)
         sep = self._sep_selector(sep_string)
         df = pd.read_csv(
-            io.StringIO(content),
+            as_stream(buffer, data_offset),
             sep = sep, # type: ignore
-            skiprows=skiprows,
             header=None,
             usecols = [0,1],
         )
@@ -0,0 +1,89 @@
+import gzip
+import struct
+import sys
+from array import array
+from typing import Literal, Sequence, get_args
+
+MeasurementEncoding = Literal['csv', 'csv.gz', 'float32', 'float64']
+MEASUREMENT_ENCODINGS: tuple = get_args(MeasurementEncoding)
+
+# Binary histogram container
+# | magic (8 bytes) | version (uint8) | typecode (1 byte, 'f' or 'd') | n_points (uint64) | twotheta[n_points] | counts[n_points] |
+# All the values are little-endian.
+MAGIC = b'BBORHIST'
+VERSION = 1
+HEADER = struct.Struct('<8sBcQ')
+TYPECODES = {'float32': 'f', 'float64': 'd'}
+
+FILE_SUFFIXES = {
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+    'float32': '.bhist',
+    'float64': '.bhist',
+}
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'float32': 'application/octet-stream',
+    'float64': 'application/octet-stream',
+}
+
+
+def _to_csv(twotheta: Sequence[float], counts: Sequence[float]) -> bytes:
+    # GSASII does not require title line
+    return ''.join(
+        f'{ttheta},{count}\n' for ttheta, count in zip(twotheta, counts)
+    ).encode('utf-8')
+
+
+def _to_binary(twotheta: Sequence[float], counts: Sequence[float], typecode: str) -> bytes:
+    twotheta = array(typecode, twotheta)
+    counts = array(typecode, counts)
+    if sys.byteorder == 'big':
+        twotheta.byteswap()
+        counts.byteswap()
+    header = HEADER.pack(MAGIC, VERSION, typecode.encode(), len(twotheta))
+    return header + twotheta.tobytes() + counts.tobytes()
+
+
+def encode_histogram(
+        twotheta: Sequence[float],
+        counts: Sequence[float],
+        encoding: MeasurementEncoding = 'csv',
+) -> bytes:
+    '''Encodes a histogram for the upload to the API server.'''
+    if encoding == 'csv':
+        return _to_csv(twotheta, counts)
+    elif encoding == 'csv.gz':
+        return gzip.compress(_to_csv(twotheta, counts), compresslevel=6)
+    elif encoding in TYPECODES:
+        return _to_binary(twotheta, counts, TYPECODES[encoding])
+    else:
+        raise ValueError(f'Unknown measurement encoding "{encoding}". Choose from {MEASUREMENT_ENCODINGS}.')
+
+
+def decode_histogram(
+        data: bytes,
+        encoding: MeasurementEncoding = 'csv',
+) -> tuple[Sequence[float], Sequence[float]]:
+    '''Decodes an encoded histogram into twotheta and counts. The inverse of encode_histogram.'''
+    if encoding == 'csv.gz':
+        data = gzip.decompress(data)
+        encoding = 'csv'
+    if encoding == 'csv':
+        rows = [line.split(',') for line in data.decode('utf-8').splitlines() if line]
+        return [float(row[0]) for row in rows], [float(row[1]) for row in rows]
+    elif encoding in TYPECODES:
+        magic, version, typecode, n_points = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a histogram container of a supported version')
+        values = array(typecode.decode())
+        values.frombytes(data[HEADER.size:HEADER.size + 2*n_points*values.itemsize])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values[:n_points], values[n_points:]
+    else:
+        raise ValueError(f'Unknown measurement encoding "{encoding}". Choose from {MEASUREMENT_ENCODINGS}.')
+
+
+
@@ -1,15 +1,51 @@
 from abc import ABC, abstractmethod
-from typing import Union, Optional
+from typing import Union, Optional, Sequence, Iterator, BinaryIO
 from pathlib import Path
+from contextlib import contextmanager
 import io
+import os
+import mmap
 from dataclasses import dataclass
+from .encoding import MeasurementEncoding, FILE_SUFFIXES, encode_histogram
+
+# bytes or mmap.mmap of the whole file content
+Buffer = Union[bytes, mmap.mmap]
+
+
+@contextmanager
+def map_file(filepath: Union[str,Path]) -> Iterator[Buffer]:
+    '''Memory-maps a file for reading. An empty file is given as b'' because it cannot be mapped.'''
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+
+def iter_lines(buffer: Buffer, start: int = 0) -> Iterator[tuple[int, str]]:
+    '''Yields the byte offset and the decoded text of each line, without decoding the whole buffer.'''
+    end = len(buffer)
+    while start < end:
+        stop = buffer.find(b'\n', start)
+        if stop == -1:
+            stop = end
+        yield start, buffer[start:stop].decode('utf-8').rstrip('\r')
+        start = stop + 1
+
+
+def as_stream(buffer: Buffer, offset: int = 0) -> BinaryIO:
+    '''Returns a file-like object reading the buffer from the offset without copying it.'''
+    stream = buffer if isinstance(buffer, mmap.mmap) else io.BytesIO(buffer)
+    stream.seek(offset)
+    return stream # type: ignore
 
 
 @dataclass
 class ParsedData:
     header: str
-    twotheta: list[float]
-    counts: list[float]
+    twotheta: Sequence[float] # list, or array.array when transferred from a worker process
+    counts: Sequence[float]
 
 
 class ParserInterface(ABC):
@@ -17,16 +53,26 @@ class ParserInterface(ABC):
             self,
             filepath: Optional[Union[str,Path]] = None,
             filename: Optional[str] = None,
-            filecontent: Optional[bytes] = None,
+            filecontent: Optional[Buffer] = None,
+            histograms: Optional[list[ParsedData]] = None,
     ):
         # Populate path-related variables
         if filepath:
             filepath = Path(filepath)
-            filename = filepath.name
-            filecontent = filepath.read_bytes()
-        
+            with map_file(filepath) as buffer:
+                self._populate(filepath.name, buffer, histograms)
+        else:
+            self._populate(filename, filecontent, histograms)
+
+    def _populate(
+            self,
+            filename: Optional[str],
+            filecontent: Optional[Buffer],
+            histograms: Optional[list[ParsedData]],
+    ):
         assert filename is not None, 'Either filepath or filename must be provided.'
-        assert filecontent is not None, 'Either filepath or filecontent must be provided.'
+        assert filecontent is not None or histograms is not None, \
+            'Either filepath, filecontent, or already parsed histograms must be provided.'
 
         # self._path = filepath.as_posix() #NOTE: Parser should not have file location info
         self._name = filename
@@ -34,14 +80,32 @@ class ParserInterface(ABC):
         self._csvname = filename.rsplit('.',1)[0] + '.csv'
 
         # Parse the file and populate variables of measurement data
-        data = self._parse(filecontent.decode('utf-8'))
-        self._header = data.header
-        self._twotheta = data.twotheta
-        self._counts = data.counts
+        # A parser returns a list of ParsedData when the file contains multiple scans
+        if histograms is None:
+            data = self._parse_buffer(filecontent) # type: ignore
+            histograms = data if isinstance(data, list) else [data]
+        self._histograms = histograms
+        if len(self._histograms) == 0:
+            raise ValueError(f'No histogram found in {filename}')
+        self._header = self._histograms[0].header
+        self._twotheta = self._histograms[0].twotheta
+        self._counts = self._histograms[0].counts
 
 
     @abstractmethod
-    def _parse(self, content:str) -> ParsedData:...
+    def _parse(self, content:str) -> Union[ParsedData, list[ParsedData]]:...
+
+    def _parse_buffer(self, buffer: Buffer) -> Union[ParsedData, list[ParsedData]]:
+        '''
+        Parses the file content given as bytes or a memory-mapped file.
+        Override this to parse the buffer directly without decoding the whole content to str.
+        '''
+        return self._parse(buffer[:].decode('utf-8'))
+
+    @classmethod
+    def sniff(cls, head: str) -> bool:
+        '''Returns True if the head of the file content looks parsable. Used for choosing a parser.'''
+        return False
 
 
     # @property
@@ -60,21 +124,39 @@ class ParserInterface(ABC):
     def header(self) -> str:
         return self._header
     @property
-    def twotheta(self) -> list[float]:
+    def twotheta(self) -> Sequence[float]:
         return self._twotheta
     @property
-    def counts(self) -> list[float]:
+    def counts(self) -> Sequence[float]:
         return self._counts
+    @property
+    def histograms(self) -> list[ParsedData]:
+        return self._histograms
+    @property
+    def n_histograms(self) -> int:
+        return len(self._histograms)
 
-    def _to_csv_bytesio(self) -> io.BufferedReader:
+    def histogram_csvname(self, index: int = 0) -> str:
+        '''Returns the CSV file name for the index-th histogram, e.g. sample_scan002.csv'''
+        if self.n_histograms == 1:
+            return self.csvname
+        return self.csvname.rsplit('.',1)[0] + f'_scan{index:03d}.csv'
+
+    def upload_filename(self, index: int = 0, encoding: MeasurementEncoding = 'csv') -> str:
+        '''Returns the file name of the index-th histogram uploaded with the encoding, e.g. sample_scan002.csv.gz'''
+        return self.histogram_csvname(index).rsplit('.',1)[0] + FILE_SUFFIXES[encoding]
+
+    def _to_csv_bytesio(self, index: int = 0) -> io.BufferedReader:
         '''Converts histogram data to CSV format and returns as an IO object for the API upload.'''
-        output = io.StringIO()
-        # output.write("2Theta,Counts\n") # GSASII does not require title line
-        for ttheta, count in zip(self.twotheta, self.counts):
-            output.write(f'{ttheta},{count}\n')
-        output.seek(0)
+        return self._to_upload_bytesio(index, encoding='csv')
+
+    def _to_upload_bytesio(self, index: int = 0, encoding: MeasurementEncoding = 'csv') -> io.BufferedReader:
+        '''
+        Encodes histogram data and returns as an IO object for the API upload.
+        The encoding is either plain CSV, gzip-compressed CSV, or a binary float32/float64 container.
+        '''
+        histogram = self._histograms[index]
         return io.BufferedReader(
-            io.BytesIO(output.read().encode('utf-8'))
+            io.BytesIO(encode_histogram(histogram.twotheta, histogram.counts, encoding))
         )
 
-
@@ -0,0 +1,95 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional, Union, Type
+from xml.parsers.expat import ExpatError
+from .interface import ParserInterface, ParsedData, map_file
+from .selector import selector, SNIFF_BYTES
+
+# Errors of reading and parsing a file reported in its ParseResult: malformed contents raise ValueError,
+# LookupError (missing keys or columns), ArithmeticError, or ExpatError (XML), and a missing parser module ImportError
+PARSE_ERRORS = (OSError, ValueError, LookupError, TypeError, ArithmeticError, StopIteration, ImportError, ExpatError)
+
+
+@dataclass
+class ParseResult:
+    path: str
+    parser: Optional[ParserInterface] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _parse_file(
+        path: str,
+) -> tuple[str, Optional[Type[ParserInterface]], Optional[list[ParsedData]], Optional[str]]:
+    '''
+    Parses a file in a worker process.
+
+    The histograms are returned as array.array which is pickled as a raw buffer,
+    instead of lists of Python floats.
+    '''
+    try:
+        filepath = Path(path)
+        with map_file(filepath) as buffer:
+            parser_class = selector(filepath.name, head=buffer[:SNIFF_BYTES])
+            parser = parser_class(filename=filepath.name, filecontent=buffer)
+        histograms = [
+            ParsedData(
+                header = h.header,
+                twotheta = array('d', h.twotheta),
+                counts = array('d', h.counts),
+            )
+            for h in parser.histograms
+        ]
+        return path, parser_class, histograms, None
+    except PARSE_ERRORS as e:
+        return path, None, None, f'{type(e).__name__}: {e}'
+
+
+def parse_many(
+        paths: Iterable[Union[str, Path]],
+        workers: Optional[int] = None,
+        chunksize: int = 1,
+) -> list[ParseResult]:
+    '''
+    Parses measurement files in a process pool.
+
+    Args:
+        paths: Paths of the measurement files.
+        workers: Number of worker processes. os.cpu_count() is used when None.
+            The files are parsed in the current process when workers=1.
+        chunksize: Number of files sent to a worker at once. Larger values reduce the overhead for many small files.
+
+    Returns:
+        ParseResults in the same order as the paths.
+        A file failed in parsing has a ParseResult with the error message instead of raising an exception.
+    '''
+    paths = [str(path) for path in paths]
+    if workers == 1:
+        outputs = map(_parse_file, paths)
+        return [_to_result(*output) for output in outputs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        outputs = executor.map(_parse_file, paths, chunksize=chunksize)
+        return [_to_result(*output) for output in outputs]
+
+
+def _to_result(
+        path: str,
+        parser_class: Optional[Type[ParserInterface]],
+        histograms: Optional[list[ParsedData]],
+        error: Optional[str],
+) -> ParseResult:
+    if error is not None or parser_class is None:
+        return ParseResult(path=path, error=error)
+    parser = parser_class(
+        filename = Path(path).name,
+        histograms = histograms,
+    )
+    return ParseResult(path=path, parser=parser)
+
+
+
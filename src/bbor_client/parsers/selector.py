@@ -1,13 +1,124 @@
 import importlib
-from typing import Type
+import sys
+import threading
+from typing import Type, Union, Optional
 from .interface import ParserInterface
 
+# Entry point group for third-party parsers, e.g. in the pyproject.toml of a plugin package
+# [project.entry-points."bbor_client.parsers"]
+# rasx = "my_package.rasx:Parser"
+ENTRY_POINT_GROUP = 'bbor_client.parsers'
+
+# Number of bytes read from the head of a file for content sniffing
+SNIFF_BYTES = 4*1024
+
+# Parsers keyed by file extension. Values are module paths of the built-in parsers,
+# entry points, or parser classes, and are resolved to classes only on first use.
+_registry: dict = {
+    'xrdml': 'bbor_client.parsers.xrdml',
+    'csv': 'bbor_client.parsers.csv',
+    '2ta': 'bbor_client.parsers.2ta',
+}
+_resolved: dict[str, Type[ParserInterface]] = {}
+_entry_points_loaded = False
+_lock = threading.RLock()
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    from importlib.metadata import entry_points
+    if sys.version_info >= (3, 10):
+        eps = entry_points(group=ENTRY_POINT_GROUP)
+    else:
+        eps = entry_points().get(ENTRY_POINT_GROUP, [])
+    for ep in eps:
+        # Built-in and explicitly registered parsers take precedence
+        _registry.setdefault(ep.name.lower(), ep)
+    _entry_points_loaded = True
+
+
+def register_parser(
+        extension: str,
+        parser: Union[str, Type[ParserInterface]],
+) -> None:
+    '''
+    Registers a parser class for a file extension.
+
+    The parser can be given as a class or as a module path which has a class named Parser.
+    A parser registered here overrides the built-in and entry-point parsers of the same extension.
+    '''
+    extension = extension.lower().lstrip('.')
+    with _lock:
+        _registry[extension] = parser
+        _resolved.pop(extension, None)
+
+
+def get_parser(
+        extension: str,
+) -> Type[ParserInterface]:
+    '''Returns the parser class registered for the extension. Modules are imported only once.'''
+    extension = extension.lower().lstrip('.')
+    if extension in _resolved:
+        return _resolved[extension]
+    with _lock:
+        if extension not in _registry:
+            _load_entry_points()
+        if extension not in _registry:
+            raise ValueError(f'No parser is registered for the extension "{extension}"')
+        entry = _registry[extension]
+        if isinstance(entry, str):
+            parser = importlib.import_module(entry).Parser
+        elif isinstance(entry, type):
+            parser = entry
+        else: # entry point
+            parser = entry.load()
+        _resolved[extension] = parser
+        return parser
+
+
+def sniff(
+        head: bytes,
+) -> Optional[Type[ParserInterface]]:
+    '''Returns the first registered parser which recognizes the head of the file content.'''
+    text = head[:SNIFF_BYTES].decode('utf-8', errors='ignore')
+    with _lock:
+        _load_entry_points()
+        extensions = list(_registry)
+    for extension in extensions:
+        try:
+            parser = get_parser(extension)
+        except ImportError:
+            # An optional dependency of the parser is not installed
+            continue
+        if parser.sniff(text):
+            return parser
+    return None
+
+
 def selector(
         filename: str,
+        head: Optional[bytes] = None,
 ) -> Type[ParserInterface]:
+    '''
+    Chooses a parser from the file extension.
+
+    When the head of the file content is given, the parser is checked against the content
+    and another parser recognizing the content is chosen if the extension does not tell the truth.
+    '''
     extension = filename.lower().split('.')[-1]
-    module = importlib.import_module(f'bbor_client.parsers.{extension}')
-    return module.Parser
+    try:
+        parser = get_parser(extension)
+    except ValueError:
+        parser = None
+    if head is not None:
+        text = head[:SNIFF_BYTES].decode('utf-8', errors='ignore')
+        if parser is None or not parser.sniff(text):
+            parser = sniff(head) or parser
+    if parser is None:
+        raise ValueError(f'No parser found for {filename}')
+    return parser
 
 
 
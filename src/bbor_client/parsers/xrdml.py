@@ -1,23 +1,25 @@
 import xmltodict
 import re
-from .interface import ParserInterface, ParsedData
+from .interface import ParserInterface, ParsedData, Buffer, as_stream
 
 
 class Parser(ParserInterface):
 
     @classmethod
-    def _remove_counts(cls, original: str) -> str:
+    def _remove_counts(cls, original: Buffer) -> str:
         '''Removes counts strings and returns only header information as string.'''
-        pattern = r'(?<=\<counts unit="counts"\>)[\d.\s\n]+(?=\</counts\>)'
-        removed = re.sub(pattern, '', original)
-        return removed
+        pattern = rb'(?<=\<counts unit="counts"\>)[\d.\s\n]+(?=\</counts\>)'
+        removed = re.sub(pattern, b'', original)
+        return removed.decode('utf-8')
 
 
-    def _parse(self, content: str) -> ParsedData:
-        self._data = xmltodict.parse(content)
-        header = self._remove_counts(content)
+    @classmethod
+    def sniff(cls, head: str) -> bool:
+        return '<xrdMeasurements' in head
 
-        scan_data = self._data['xrdMeasurements']['xrdMeasurement']['scan']
+    @classmethod
+    def _parse_scan(cls, scan_data: dict, header: str) -> ParsedData:
+        '''Extracts the histogram of a single scan element.'''
         data_points =  scan_data['dataPoints']
         count_data = data_points['counts']['#text']
         angle_data = data_points['positions']
@@ -38,6 +40,23 @@ class Parser(ParserInterface):
         )
 
 
+    def _parse(self, content: str) -> list[ParsedData]:
+        return self._parse_buffer(content.encode('utf-8'))
+
+    def _parse_buffer(self, buffer: Buffer) -> list[ParsedData]:
+        # Time-resolved and in-situ measurements have multiple xrdMeasurement and/or scan elements
+        self._data = xmltodict.parse(
+            as_stream(buffer),
+            force_list = ('xrdMeasurement', 'scan', 'positions'),
+        )
+        header = self._remove_counts(buffer)
+
+        return [
+            self._parse_scan(scan_data, header)
+            for measurement in self._data['xrdMeasurements']['xrdMeasurement']
+            for scan_data in measurement.get('scan', [])
+        ]
+
 
 
 
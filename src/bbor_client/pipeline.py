@@ -0,0 +1,289 @@
+import math
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Optional, Iterable, Callable, Any
+import requests
+from requests.models import Response
+from .client import BBORClient, PreparedStudy, UploadedFiles
+from .parsers.parallel import PARSE_ERRORS
+from . import deadline
+
+STAGES = ('prepare', 'upload', 'post')
+
+# Failures of a study task: invalid arguments, missing or unparsable files, failed requests, and the deadline
+STUDY_ERRORS = PARSE_ERRORS + (requests.RequestException,)
+
+# Put into the queue of the next stage when all the workers of a stage have finished
+_DONE = object()
+
+
+@dataclass
+class StageMetrics:
+    '''Items processed by a stage, and the seconds its workers spent working and blocked on the full next queue.'''
+    workers: int
+    items: int = 0
+    errors: int = 0
+    busy: float = 0.
+    blocked: float = 0.
+    started_at: Optional[float] = None  # perf_counter
+    finished_at: Optional[float] = None
+
+    @property
+    def wall(self) -> float:
+        if self.started_at is None:
+            return 0.
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        '''Items per second of the stage.'''
+        return self.items / self.wall if self.wall > 0 else 0.
+
+    @property
+    def utilization(self) -> float:
+        '''Fraction of the time the workers were busy. A stage near 1 is the bottleneck.'''
+        return self.busy / (self.wall * self.workers) if self.wall > 0 else 0.
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'errors': self.errors,
+            'busy': self.busy,
+            'blocked': self.blocked,
+            'wall': self.wall,
+            'throughput': self.throughput,
+            'utilization': self.utilization,
+        }
+
+
+@dataclass
+class PipelineResult:
+    '''Result of a study task of the batch, in the order of the arguments.'''
+    index: int
+    params: dict[str, Any]
+    responses: list[Response] = field(default_factory=list)
+    error: Optional[BaseException] = None
+    traceback: Optional[str] = None  # of the error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and len(self.responses) > 0 and all(
+            r is not None and r.status_code in (200, 202) for r in self.responses
+        )
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self.traceback = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+    def study_id(self, index: int) -> Optional[str]:
+        '''Id of the study posted (or found) for the scan of index, or None if it failed.'''
+        if index >= len(self.responses):
+            return None
+        response = self.responses[index]
+        if response is None or response.status_code not in (200, 202):
+            return None
+        return response.json()['study_id']
+
+
+class _Item:
+    def __init__(self, index: int, params: dict[str, Any]):
+        self.result = PipelineResult(index, params)
+        self.prepared: Optional[PreparedStudy] = None
+        # scan index -> (item, scan index) of the same fingerprint earlier in the batch
+        self.duplicates: dict[int, tuple['_Item', int]] = {}
+        self.finished = threading.Event()  # set when the item has passed all the stages
+
+
+class SubmissionPipeline:
+    '''
+    Posts a batch of study tasks in three stages connected by bounded queues,
+    so that the measurement file of the next task is parsed while the earlier ones are uploading and posting.
+
+    prepare: validates the arguments, parses and encodes the measurement file, and computes the fingerprints.
+    upload: looks up the studies already posted, and uploads the PRM and CIF files, each file once in a batch.
+    post: posts the study tasks.
+
+    A task failing in a stage is passed through the rest with its error, and the others are processed.
+    If params raises, the error is the result of the next task and no more tasks are taken.
+    A task of the same fingerprint as an earlier task of the batch is not posted, and gets the study of the earlier one.
+    Parsing runs in threads, so prepare_workers > 1 helps only while the parsers release the GIL (reading files).
+
+    Args:
+        client: A logged-in client.
+        prepare_workers, post_workers: Threads of the stages. Uploads run in one thread.
+        queue_size: Tasks waiting between the stages at most.
+        deduplicate: See BBORClient.post_bborietveld_study_task.
+    '''
+    def __init__(
+            self,
+            client: BBORClient,
+            prepare_workers: int = 1,
+            post_workers: int = 2,
+            queue_size: int = 4,
+            deduplicate: bool = True,
+    ):
+        if min(prepare_workers, post_workers, queue_size) < 1:
+            raise ValueError('prepare_workers, post_workers, and queue_size must be positive')
+        self.client = client
+        self.workers = {'prepare': prepare_workers, 'upload': 1, 'post': post_workers}
+        self.queue_size = queue_size
+        self.deduplicate = deduplicate
+        self.stages: dict[str, StageMetrics] = {}
+        self._lock = threading.Lock()
+
+    def metrics(self) -> dict[str, dict[str, Any]]:
+        '''{stage: StageMetrics.to_dict()} of the last run.'''
+        with self._lock:
+            return {name: stage.to_dict() for name, stage in self.stages.items()}
+
+    def _put(self, stage: StageMetrics, output: queue.Queue, item: Any):
+        start = time.perf_counter()
+        output.put(item)
+        with self._lock:
+            stage.blocked += time.perf_counter() - start
+
+    def _process(self, name: str, item: _Item, func: Callable[[_Item], None]):
+        stage = self.stages[name]
+        start = time.perf_counter()
+        if item.result.error is None:
+            try:
+                func(item)
+            except STUDY_ERRORS as e:
+                item.result.fail(e)
+                with self._lock:
+                    stage.errors += 1
+        with self._lock:
+            stage.items += 1
+            stage.busy += time.perf_counter() - start
+
+    ### Stages ###
+    def _prepare(self, item: _Item):
+        item.prepared = self.client._prepare_study(deduplicate=self.deduplicate, encode=True, **item.result.params)
+
+    def _upload(self, item: _Item, uploaded: UploadedFiles, first: dict[str, tuple[_Item, int]]):
+        '''Uploads the files, and finds the scans of the same fingerprints as earlier tasks in first.'''
+        prepared = item.prepared
+        assert prepared is not None
+        self.client._upload_study_files(prepared, uploaded=uploaded)
+        for index, fingerprint in enumerate(prepared.fingerprints):
+            if fingerprint is None or prepared.existing[index] is not None:
+                continue
+            if fingerprint in first:
+                item.duplicates[index] = first[fingerprint]
+            else:
+                first[fingerprint] = (item, index)
+
+    def _post(self, item: _Item):
+        assert item.prepared is not None
+        # Wait for the earlier tasks of the same fingerprints to be posted, and use their studies
+        for index, (earlier, earlier_index) in item.duplicates.items():
+            left = deadline.remaining()
+            if not earlier.finished.wait(left if left is not None and math.isfinite(left) else None):
+                deadline.check('posting a study of the same inputs as an earlier one')
+            item.prepared.existing[index] = earlier.result.study_id(earlier_index)
+        item.result.responses = self.client._post_prepared_study(item.prepared)
+        item.prepared = None  # Release the parsed measurement
+
+    ### Workers ###
+    def _run_stage(
+            self,
+            name: str,
+            take: Callable[[], Any],
+            func: Callable[[_Item], None],
+            output: Optional[queue.Queue],
+            expiry: Optional[float],
+    ) -> list[threading.Thread]:
+        '''Starts the workers of a stage, taking items from take() until _DONE.'''
+        stage = self.stages[name]
+
+        def work():
+            with deadline.deadline(at=expiry):
+                while True:
+                    item = take()
+                    if item is _DONE:
+                        return
+                    self._process(name, item, func)
+                    if output is not None:
+                        self._put(stage, output, item)
+                    else:
+                        item.finished.set()
+
+        threads = [
+            threading.Thread(target=work, name=f'bbor-{name}-{i}', daemon=True)
+            for i in range(self.workers[name])
+        ]
+        stage.started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _close(
+            self,
+            name: str,
+            threads: list[threading.Thread],
+            output: Optional[queue.Queue],
+            n_next: int,
+    ):
+        '''Waits for the workers of a stage, and tells the workers of the next stage to stop.'''
+        for thread in threads:
+            thread.join()
+        self.stages[name].finished_at = time.perf_counter()
+        if output is not None:
+            for _ in range(n_next):
+                output.put(_DONE)
+
+    def run(
+            self,
+            params: Iterable[dict[str, Any]],
+    ) -> list[PipelineResult]:
+        '''
+        Posts study tasks with the arguments of post_bborietveld_study_task, e.g. a dict for each measurement file.
+        params may be a generator, which is consumed as the prepare stage has room.
+        The deadline of deadline.deadline() applies to the workers.
+        '''
+        self.stages = {name: StageMetrics(workers=self.workers[name]) for name in STAGES}
+        expiry = deadline.expiry()
+        prepared: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        uploaded: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        results: list[PipelineResult] = []
+
+        source = iter(params)
+        source_lock = threading.Lock()
+        stopped = False
+
+        def next_input():
+            nonlocal stopped
+            with source_lock:
+                if stopped:
+                    return _DONE
+                index = len(results)
+                try:
+                    entry = next(source, None)
+                except Exception as e:
+                    # Any error of the caller's iterator: recorded with its traceback, and the batch is stopped
+                    stopped = True
+                    failed = PipelineResult(index, {})
+                    failed.fail(e)
+                    results.append(failed)
+                    return _DONE
+                if entry is None:
+                    stopped = True
+                    return _DONE
+                item = _Item(index, entry)
+                results.append(item.result)
+                return item
+
+        uploaded_files = UploadedFiles()
+        first: dict[str, tuple[_Item, int]] = {}
+        prepare = self._run_stage('prepare', next_input, self._prepare, prepared, expiry)
+        upload = self._run_stage('upload', prepared.get, lambda item: self._upload(item, uploaded_files, first), uploaded, expiry)
+        post = self._run_stage('post', uploaded.get, self._post, None, expiry)
+
+        self._close('prepare', prepare, prepared, self.workers['upload'])
+        self._close('upload', upload, uploaded, self.workers['post'])
+        self._close('post', post, None, 0)
+        return sorted(results, key=lambda result: result.index)
@@ -0,0 +1,219 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Literal, Union, Callable, Any
+import requests
+from requests.models import Response
+from .client import BBORClient
+from .models.study import Study
+from .models.trial import Trial
+from .query import get_value
+from . import deadline
+
+
+# Extracts the number of the queued studies from a response of /task/status (without study_id)
+QueueDepth = Callable[[Any], int]
+
+
+def queue_depth(status: Any) -> int:
+    '''
+    Number of the queued studies in a response of /task/status: {'n_queuing': 3, 'queuing': [study ids]}.
+    Raises ValueError for a response of another shape. Give another QueueDepth to BBORClientPool
+    and StudyScheduler for a server which reports its queue differently.
+    '''
+    if isinstance(status, dict):
+        if isinstance(status.get('n_queuing'), int):
+            return status['n_queuing']
+        if isinstance(status.get('queuing'), list):
+            return len(status['queuing'])
+    raise ValueError(f'Unknown response of /task/status: {status!r:.200}. Pass queue_depth to parse it.')
+
+
+def _document_id(document: Union[Study, Trial, dict]) -> str:
+    return document['_id'] if isinstance(document, dict) else document.id
+
+
+class BBORClientPool:
+    '''
+    Clients of several BBOR servers used as one, e.g. the public server and a local docker server.
+
+    Study tasks are posted to the server with the shortest task queue (from /task/status),
+    and find_studies/find_trials are sent to all the servers concurrently and their results merged.
+    A server which fails or whose circuit breaker is open is skipped.
+
+    Args:
+        clients: Logged-in clients of the servers, e.g. [BBORClient(user, pwd, 'mdx'), BBORClient(user, pwd, 'docker')].
+        queue_depth: Extracts the number of the queued studies from a response of /task/status.
+    '''
+    def __init__(
+            self,
+            clients: list[BBORClient],
+            queue_depth: QueueDepth = queue_depth,
+    ):
+        if len(clients) == 0:
+            raise ValueError('At least one client is required')
+        self.queue_depth = queue_depth
+        self.clients: dict[str, BBORClient] = {}
+        for client in clients:
+            name = client.server
+            index = 2
+            while name in self.clients:
+                name = f'{client.server}#{index}'
+                index += 1
+            self.clients[name] = client
+        # (server name, study id) of the posted studies
+        self.history: list[tuple[str, str]] = []
+        # Study id -> server name, of the studies posted or found
+        self.locations: dict[str, str] = {}
+        self._submitted: dict[str, int] = {name: 0 for name in self.clients}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(
+            cls,
+            username: str,
+            password: str,
+            servers: list[str],
+            **kwargs,
+    ) -> 'BBORClientPool':
+        '''Logs in to each server with the same account. kwargs are passed to BBORClient.'''
+        return cls([BBORClient(username, password, server=server, **kwargs) for server in servers])
+
+    def _available(self, group: str) -> dict[str, BBORClient]:
+        '''Clients with a token whose circuit of the endpoint group is not open.'''
+        return {
+            name: client for name, client in self.clients.items()
+            if client.token and (client.circuit_breaker is None or client.circuit_breaker.state(group) != 'open')
+        }
+
+    def _fan_out(
+            self,
+            clients: dict[str, BBORClient],
+            call: Callable[[BBORClient], Any],
+    ) -> dict[str, Any]:
+        '''Calls every client concurrently. Failed calls (None or a connection error) are left out.'''
+        expiry = deadline.expiry()
+
+        def run(name: str):
+            with deadline.deadline(at=expiry):
+                try:
+                    return call(clients[name])
+                except requests.RequestException as e:
+                    print(f'Request failed on {name}: {e}')
+                    return None
+
+        with ThreadPoolExecutor(max_workers=max(len(clients), 1)) as executor:
+            results = dict(zip(clients, executor.map(run, clients)))
+        return {name: result for name, result in results.items() if result is not None}
+
+    ### Tasks ###
+    def queue_depths(self) -> dict[str, int]:
+        '''
+        Number of the queued studies of each available server. Servers failing to answer are left out,
+        and ValueError is raised for a response queue_depth cannot parse.
+        '''
+        statuses = self._fan_out(self._available('task'), lambda client: client.ask_task_queue_status())
+        return {name: self.queue_depth(status) for name, status in statuses.items()}
+
+    def choose_server(self) -> str:
+        '''The server with the shortest task queue. Ties are broken by the studies posted by this pool.'''
+        depths = self.queue_depths()
+        if len(depths) == 0:
+            raise requests.ConnectionError('No server is available')
+        with self._lock:
+            return min(depths, key=lambda name: (depths[name], self._submitted[name]))
+
+    def post_bborietveld_study_task(
+            self,
+            server: Optional[str] = None,
+            return_response: bool = False,
+            **kwargs,
+    ) -> Union[Response, list[Response], None]:
+        '''
+        Posts a study task (see BBORClient.post_bborietveld_study_task) to the server with the shortest queue,
+        or to server if given.
+        '''
+        name = server or self.choose_server()
+        with self._lock:
+            self._submitted[name] += 1
+        response = self.clients[name].post_bborietveld_study_task(return_response=True, **kwargs)
+        responses = response if isinstance(response, list) else [response]
+        with self._lock:
+            for r in responses:
+                if r is not None and r.status_code in (200, 202):
+                    study_id = r.json()['study_id']
+                    self.history.append((name, study_id))
+                    self.locations[study_id] = name
+        if return_response:
+            return response
+
+    def client_of(
+            self,
+            study_id: str,
+    ) -> Optional[BBORClient]:
+        '''The client of the server of a study posted or found through this pool.'''
+        name = self.locations.get(study_id)
+        return self.clients[name] if name is not None else None
+
+    ### Find ###
+    def _merge(
+            self,
+            results: dict[str, list],
+            sort: Optional[list[tuple[str, int]]] = None,
+            limit: Optional[int] = None,
+    ) -> list:
+        merged = []
+        for documents in results.values():
+            merged.extend(documents)
+        if sort:
+            # Sorted by the paths of the documents of the server, e.g. trial_num of Trial.num
+            wire = {id(d): d if isinstance(d, dict) else d.to_document() for d in merged}
+            for path, order in reversed(sort):
+                present = [d for d in merged if get_value(wire[id(d)], path) is not None]
+                missing = [d for d in merged if get_value(wire[id(d)], path) is None]
+                present.sort(key=lambda d: get_value(wire[id(d)], path), reverse=order < 0)
+                merged = present + missing
+        if limit is not None:
+            merged = merged[:limit]
+        return merged
+
+    def find_studies(
+            self,
+            query: dict = {},
+            scope: Literal['account', 'group'] = 'group',
+            return_dict: bool = False,
+            fields: Optional[list[str]] = None,
+    ) -> Union[list[Study], list[dict], None]:
+        '''find_studies of all the servers merged. The servers of the studies are recorded in self.locations.'''
+        results = self._fan_out(self._available('study'), lambda client: client.find_studies(
+            query = query,
+            scope = scope,
+            return_dict = return_dict,
+            fields = fields,
+        ))
+        if len(results) == 0:
+            return None
+        with self._lock:
+            for name, studies in results.items():
+                for study in studies:
+                    self.locations[_document_id(study)] = name
+        return self._merge(results)
+
+    def find_trials(
+            self,
+            query: dict = {},
+            return_dict: bool = False,
+            fields: Optional[list[str]] = None,
+            sort: Optional[list[tuple[str, int]]] = None,
+            limit: Optional[int] = None,
+    ) -> Union[list[Trial], list[dict], None]:
+        '''find_trials of all the servers merged, sorted and limited again over the servers.'''
+        results = self._fan_out(self._available('trial'), lambda client: client.find_trials(
+            query = query,
+            return_dict = return_dict,
+            fields = fields,
+            sort = sort,
+            limit = limit,
+        ))
+        if len(results) == 0:
+            return None
+        return self._merge(results, sort, limit)
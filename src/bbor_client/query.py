@@ -0,0 +1,203 @@
+import re
+from typing import Any
+
+# Evaluation of MongoDB-style filters on documents received from the API server,
+# e.g. {'trial_num': {'$lt': 10}, 'result_refine.Rval.converged': True}.
+# Supported operators:
+#   $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists, $regex (with $options), $not, $size, $all, $elemMatch
+#   $and, $or, $nor at the top level
+
+
+def normalize_path(path: str) -> str:
+    '''References are queried as parent_study.$id on the server, but received as parent_study.id.'''
+    return path.replace('.$id', '.id')
+
+
+def resolve(document: Any, path: str) -> list:
+    '''
+    Returns the values at the dotted path. Arrays in the middle of the path are traversed as MongoDB does,
+    so that {'a': [{'b': 1}, {'b': 2}]} gives [1, 2] for 'a.b'. An empty list is returned if the path does not exist.
+    '''
+    values = [document]
+    for key in normalize_path(path).split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if key in value:
+                    next_values.append(value[key])
+            elif isinstance(value, list):
+                if key.isdigit() and int(key) < len(value):
+                    next_values.append(value[int(key)])
+                else:
+                    next_values.extend(v[key] for v in value if isinstance(v, dict) and key in v)
+        values = next_values
+    return values
+
+
+def _candidates(values: list) -> list:
+    '''A field matches if either the array itself or one of its elements matches.'''
+    candidates = []
+    for value in values:
+        candidates.append(value)
+        if isinstance(value, list):
+            candidates.extend(value)
+    return candidates
+
+
+def _compare(value, operand, op) -> bool:
+    if value is None or operand is None or isinstance(value, (dict, list)):
+        return False
+    try:
+        return op(value, operand)
+    except TypeError:
+        return False
+
+
+def _match_operators(values: list, condition: dict) -> bool:
+    candidates = _candidates(values)
+    for op, operand in condition.items():
+        if op == '$eq':
+            ok = any(c == operand for c in candidates) or (operand is None and len(values) == 0)
+        elif op == '$ne':
+            ok = not (any(c == operand for c in candidates) or (operand is None and len(values) == 0))
+        elif op == '$gt':
+            ok = any(_compare(c, operand, lambda a, b: a > b) for c in candidates)
+        elif op == '$gte':
+            ok = any(_compare(c, operand, lambda a, b: a >= b) for c in candidates)
+        elif op == '$lt':
+            ok = any(_compare(c, operand, lambda a, b: a < b) for c in candidates)
+        elif op == '$lte':
+            ok = any(_compare(c, operand, lambda a, b: a <= b) for c in candidates)
+        elif op == '$in':
+            ok = any(c in operand for c in candidates) or (None in operand and len(values) == 0)
+        elif op == '$nin':
+            ok = not (any(c in operand for c in candidates) or (None in operand and len(values) == 0))
+        elif op == '$exists':
+            ok = (len(values) > 0) == bool(operand)
+        elif op == '$regex':
+            flags = 0
+            for option in condition.get('$options', ''):
+                flags |= {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}[option]
+            pattern = re.compile(operand, flags)
+            ok = any(isinstance(c, str) and pattern.search(c) is not None for c in candidates)
+        elif op == '$options':
+            continue
+        elif op == '$not':
+            ok = not _match_condition(values, operand)
+        elif op == '$size':
+            ok = any(isinstance(v, list) and len(v) == operand for v in values)
+        elif op == '$all':
+            ok = all(any(c == item for c in candidates) for item in operand)
+        elif op == '$elemMatch':
+            ok = any(
+                isinstance(v, list) and any(_match_element(e, operand) for e in v)
+                for v in values
+            )
+        else:
+            raise ValueError(f'Unsupported query operator {op}')
+        if not ok:
+            return False
+    return True
+
+
+def _match_element(element, condition: dict) -> bool:
+    if isinstance(element, dict) and not all(key.startswith('$') for key in condition):
+        return match(element, condition)
+    return _match_operators([element], condition)
+
+
+def _match_condition(values: list, condition) -> bool:
+    if isinstance(condition, dict) and len(condition) > 0 and all(key.startswith('$') for key in condition):
+        return _match_operators(values, condition)
+    if isinstance(condition, re.Pattern):
+        return any(isinstance(c, str) and condition.search(c) is not None for c in _candidates(values))
+    return _match_operators(values, {'$eq': condition})
+
+
+def match(document: dict, query: dict) -> bool:
+    '''Returns True if the document matches the MongoDB-style filter.'''
+    for key, condition in query.items():
+        if key == '$and':
+            ok = all(match(document, q) for q in condition)
+        elif key == '$or':
+            ok = any(match(document, q) for q in condition)
+        elif key == '$nor':
+            ok = not any(match(document, q) for q in condition)
+        elif key.startswith('$'):
+            raise ValueError(f'Unsupported query operator {key}')
+        else:
+            ok = _match_condition(resolve(document, key), condition)
+        if not ok:
+            return False
+    return True
+
+
+def flatten_elem_match(query: dict) -> dict:
+    '''
+    Rewrites single-field $elemMatch chains into dotted paths, which are equivalent for a single condition,
+    e.g. {'samples': {'$elemMatch': {'phases': {'$elemMatch': {'name': 'Y2O3'}}}}} -> {'samples.phases.name': 'Y2O3'}
+    '''
+    flat = {}
+    for key, condition in query.items():
+        while (
+            isinstance(condition, dict) and list(condition) == ['$elemMatch']
+            and isinstance(condition['$elemMatch'], dict) and len(condition['$elemMatch']) == 1
+            and not next(iter(condition['$elemMatch'])).startswith('$')
+        ):
+            (subkey, condition), = condition['$elemMatch'].items()
+            key = f'{key}.{subkey}'
+        flat[key] = condition
+    return flat
+
+
+def get_value(document: dict, path: str, default=None) -> Any:
+    '''Returns the single value at the dotted path without traversing arrays.'''
+    value = document
+    for key in normalize_path(path).split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return default
+        value = value[key]
+    return value
+
+
+def projection(fields: list[str]) -> dict[str, int]:
+    '''MongoDB projection of the fields. The id is always included.'''
+    return {normalize_path(field): 1 for field in fields}
+
+
+def _project(value: Any, keys: list[str]) -> Any:
+    if isinstance(value, list):
+        # Elements without the field are kept as {} as MongoDB does, which keeps the positions aligned for merging
+        return [_project(v, keys) for v in value if isinstance(v, (dict, list))]
+    if not isinstance(value, dict):
+        return None
+    key, rest = keys[0], keys[1:]
+    if key not in value:
+        return {}
+    if not rest:
+        return {key: value[key]}
+    sub = _project(value[key], rest)
+    return {key: sub} if sub is not None else {}
+
+
+def _merge(target: dict, source: dict):
+    for key, value in source.items():
+        if key in target and isinstance(target[key], dict) and isinstance(value, dict):
+            _merge(target[key], value)
+        elif key in target and isinstance(target[key], list) and isinstance(value, list):
+            for t, s in zip(target[key], value):
+                if isinstance(t, dict) and isinstance(s, dict):
+                    _merge(t, s)
+        else:
+            target[key] = value
+
+
+def project(document: dict, fields: list[str]) -> dict:
+    '''
+    Keeps only the dotted paths of the document (and its _id), as a MongoDB projection does,
+    e.g. ['trial_num', 'result_refine.Rval.Rwp'] -> {'_id': ..., 'trial_num': 3, 'result_refine': {'Rval': {'Rwp': 5.1}}}
+    '''
+    projected = {'_id': document['_id']} if '_id' in document else {}
+    for field in fields:
+        _merge(projected, _project(document, normalize_path(field).split('.')))
+    return projected
@@ -0,0 +1,259 @@
+import itertools
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Optional, Literal, Union, Any
+import requests
+from requests.models import Response
+from .client import BBORClient
+from .pool import QueueDepth, queue_depth
+from .parsers.parallel import PARSE_ERRORS
+from . import deadline
+
+JobState = Literal['pending', 'posting', 'in_flight', 'done', 'failed']
+
+# Study statuses of finished tasks
+FINISHED_STATUSES = ('COMPLETED', 'ARCHIVED')
+
+FORMAT_VERSION = 1
+
+
+@dataclass
+class Job:
+    '''A study task to be posted, with the arguments of post_bborietveld_study_task.'''
+    id: int
+    params: dict[str, Any]
+    priority: int = 0
+    batch: Optional[str] = None
+    state: JobState = 'pending'
+    study_ids: list[str] = field(default_factory=list)
+    finished: list[str] = field(default_factory=list)  # study ids of the finished tasks
+    error: Optional[str] = None
+    submitted_at: Optional[float] = None  # Unix time
+
+
+class StudyScheduler:
+    '''
+    Posts study tasks as the earlier ones finish, keeping max_in_flight studies of the scheduler queued on the server.
+
+    Jobs of higher priority are posted first, and jobs of the same priority in the order they were added.
+    The jobs are saved to path (JSON) on every change, and a scheduler created with the same path resumes them:
+    pending jobs are posted and the studies in flight are waited for.
+    A job interrupted while posting is posted again after the restart.
+
+    Args:
+        client: A logged-in client.
+        path: File to save the jobs. Not saved if None.
+        max_in_flight: Studies of this scheduler queued on the server at a time.
+        max_queue: Studies queued on the server by anyone (from /task/status) above which nothing is posted.
+        poll_interval: Seconds between the checks of the task status in run().
+        queue_depth: Extracts the number of the queued studies from a response of /task/status, for max_queue.
+    '''
+    def __init__(
+            self,
+            client: BBORClient,
+            path: Union[str, Path, None] = None,
+            max_in_flight: int = 4,
+            max_queue: Optional[int] = None,
+            poll_interval: float = 30.,
+            queue_depth: QueueDepth = queue_depth,
+    ):
+        self.client = client
+        self.path = Path(path) if path is not None else None
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.poll_interval = poll_interval
+        self.queue_depth = queue_depth
+        self.jobs: dict[int, Job] = {}
+        self._lock = threading.RLock()
+        if self.path is not None and self.path.exists():
+            self._load()
+        self._ids = itertools.count(max(self.jobs, default=0) + 1)
+
+    ### Persistence ###
+    def _load(self):
+        assert self.path is not None
+        saved = json.loads(self.path.read_text())
+        if saved.get('version') != FORMAT_VERSION:
+            raise ValueError(f'Unsupported scheduler file version {saved.get("version")}')
+        for entry in saved['jobs']:
+            job = Job(**entry)
+            if job.state == 'posting':
+                job.state = 'pending'
+            self.jobs[job.id] = job
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            content = json.dumps(
+                {'version': FORMAT_VERSION, 'jobs': [asdict(job) for job in self.jobs.values()]},
+                default = str,
+            )
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp = self.path.with_name(self.path.name + '.tmp')
+            temp.write_text(content)
+            os.replace(temp, self.path)
+
+    ### Queue ###
+    def submit(
+            self,
+            priority: int = 0,
+            batch: Optional[str] = None,
+            **kwargs,
+    ) -> int:
+        '''
+        Adds a study task with the arguments of post_bborietveld_study_task. Returns the job id.
+        File paths are saved as strings, so the arguments should be JSON serializable otherwise.
+        '''
+        with self._lock:
+            job = Job(
+                id = next(self._ids),
+                params = json.loads(json.dumps(kwargs, default=str)),
+                priority = priority,
+                batch = batch,
+            )
+            self.jobs[job.id] = job
+            self.save()
+        return job.id
+
+    def submit_batch(
+            self,
+            params: list[dict[str, Any]],
+            priority: int = 0,
+            batch: Optional[str] = None,
+    ) -> list[int]:
+        '''Adds study tasks of the same priority, e.g. a batch of measurement files.'''
+        return [self.submit(priority=priority, batch=batch, **kwargs) for kwargs in params]
+
+    def cancel(
+            self,
+            batch: Optional[str] = None,
+    ) -> int:
+        '''Removes the pending jobs (of a batch). Returns the number of jobs removed.'''
+        with self._lock:
+            cancelled = [
+                job.id for job in self.jobs.values()
+                if job.state == 'pending' and (batch is None or job.batch == batch)
+            ]
+            for id in cancelled:
+                del self.jobs[id]
+            self.save()
+        return len(cancelled)
+
+    def _jobs(self, *states: JobState) -> list[Job]:
+        with self._lock:
+            return [job for job in self.jobs.values() if job.state in states]
+
+    @property
+    def pending(self) -> list[Job]:
+        '''Jobs to be posted in the order they will be posted.'''
+        return sorted(self._jobs('pending'), key=lambda job: (-job.priority, job.id))
+
+    @property
+    def in_flight(self) -> list[Job]:
+        return self._jobs('in_flight')
+
+    def n_in_flight(self) -> int:
+        '''Studies of this scheduler queued on the server.'''
+        return sum(len(job.study_ids) - len(job.finished) for job in self.in_flight)
+
+    ### Scheduling ###
+    def _study_finished(self, study_id: str) -> Optional[bool]:
+        '''Whether the task of a study has finished. None if unknown, e.g. the server is unavailable.'''
+        try:
+            status = self.client.ask_task_queue_status(study_id, return_response=True)
+        except requests.RequestException:
+            return None
+        if isinstance(status, dict):
+            return status.get('status') in FINISHED_STATUSES
+        if isinstance(status, Response) and status.status_code == 404:
+            # Deleted
+            return True
+        return None
+
+    def refresh(self):
+        '''Checks the task status of the studies in flight.'''
+        for job in self.in_flight:
+            for study_id in job.study_ids:
+                if study_id not in job.finished and self._study_finished(study_id):
+                    with self._lock:
+                        job.finished.append(study_id)
+            with self._lock:
+                if len(job.finished) == len(job.study_ids):
+                    job.state = 'done'
+        self.save()
+
+    def _server_full(self) -> bool:
+        if self.max_queue is None:
+            return False
+        try:
+            status = self.client.ask_task_queue_status()
+        except requests.RequestException:
+            return True
+        if status is None:
+            # The request failed
+            return True
+        return self.queue_depth(status) >= self.max_queue
+
+    def _post(self, job: Job) -> bool:
+        '''Posts a job. Returns False if the server is unavailable and the job is left pending.'''
+        with self._lock:
+            job.state = 'posting'
+            self.save()
+        try:
+            response = self.client.post_bborietveld_study_task(return_response=True, **job.params)
+        except requests.RequestException as e:
+            print(f'Failed in posting job {job.id}: {e}')
+            with self._lock:
+                job.state = 'pending'
+                self.save()
+            return False
+        except PARSE_ERRORS as e:
+            # Invalid arguments, or files missing or failing to parse
+            with self._lock:
+                job.state = 'failed'
+                job.error = repr(e)
+                self.save()
+            return True
+        responses = response if isinstance(response, list) else [response]
+        with self._lock:
+            for r in responses:
+                if r is not None and r.status_code in (200, 202):
+                    # 200 for a study already posted
+                    job.study_ids.append(r.json()['study_id'])
+                elif r is not None:
+                    job.error = f'{r.status_code}: {r.content.decode()}'
+            job.state = 'in_flight' if job.study_ids else 'failed'
+            job.submitted_at = time.time()
+            self.save()
+        return True
+
+    def step(self) -> int:
+        '''Checks the studies in flight and posts the pending jobs up to max_in_flight. Returns the jobs posted.'''
+        self.refresh()
+        posted = 0
+        for job in self.pending:
+            if self.n_in_flight() >= self.max_in_flight or self._server_full():
+                break
+            if not self._post(job):
+                break
+            posted += 1
+        return posted
+
+    def run(
+            self,
+            wait: bool = True,
+    ):
+        '''
+        Posts all the pending jobs, checking the task status every poll_interval seconds,
+        until all are posted, or all are finished with wait=True. Stops at the deadline of deadline.deadline().
+        '''
+        while True:
+            self.step()
+            if not self.pending and (not wait or not self.in_flight):
+                return
+            deadline.sleep(self.poll_interval)
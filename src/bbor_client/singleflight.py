@@ -0,0 +1,65 @@
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+
+class FlightTimeout(TimeoutError):
+    '''Raised to a caller which timed out waiting for the call of another caller.'''
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    '''
+    Runs a function once for the concurrent callers with the same key.
+
+    The first caller runs the function and the others wait for it and receive the same result or exception.
+    A call made after the function returned runs the function again, i.e. nothing is cached.
+    '''
+    def __init__(self):
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(
+            self,
+            key: Hashable,
+            func: Callable[[], Any],
+            timeout: Optional[float] = None,
+    ) -> tuple[Any, bool]:
+        '''
+        timeout: Seconds to wait for the call of another caller. FlightTimeout is raised after that.
+        Returns:
+            (result of func, whether the result was shared from a call of another caller)
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            if not call.done.wait(timeout):
+                raise FlightTimeout('Timed out waiting for the same request in flight')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
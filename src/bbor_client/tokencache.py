@@ -0,0 +1,159 @@
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Union
+
+# Tokens expiring within this many seconds are not reused
+EXPIRY_MARGIN = 60.
+
+
+def default_path() -> Path:
+    '''~/.cache/bbor_client/tokens.json, or under $XDG_CACHE_HOME.'''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'bbor_client' / 'tokens.json'
+
+
+def token_expiry(token: str) -> Optional[float]:
+    '''The exp claim (Unix time) of a JWT, or None if the token is not a JWT with exp.'''
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(parts[1] + '=' * (-len(parts[1]) % 4)))
+    except (ValueError, binascii.Error):
+        return None
+    exp = payload.get('exp') if isinstance(payload, dict) else None
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+def _lock_file(f):
+    if os.name == 'nt':
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if os.name == 'nt':
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class TokenCache:
+    '''
+    Access tokens stored in a file shared by the processes of the user, per server and username.
+
+    The file and its directory are readable only by the user, and it is locked (with a sibling .lock file)
+    while being read or written, so that the processes renewing a token do not log in at the same time.
+    Passwords are not stored.
+    '''
+    def __init__(
+            self,
+            path: Union[str, Path, None] = None,
+    ):
+        self.path = Path(path) if path is not None else default_path()
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+
+    @staticmethod
+    def _key(server_url: str, username: str) -> str:
+        return f'{username}@{server_url}'
+
+    @contextmanager
+    def locked(self):
+        '''Holds the file lock, e.g. over checking the cache and logging in. Reentrant in a thread.'''
+        with self._thread_lock:
+            if self._depth > 0:
+                # Already held by this thread
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            with open(self.path.with_name(self.path.name + '.lock'), 'a+b') as handle:
+                _lock_file(handle)
+                self._depth = 1
+                try:
+                    yield
+                finally:
+                    self._depth = 0
+                    _unlock_file(handle)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, entries: dict):
+        temp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp, self.path)
+
+    def load(
+            self,
+            server_url: str,
+            username: str,
+    ) -> Optional[str]:
+        '''The cached token, or None if there is none or it expires within EXPIRY_MARGIN.'''
+        with self.locked():
+            entry = self._read().get(self._key(server_url, username))
+        if not isinstance(entry, dict) or not entry.get('token'):
+            return None
+        expires_at = entry.get('expires_at')
+        if expires_at is not None and expires_at - EXPIRY_MARGIN < time.time():
+            return None
+        return entry['token']
+
+    def save(
+            self,
+            server_url: str,
+            username: str,
+            token: str,
+    ):
+        with self.locked():
+            entries = self._read()
+            now = time.time()
+            # Drop expired tokens of any server and user
+            entries = {
+                key: entry for key, entry in entries.items()
+                if isinstance(entry, dict) and (entry.get('expires_at') is None or entry['expires_at'] > now)
+            }
+            entries[self._key(server_url, username)] = {
+                'token': token,
+                'expires_at': token_expiry(token),
+                'saved_at': now,
+            }
+            self._write(entries)
+
+    def discard(
+            self,
+            server_url: str,
+            username: str,
+            token: str,
+    ):
+        '''Removes the token if it is still cached, e.g. after the server rejected it.'''
+        with self.locked():
+            entries = self._read()
+            key = self._key(server_url, username)
+            if isinstance(entries.get(key), dict) and entries[key].get('token') == token:
+                del entries[key]
+                self._write(entries)
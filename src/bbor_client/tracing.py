@@ -0,0 +1,402 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import Optional, Union, Any, Protocol
+from .metrics import RequestInfo
+
+# Phases summed up in the spans. See metrics.PHASES
+SPAN_PHASES = ('connect', 'ttfb', 'transfer', 'decode', 'validate')
+
+OTLP_ENDPOINT = 'http://localhost:4318/v1/traces'
+SERVICE_NAME = 'bbor_client'
+
+# Finished spans waiting for the exporters at most. Spans are dropped while the exporters cannot keep up.
+MAX_QUEUED_SPANS = 2048
+# Spans passed to an exporter at a time
+EXPORT_BATCH_SIZE = 64
+# Seconds the export thread waits for more spans to fill a batch
+EXPORT_INTERVAL = 1.
+# Seconds waited at exit for the queued spans to be exported
+EXIT_FLUSH_TIMEOUT = 5.
+
+# Errors of the exporters: I/O and connection errors (requests.RequestException is an OSError),
+# and spans which cannot be serialized
+EXPORT_ERRORS = (OSError, ValueError, TypeError)
+
+# Put into the export queue by flush() to export the spans without waiting for a full batch
+_FLUSH = object()
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+@dataclass
+class Span:
+    '''
+    A traced call of a client method, e.g. find_refines, with the HTTP requests sent during the call.
+    Calls of client methods inside the call (e.g. get_trial in get_best_trials) are recorded as children.
+    '''
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_ns: int = 0
+    end_ns: int = 0
+    error: Optional[str] = None
+    requests: list[RequestInfo] = field(default_factory=list)
+    children: list['Span'] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def timings(self) -> dict[str, float]:
+        '''Seconds spent in each phase summed over the requests of the span and its children.'''
+        totals = {phase: 0. for phase in SPAN_PHASES}
+        for info in self.requests:
+            for phase in totals:
+                totals[phase] += info.timings.get(phase, 0.)
+        for child in self.children:
+            for phase, seconds in child.timings().items():
+                totals[phase] += seconds
+        return totals
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: list[Span]) -> None:
+        ...
+
+
+def _flush_at_exit(ref: 'weakref.ref[Tracer]'):
+    tracer = ref()
+    if tracer is not None:
+        tracer.flush(EXIT_FLUSH_TIMEOUT)
+
+
+class Tracer:
+    '''
+    Keeps the spans of the client method calls per thread and passes finished root spans to the exporters.
+
+    The spans are exported in batches from a background thread, so that a slow or unavailable collector
+    does not delay the traced calls. Up to MAX_QUEUED_SPANS spans wait for the exporters,
+    and more are dropped (counted in dropped). Spans an exporter failed to export are printed and counted in failed.
+    The queued spans are flushed at exit.
+    '''
+    def __init__(self):
+        self.exporters: list[SpanExporter] = []
+        self.dropped = 0
+        self.failed = 0  # spans an exporter failed to export
+        self._local = threading.local()
+        self._queue: queue.Queue = queue.Queue(maxsize=MAX_QUEUED_SPANS)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def current(self) -> Optional[Span]:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @property
+    def last(self) -> Optional[Span]:
+        '''The last finished root span of this thread.'''
+        return getattr(self._local, 'last', None)
+
+    @contextmanager
+    def span(self, name: str):
+        parent = self.current
+        span = Span(
+            name = name,
+            trace_id = parent.trace_id if parent else _new_id(16),
+            span_id = _new_id(8),
+            parent_id = parent.span_id if parent else None,
+            start_ns = time.time_ns(),
+        )
+        if parent:
+            parent.children.append(span)
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            stack.pop()
+            if parent is None:
+                self._local.last = span
+                self._enqueue(span)
+
+    ### Export ###
+    def _enqueue(self, span: Span):
+        if not self.exporters:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target = self._export_loop,
+                    args = (weakref.ref(self), self._queue),
+                    name = 'bbor-span-exporter',
+                    daemon = True,
+                )
+                self._thread.start()
+                atexit.register(_flush_at_exit, weakref.ref(self))
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            with self._thread_lock:
+                self.dropped += 1
+
+    @staticmethod
+    def _export_loop(ref: 'weakref.ref[Tracer]', spans: queue.Queue):
+        '''Passes the queued spans to the exporters in batches of EXPORT_BATCH_SIZE or every EXPORT_INTERVAL seconds.'''
+        while True:
+            batch = [spans.get()]
+            end = time.monotonic() + EXPORT_INTERVAL
+            while batch[-1] is not _FLUSH and len(batch) < EXPORT_BATCH_SIZE:
+                left = end - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(spans.get(timeout=left))
+                except queue.Empty:
+                    break
+            tracer = ref()
+            finished = [span for span in batch if span is not _FLUSH]
+            if tracer is not None and finished:
+                tracer._export(finished)
+            del tracer
+            for _ in batch:
+                spans.task_done()
+
+    def _export(self, spans: list[Span]):
+        for exporter in list(self.exporters):
+            try:
+                exporter.export(spans)
+            except EXPORT_ERRORS as e:
+                with self._thread_lock:
+                    self.failed += len(spans)
+                print(f'Failed in exporting {len(spans)} spans with {type(exporter).__name__}: {e!r}')
+
+    def flush(
+            self,
+            timeout: Optional[float] = None,
+    ) -> bool:
+        '''Waits until the queued spans are exported. Returns False if they were not exported in timeout seconds.'''
+        if self._thread is None:
+            return True
+        try:
+            self._queue.put_nowait(_FLUSH)
+        except queue.Full:
+            pass
+        end = time.monotonic() + timeout if timeout is not None else None
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                left = end - time.monotonic() if end is not None else None
+                if left is not None and left <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(left)
+        return True
+
+    @contextmanager
+    def attach(self, span: Optional[Span]):
+        '''Continues a span of another thread in this thread, e.g. in the workers of a thread pool.'''
+        if span is None:
+            yield
+            return
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def add_request(self, info: RequestInfo):
+        span = self.current
+        if span is not None:
+            span.requests.append(info)
+
+
+def traced(func):
+    '''Records a call of a client method as a span of the client's tracer.'''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.tracer.span(func.__name__):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+### OpenTelemetry export ###
+def _attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def _otlp_span(
+        name: str,
+        trace_id: str,
+        span_id: str,
+        parent_id: Optional[str],
+        start_ns: int,
+        end_ns: int,
+        kind: int,
+        attributes: dict,
+        error: Optional[str] = None,
+) -> dict:
+    span = {
+        'traceId': trace_id,
+        'spanId': span_id,
+        'name': name,
+        'kind': kind,
+        'startTimeUnixNano': str(start_ns),
+        'endTimeUnixNano': str(end_ns),
+        'attributes': [_attribute(k, v) for k, v in attributes.items() if v is not None],
+        'status': {'code': 2, 'message': error} if error else {'code': 1},
+    }
+    if parent_id:
+        span['parentSpanId'] = parent_id
+    return span
+
+
+def _request_spans(info: RequestInfo, trace_id: str, parent_id: str) -> list[dict]:
+    '''A CLIENT span of the HTTP request and INTERNAL spans of its phases.'''
+    span_id = _new_id(8)
+    end_ns = max(
+        [info.start_ns + int(info.timings.get('request', 0.) * 1e9)]
+        + [start + int(info.timings[phase] * 1e9) for phase, start in info.phase_starts.items()]
+    )
+    spans = [_otlp_span(
+        name = f'{info.method} {info.route}',
+        trace_id = trace_id,
+        span_id = span_id,
+        parent_id = parent_id,
+        start_ns = info.start_ns,
+        end_ns = end_ns,
+        kind = SPAN_KIND_CLIENT,
+        attributes = {
+            'http.request.method': info.method,
+            'http.route': info.route,
+            'url.full': info.url,
+            'http.response.status_code': info.status_code,
+            'http.request.body.size': info.bytes_out,
+            'http.response.body.size': info.bytes_in,
+        },
+        error = repr(info.error) if info.error is not None else None,
+    )]
+    for phase, start in info.phase_starts.items():
+        spans.append(_otlp_span(
+            name = phase,
+            trace_id = trace_id,
+            span_id = _new_id(8),
+            parent_id = span_id,
+            start_ns = start,
+            end_ns = start + int(info.timings[phase] * 1e9),
+            kind = SPAN_KIND_INTERNAL,
+            attributes = {},
+        ))
+    return spans
+
+
+def _flatten_spans(span: Span) -> list[dict]:
+    spans = [_otlp_span(
+        name = span.name,
+        trace_id = span.trace_id,
+        span_id = span.span_id,
+        parent_id = span.parent_id,
+        start_ns = span.start_ns,
+        end_ns = span.end_ns,
+        kind = SPAN_KIND_INTERNAL,
+        attributes = {f'bbor.{phase}_seconds': seconds for phase, seconds in span.timings().items()},
+        error = span.error,
+    )]
+    for info in span.requests:
+        spans.extend(_request_spans(info, span.trace_id, span.span_id))
+    for child in span.children:
+        spans.extend(_flatten_spans(child))
+    return spans
+
+
+def to_otlp(
+        spans: list[Span],
+        service_name: str = SERVICE_NAME,
+) -> dict:
+    '''Converts the spans into an OTLP/JSON ExportTraceServiceRequest.'''
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', service_name)]},
+            'scopeSpans': [{
+                'scope': {'name': 'bbor_client'},
+                'spans': [s for span in spans for s in _flatten_spans(span)],
+            }],
+        }],
+    }
+
+
+class OTLPJsonExporter:
+    '''
+    Sends the spans to an OpenTelemetry collector with OTLP/HTTP JSON, e.g. a local collector at localhost:4318.
+    Does not require the opentelemetry packages. The tracer prints failures and drops the spans.
+    Called from the export thread of the tracer, so the timeout does not delay the traced calls.
+    '''
+    def __init__(
+            self,
+            endpoint: str = OTLP_ENDPOINT,
+            service_name: str = SERVICE_NAME,
+            timeout: float = 5.,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, spans: list[Span]):
+        '''Raises requests.RequestException if the collector is unavailable or rejects the spans.'''
+        import requests
+        response = requests.post(
+            self.endpoint,
+            json = to_otlp(spans, self.service_name),
+            timeout = self.timeout,
+        )
+        if response.status_code >= 400:
+            raise requests.HTTPError(f'{response.status_code}: {response.content.decode()}', response=response)
+
+
+class JsonlSpanExporter:
+    '''Appends the spans to a file as OTLP/JSON lines, which can be sent to a collector later.'''
+    def __init__(
+            self,
+            path: Union[str, Path],
+            service_name: str = SERVICE_NAME,
+    ):
+        self.path = Path(path)
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]):
+        line = json.dumps(to_otlp(spans, self.service_name))
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
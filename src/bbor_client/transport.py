@@ -0,0 +1,58 @@
+import threading
+from time import perf_counter
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connection time of the last request of each thread, set by the connections of the pools below
+_connect = threading.local()
+
+
+def take_connect_time() -> float:
+    '''Returns and clears the connection time (seconds) of the last request of this thread. 0 for a reused connection.'''
+    seconds = getattr(_connect, 'seconds', 0.)
+    _connect.seconds = 0.
+    return seconds
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = perf_counter()
+        super().connect()
+        _connect.seconds = getattr(_connect, 'seconds', 0.) + perf_counter() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # Including the TLS handshake
+        start = perf_counter()
+        super().connect()
+        _connect.seconds = getattr(_connect, 'seconds', 0.) + perf_counter() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    '''HTTPAdapter whose connections record their connection time.'''
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+def timed_session() -> requests.Session:
+    '''A session reusing connections, with the connection time of each request recorded.'''
+    session = requests.Session()
+    adapter = TimedHTTPAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
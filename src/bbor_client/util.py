@@ -23,6 +23,9 @@ def get_file_size_from_binaryio(bytes: BinaryIO) -> int:
 
 
 def api_url(server:str, dp) -> str:
+    if server.startswith(('http://', 'https://')):
+        # A URL of another server, e.g. the local mock server
+        return server.rstrip('/')
     if server=='mdx':
         return API_URL_MDX
     elif server=='local':
@@ -32,7 +35,7 @@ def api_url(server:str, dp) -> str:
     elif server=='dev':
         return API_URL_MDX.replace('/api', f':{dp}/api')
     else:
-        raise ValueError('The argument server should be either "mdx", "local", or "docker".')
+        raise ValueError('The argument server should be either "mdx", "local", "docker", or a URL.')
 
 
 def require_token(func):
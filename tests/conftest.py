@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+import pytest
+from bbor_client import BBORClient
+
+# The mock server of the benchmarks
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
+from mockserver import MockData, serve, MOCK_USERNAME, MOCK_PASSWORD
+
+
+@pytest.fixture
+def mock_url():
+    with serve(MockData(n_studies=2, n_trials=20, n_refines=1), task_time=0.2) as url:
+        yield url
+
+
+@pytest.fixture
+def client(mock_url) -> BBORClient:
+    return BBORClient(MOCK_USERNAME, MOCK_PASSWORD, server=mock_url)
+
+
+@pytest.fixture
+def input_files(tmp_path) -> dict[str, Path]:
+    '''A measurement file, copies of it with other names, and PRM and CIF files.'''
+    content = '\n'.join(f'{10 + 0.02*i:.2f},{1000 + (i*37) % 500}' for i in range(500))
+    files = {}
+    for name in ('measurement', 'copy0', 'copy1'):
+        files[name] = tmp_path / f'{name}.csv'
+        files[name].write_text(content)
+    files['other'] = tmp_path / 'other.csv'
+    files['other'].write_text(content + '\n20.00,1\n')
+    files['prm'] = tmp_path / 'test.instprm'
+    files['prm'].write_text('#GSAS-II instrument parameter file\nType:PXC\n')
+    files['cif'] = tmp_path / 'test.cif'
+    files['cif'].write_text('data_test\n_cell_length_a 5.64\n')
+    return files
+
+
+@pytest.fixture
+def study_params(input_files) -> dict:
+    '''Arguments of post_bborietveld_study_task except study_name and measurementfile.'''
+    return dict(
+        prmfile = input_files['prm'],
+        ciffiles = [input_files['cif']],
+        sequence = 'default',
+        n_trials_total = 10,
+    )
@@ -0,0 +1,58 @@
+import json
+import pytest
+from requests.models import Response
+from bbor_client.cassette import Cassette, REDACTED_TOKEN, redact_body, request_key
+
+
+def response(body: dict, status_code: int = 200) -> Response:
+    r = Response()
+    r.status_code = status_code
+    r.headers['Content-Type'] = 'application/json'
+    r.headers['Set-Cookie'] = 'session=secret'
+    r._content = json.dumps(body).encode()
+    return r
+
+
+def test_redact_body():
+    body = {'access_token': 'abc', 'token_type': 'bearer', 'nested': [{'refresh_token': 'def'}]}
+    assert json.loads(redact_body(json.dumps(body).encode())) == {
+        'access_token': REDACTED_TOKEN,
+        'token_type': 'bearer',
+        'nested': [{'refresh_token': REDACTED_TOKEN}],
+    }
+    # Bodies without tokens are kept byte for byte
+    assert redact_body(b'{"a":  1}') == b'{"a":  1}'
+    assert redact_body(b'not json') == b'not json'
+
+
+def test_request_key_leaves_out_credentials():
+    login = request_key('post', '/token', data={'username': 'user', 'password': 'secret'})
+    assert login == request_key('POST', '/token', data={'username': 'other', 'password': 'other'})
+    assert request_key('get', '/study', params={'a': 1}) != request_key('get', '/study', params={'a': 2})
+
+
+def test_record_and_replay(tmp_path):
+    path = tmp_path / 'session.zip'
+    login = request_key('post', '/token', data={'username': 'user', 'password': 'secret'})
+    study = request_key('get', '/study/1')
+    with Cassette(path, mode='record') as cassette:
+        cassette.record(login, 'post', '/token', response({'access_token': 'abc'}))
+        cassette.record(study, 'get', '/study/1', response({'n': 1}))
+        cassette.record(study, 'get', '/study/1', response({'n': 2}))
+    assert b'abc' not in path.read_bytes()
+    assert b'secret' not in path.read_bytes()
+
+    with Cassette(path, mode='replay') as cassette:
+        assert len(cassette) == 3
+        token = cassette.play(login, 'post', '/token', 'http://server/token')
+        assert token.json() == {'access_token': REDACTED_TOKEN}
+        assert 'Set-Cookie' not in token.headers
+        # In the recorded order, repeating the last one
+        assert [cassette.play(study, 'get', '/study/1', 'url').json()['n'] for _ in range(3)] == [1, 2, 2]
+        with pytest.raises(KeyError):
+            cassette.play(request_key('get', '/study/2'), 'get', '/study/2', 'url')
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(tmp_path / 'session.zip', mode='rewind')  # type: ignore
@@ -0,0 +1,68 @@
+import pytest
+from bbor_client import circuit
+from bbor_client.circuit import CircuitBreaker, CircuitOpenError, endpoint_group
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    now = [1000.]
+    monkeypatch.setattr(circuit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize('endpoint, group', [
+    ('/study', 'study'),
+    ('studies', 'study'),
+    ('/study/name/optunadf', 'study'),
+    ('/trials/', 'trial'),
+    ('/task/status', 'task'),
+])
+def test_endpoint_group(endpoint, group):
+    assert endpoint_group(endpoint) == group
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_time=10.)
+    for _ in range(2):
+        breaker.before('study')
+        breaker.failure('study')
+    breaker.before('study')
+    breaker.success('study')
+    for _ in range(3):
+        breaker.before('study')
+        breaker.failure('study')
+    assert breaker.state('study') == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before('study')
+    # Other groups are not affected
+    breaker.before('trial')
+    assert breaker.to_dict()['study'] == {'state': 'open', 'failures': 3, 'opened': 1, 'rejected': 1}
+
+
+@pytest.mark.parametrize('probe_succeeds, state', [(True, 'closed'), (False, 'open')])
+def test_half_open_probe(clock, probe_succeeds, state):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_time=10.)
+    breaker.before('study')
+    breaker.failure('study')
+    clock[0] += 10.
+    breaker.before('study')
+    assert breaker.state('study') == 'half_open'
+    # One probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before('study')
+    if probe_succeeds:
+        breaker.success('study')
+    else:
+        breaker.failure('study')
+    assert breaker.state('study') == state
+
+
+def test_release_lets_another_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_time=10.)
+    breaker.before('study')
+    breaker.failure('study')
+    clock[0] += 10.
+    breaker.before('study')
+    breaker.release('study')
+    breaker.before('study')
+    assert breaker.state('study') == 'half_open'
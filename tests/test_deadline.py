@@ -0,0 +1,57 @@
+import threading
+import time
+import pytest
+from bbor_client import deadline
+from bbor_client.deadline import DeadlineExceeded, request_timeout
+
+
+def test_no_deadline():
+    assert deadline.remaining() is None
+    assert request_timeout((5, 30)) == (5, 30)
+
+
+def test_timeouts_are_cut_to_the_deadline():
+    with deadline.deadline(2.):
+        connect, read = request_timeout((5, 30))
+        assert 1. < connect == read <= 2.
+        assert request_timeout((5, 30), cut=False) == (5, 30)
+        assert request_timeout((0.5, 30))[0] == 0.5
+
+
+def test_nested_deadline_cannot_extend_the_outer_one():
+    with deadline.deadline(1.):
+        with deadline.deadline(100.):
+            assert deadline.remaining() <= 1.
+
+
+def test_timeouts_override():
+    with deadline.timeouts(read=300):
+        assert request_timeout((5, 30)) == (5, 300)
+        with deadline.timeouts(connect=1):
+            assert request_timeout((5, 30)) == (1, 300)
+    assert request_timeout((5, 30)) == (5, 30)
+
+
+def test_check_and_sleep_after_the_deadline():
+    with deadline.deadline(0.05):
+        deadline.check()
+        with pytest.raises(DeadlineExceeded):
+            deadline.sleep(1.)
+        with pytest.raises(DeadlineExceeded):
+            deadline.check('the request')
+
+
+def test_deadline_is_passed_to_other_threads():
+    remaining = []
+    with deadline.deadline(1.):
+        expiry = deadline.expiry()
+
+    def work():
+        with deadline.deadline(at=expiry):
+            remaining.append(deadline.remaining())
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    assert 0. < remaining[0] <= 1.
+    assert expiry <= time.monotonic() + 1.
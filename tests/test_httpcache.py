@@ -0,0 +1,51 @@
+from requests.models import Response
+from bbor_client.httpcache import ConditionalCache, http_date
+
+
+def response(content: bytes, **headers) -> Response:
+    r = Response()
+    r.status_code = 200
+    r.headers.update(headers)
+    r._content = content
+    r.url = 'http://server/study/1'
+    return r
+
+
+def test_conditions_prefer_etag():
+    cache = ConditionalCache()
+    cache.store('a', response(b'{}', ETag='"v1"', **{'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'}))
+    cache.store('b', response(b'{}'), last_modified='Wed, 01 Jan 2025 00:00:00 GMT')
+    assert cache.get('a').conditions() == {'If-None-Match': '"v1"'}
+    assert cache.get('b').conditions() == {'If-Modified-Since': 'Wed, 01 Jan 2025 00:00:00 GMT'}
+
+
+def test_response_without_validators_is_dropped():
+    cache = ConditionalCache()
+    cache.store('a', response(b'old', ETag='"v1"'))
+    cache.store('a', response(b'new'))
+    assert cache.get('a') is None
+
+
+def test_hit_replays_content():
+    cache = ConditionalCache()
+    cache.store('a', response(b'{"x": 1}', ETag='"v1"'))
+    replayed = cache.hit(cache.get('a'))
+    assert replayed.json() == {'x': 1}
+    assert replayed.headers['ETag'] == '"v1"'
+    assert cache.hits == 1
+
+
+def test_least_recently_used_are_dropped():
+    cache = ConditionalCache(max_entries=2)
+    cache.store('a', response(b'a', ETag='a'))
+    cache.store('b', response(b'b', ETag='b'))
+    cache.get('a')
+    cache.store('c', response(b'c', ETag='c'))
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+
+
+def test_http_date():
+    assert http_date('2025-01-01T09:00:00+09:00') == 'Wed, 01 Jan 2025 00:00:00 GMT'
+    assert http_date('2025-01-01T00:00:00') == 'Wed, 01 Jan 2025 00:00:00 GMT'
@@ -0,0 +1,46 @@
+import pytest
+from bbor_client.mirror import LocalMirror
+from bbor_client.models.trial import Trial
+
+STUDY_ID = '0123456789abcdef01234567'
+
+
+def trial_document(num: int) -> dict:
+    return {
+        '_id': f'{num:024x}',
+        'parent_study': {'collection': 'study', 'id': STUDY_ID},
+        'group': {'collection': 'group', 'id': 'f' * 24},
+        'refines': [],
+        'result_refine': None,
+        'trial_num': num,
+        'is_randomly_sampled': num < 3,
+        'seed': num,
+        'start_at': '2025-01-01T00:00:00+00:00',
+        'time_to_complete': 1.5,
+        'processed_by': 'test',
+    }
+
+
+@pytest.fixture
+def documents() -> list[dict]:
+    return [trial_document(num) for num in range(10)]
+
+
+@pytest.mark.parametrize('as_model', [False, True])
+def test_add_trials_indexes_trial_num(documents, as_model):
+    trials = [Trial.model_validate(d) for d in documents] if as_model else documents
+    with LocalMirror() as mirror:
+        assert mirror.add_trials(trials) == 10
+        found = mirror.find_trials({'trial_num': {'$lt': 5}}, return_dict=True)
+        assert sorted(t['trial_num'] for t in found) == [0, 1, 2, 3, 4]
+        assert {t['_id'] for t in found} == {d['_id'] for d in documents[:5]}
+        assert len(mirror.find_trials({'parent_study.id': STUDY_ID})) == 10
+
+
+def test_model_round_trip(documents):
+    with LocalMirror() as mirror:
+        mirror.add_trials([Trial.model_validate(documents[0])])
+        trial, = mirror.find_trials({'_id': documents[0]['_id']})
+        assert isinstance(trial, Trial)
+        assert trial.num == 0
+        assert trial.id == documents[0]['_id']
@@ -0,0 +1,97 @@
+import importlib
+from pathlib import Path
+import pytest
+from bbor_client.parsers import selector, register_parser, get_parser, parse_many
+from bbor_client.parsers.encoding import encode_histogram, decode_histogram, HEADER
+from bbor_client.parsers.interface import ParserInterface
+
+CSV = ''.join(f'{10 + 0.02*i:.2f},{1000 + i % 37}\n' for i in range(200))
+XRDML_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n<xrdMeasurements xmlns="http://www.xrdml.com/XRDMeasurement/1.5">\n'
+
+
+@pytest.fixture
+def files(tmp_path) -> dict[str, Path]:
+    paths = {
+        'csv': tmp_path / 'a.csv',
+        'misnamed': tmp_path / 'b.xrdml',  # CSV content
+        'empty': tmp_path / 'c.csv',
+        'missing': tmp_path / 'd.csv',
+    }
+    paths['csv'].write_text(CSV)
+    paths['misnamed'].write_text(CSV)
+    paths['empty'].write_text('')
+    return paths
+
+
+def test_selector_by_extension():
+    assert selector('a.CSV') is get_parser('csv')
+    with pytest.raises(ValueError):
+        selector('a.unknown')
+
+
+@pytest.mark.parametrize('filename, head, extension', [
+    ('a.xrdml', CSV, 'csv'),  # The content wins over a wrong extension
+    ('a.dat', CSV, 'csv'),  # Unknown extension
+    ('a.csv', XRDML_HEAD, 'xrdml'),
+    ('a.csv', CSV, 'csv'),
+])
+def test_selector_sniffs_the_content(filename, head, extension):
+    assert selector(filename, head=head.encode()) is get_parser(extension)
+
+
+def test_selector_keeps_the_extension_if_nothing_recognizes_the_content():
+    assert selector('a.csv', head=b'\x00\x01binary') is get_parser('csv')
+    with pytest.raises(ValueError):
+        selector('a.dat', head=b'\x00\x01binary')
+
+
+def test_register_parser(monkeypatch):
+    # The module, not the function of the same name re-exported by the package
+    selector_module = importlib.import_module('bbor_client.parsers.selector')
+    monkeypatch.setattr(selector_module, '_registry', dict(selector_module._registry))
+    monkeypatch.setattr(selector_module, '_resolved', dict(selector_module._resolved))
+
+    class Parser(ParserInterface):
+        @classmethod
+        def sniff(cls, head: str) -> bool:
+            return head.startswith('RASX')
+
+    register_parser('.RASX', Parser)
+    assert get_parser('rasx') is Parser
+    assert selector('a.txt', head=b'RASX data') is Parser
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parse_many(files, workers):
+    order = ['csv', 'missing', 'misnamed', 'empty']
+    results = parse_many([files[name] for name in order], workers=workers)
+    assert [r.path for r in results] == [str(files[name]) for name in order]
+    assert [r.ok for r in results] == [True, False, True, False]
+    assert results[1].error.startswith('FileNotFoundError')
+    parser = results[2].parser
+    assert isinstance(parser, get_parser('csv'))
+    assert len(parser.twotheta) == 200
+    assert list(parser.counts[:2]) == [1000., 1001.]
+
+
+@pytest.mark.parametrize('encoding', ['csv', 'csv.gz', 'float32', 'float64'])
+def test_encoding_round_trip(encoding):
+    twotheta = [10 + 0.25*i for i in range(100)]
+    counts = [float(i % 17) for i in range(100)]
+    decoded = decode_histogram(encode_histogram(twotheta, counts, encoding), encoding)
+    assert list(decoded[0]) == twotheta
+    assert list(decoded[1]) == counts
+
+
+def test_binary_container_layout():
+    data = encode_histogram([1., 2.], [3., 4.], 'float32')
+    assert data[:8] == b'BBORHIST'
+    assert len(data) == HEADER.size + 4 * 4
+    assert HEADER.unpack_from(data)[1:] == (1, b'f', 2)
+
+
+def test_invalid_encodings():
+    with pytest.raises(ValueError):
+        encode_histogram([1.], [2.], 'float16')  # type: ignore
+    with pytest.raises(ValueError):
+        decode_histogram(b'NOTAHIST' + bytes(HEADER.size), 'float64')
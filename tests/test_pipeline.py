@@ -0,0 +1,57 @@
+import pytest
+from bbor_client.pipeline import SubmissionPipeline, STAGES
+
+
+def requests_of(client, route: str) -> int:
+    return client.metrics.to_dict().get(route, {}).get('requests', 0)
+
+
+def test_posts_a_batch_in_order(client, input_files, study_params):
+    names = ['measurement', 'copy0', 'missing', 'other']
+    input_files['missing'] = input_files['measurement'].with_name('missing.csv')
+    pipeline = SubmissionPipeline(client, post_workers=2, queue_size=1)
+    results = pipeline.run(
+        dict(study_params, study_name=name, measurementfile=input_files[name]) for name in names
+    )
+    assert [result.index for result in results] == [0, 1, 2, 3]
+    assert [result.ok for result in results] == [True, True, False, True]
+    assert 'missing.csv' in results[2].traceback
+    # Uploaded once for the batch
+    assert requests_of(client, 'POST /file/prm') == 1
+    assert requests_of(client, 'POST /file/cif') == 1
+    metrics = pipeline.metrics()
+    assert list(metrics) == list(STAGES)
+    assert [metrics[stage]['items'] for stage in STAGES] == [4, 4, 4]
+    assert metrics['prepare']['errors'] == 1
+
+
+def test_same_inputs_are_posted_once_in_a_batch(client, input_files, study_params):
+    names = ['measurement', 'copy0', 'other', 'copy1']
+    params = [
+        dict(study_params, study_name=name, measurementfile=input_files[name], random_seed=1) for name in names
+    ]
+    results = SubmissionPipeline(client, post_workers=3).run(params)
+    assert all(result.ok for result in results)
+    study_ids = [result.responses[0].json()['study_id'] for result in results]
+    assert study_ids[0] == study_ids[1] == study_ids[3] != study_ids[2]
+    assert [result.responses[0].status_code for result in results] == [202, 200, 202, 200]
+    # And found on the server in the next batch
+    again = SubmissionPipeline(client).run(params[:1])
+    assert again[0].responses[0].json() == {'study_id': study_ids[0], 'study_name': 'measurement', 'existing': True}
+
+
+def test_error_of_the_params_iterator(client, input_files, study_params):
+    def params():
+        yield dict(study_params, study_name='s0', measurementfile=input_files['measurement'])
+        raise RuntimeError('listing failed')
+
+    results = SubmissionPipeline(client, prepare_workers=2).run(params())
+    assert [result.index for result in results] == [0, 1]
+    assert results[0].ok
+    assert isinstance(results[1].error, RuntimeError)
+    assert 'listing failed' in results[1].traceback
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        SubmissionPipeline(None, post_workers=0)  # type: ignore
@@ -0,0 +1,76 @@
+import pytest
+import requests
+from bbor_client import BBORClient
+from bbor_client.pool import BBORClientPool, queue_depth
+from mockserver import MockData, serve, MOCK_USERNAME, MOCK_PASSWORD
+
+
+@pytest.fixture
+def pool():
+    with serve(MockData(n_studies=2, n_trials=5, seed=1)) as a, serve(MockData(n_studies=1, n_trials=5, seed=2)) as b:
+        yield BBORClientPool([BBORClient(MOCK_USERNAME, MOCK_PASSWORD, server=url) for url in (a, b)])
+
+
+@pytest.mark.parametrize('status, depth', [
+    ({'n_queuing': 3, 'queuing': ['a']}, 3),
+    ({'queuing': ['a', 'b']}, 2),
+    ({'n_queuing': 0}, 0),
+])
+def test_queue_depth(status, depth):
+    assert queue_depth(status) == depth
+
+
+@pytest.mark.parametrize('status', [None, [], {'tasks': []}, {'n_queuing': '3'}])
+def test_queue_depth_of_unknown_shapes(status):
+    with pytest.raises(ValueError, match='Pass queue_depth'):
+        queue_depth(status)
+
+
+def test_merge_sorts_and_limits_over_the_servers(pool):
+    results = {
+        'a': [{'_id': 1, 'r': {'Rwp': 5.}}, {'_id': 2, 'r': {'Rwp': 9.}}, {'_id': 3}],
+        'b': [{'_id': 4, 'r': {'Rwp': 1.}}, {'_id': 5, 'r': {'Rwp': 7.}}],
+    }
+    assert [d['_id'] for d in pool._merge(results, sort=[('r.Rwp', 1)])] == [4, 1, 5, 2, 3]
+    assert [d['_id'] for d in pool._merge(results, sort=[('r.Rwp', -1)], limit=2)] == [2, 5]
+    assert [d['_id'] for d in pool._merge(results)] == [1, 2, 3, 4, 5]
+
+
+def test_find_studies_of_all_the_servers(pool):
+    studies = pool.find_studies(return_dict=True)
+    assert len(studies) == 3
+    a, b = pool.clients.values()
+    assert [pool.client_of(study['_id']) for study in studies] == [a, a, b]
+
+
+def test_find_trials_sorted_over_the_servers(pool):
+    trials = pool.find_trials(sort=[('trial_num', -1)], limit=4)
+    assert [trial.num for trial in trials] == sorted((trial.num for trial in trials), reverse=True)
+    assert len(trials) == 4
+
+
+def test_posts_to_the_shortest_queue(pool, input_files, study_params):
+    names = []
+    for i in range(4):
+        pool.post_bborietveld_study_task(study_name=f's{i}', measurementfile=input_files['measurement'], **study_params)
+        names.append(pool.history[-1][0])
+    assert sorted(names) == sorted(list(pool.clients) * 2)
+    assert pool.queue_depths() == {name: 2 for name in pool.clients}
+
+
+def test_custom_queue_depth(pool):
+    statuses = []
+    pool.queue_depth = lambda status: statuses.append(status) or 7
+    assert pool.queue_depths() == {name: 7 for name in pool.clients}
+    assert all('queuing' in status for status in statuses)
+    # Errors of the parser are not hidden
+    pool.queue_depth = lambda status: status['tasks']
+    with pytest.raises(KeyError):
+        pool.choose_server()
+
+
+def test_no_server_available(pool):
+    for client in pool.clients.values():
+        client.token = None
+    with pytest.raises(requests.ConnectionError):
+        pool.choose_server()
@@ -0,0 +1,36 @@
+import pytest
+from bbor_client.query import projection, project, match
+
+TRIAL = {
+    '_id': 't1',
+    'trial_num': 3,
+    'parent_study': {'collection': 'study', 'id': 's1'},
+    'result_refine': {'Rval': {'Rwp': 5.1, 'GOF': 1.2}, 'converged': True},
+    'refines': [{'id': 'r1', 'collection': 'refine'}, {'collection': 'refine'}],
+}
+
+
+def test_projection_normalizes_references():
+    assert projection(['trial_num', 'parent_study.$id']) == {'trial_num': 1, 'parent_study.id': 1}
+
+
+@pytest.mark.parametrize('fields, projected', [
+    (['trial_num'], {'_id': 't1', 'trial_num': 3}),
+    (['result_refine.Rval.Rwp'], {'_id': 't1', 'result_refine': {'Rval': {'Rwp': 5.1}}}),
+    (
+        ['result_refine.Rval.Rwp', 'result_refine.converged'],
+        {'_id': 't1', 'result_refine': {'Rval': {'Rwp': 5.1}, 'converged': True}},
+    ),
+    (['parent_study.$id'], {'_id': 't1', 'parent_study': {'id': 's1'}}),
+    # Array elements without the field are kept as {}, as MongoDB does
+    (['refines.id'], {'_id': 't1', 'refines': [{'id': 'r1'}, {}]}),
+    (['missing.path'], {'_id': 't1'}),
+])
+def test_project(fields, projected):
+    assert project(TRIAL, fields) == projected
+
+
+def test_projected_documents_match_the_same_filters():
+    projected = project(TRIAL, ['result_refine.Rval.Rwp', 'parent_study.id'])
+    assert match(projected, {'result_refine.Rval.Rwp': {'$lt': 10}, 'parent_study.$id': 's1'})
+    assert not match(projected, {'trial_num': 3})
@@ -0,0 +1,63 @@
+import json
+import pytest
+from bbor_client.scheduler import StudyScheduler
+
+
+@pytest.fixture
+def batch(input_files, study_params) -> list[dict]:
+    return [dict(study_params, study_name=f's{i}', measurementfile=input_files['measurement']) for i in range(3)]
+
+
+def test_pending_order(client, batch):
+    scheduler = StudyScheduler(client)
+    low = scheduler.submit_batch(batch[:2], priority=0)
+    high = scheduler.submit(priority=1, **batch[2])
+    assert [job.id for job in scheduler.pending] == [high] + low
+
+
+def test_keeps_max_in_flight(client, batch):
+    scheduler = StudyScheduler(client, max_in_flight=2, poll_interval=0.05)
+    scheduler.submit_batch(batch)
+    assert scheduler.step() == 2
+    assert scheduler.n_in_flight() == 2
+    assert scheduler.step() == 0
+    scheduler.run()
+    assert [job.state for job in scheduler.jobs.values()] == ['done'] * 3
+    assert all(len(job.study_ids) == 1 and job.finished == job.study_ids for job in scheduler.jobs.values())
+
+
+def test_max_queue_of_the_server(client, batch):
+    scheduler = StudyScheduler(client, max_queue=1, queue_depth=lambda status: 1)
+    scheduler.submit_batch(batch)
+    assert scheduler.step() == 0
+    scheduler.queue_depth = lambda status: 0
+    assert scheduler.step() == 3
+
+
+def test_invalid_jobs_fail(client, batch, tmp_path):
+    scheduler = StudyScheduler(client)
+    missing = scheduler.submit(**dict(batch[0], measurementfile=tmp_path / 'missing.csv'))
+    invalid = scheduler.submit(**dict(batch[1], n_trials_total='many'))
+    valid = scheduler.submit(**batch[2])
+    assert scheduler.step() == 3
+    assert scheduler.jobs[missing].state == 'failed'
+    assert scheduler.jobs[invalid].state == 'failed'
+    assert 'n_trials_total' in scheduler.jobs[invalid].error
+    assert scheduler.jobs[valid].state == 'in_flight'
+
+
+def test_resume_from_the_file(client, batch, tmp_path):
+    path = tmp_path / 'queue.json'
+    scheduler = StudyScheduler(client, path, max_in_flight=1)
+    scheduler.submit_batch(batch[:2], batch='a')
+    scheduler.submit(batch='b', **batch[2])
+    scheduler.step()
+    # Interrupted while posting
+    saved = json.loads(path.read_text())
+    saved['jobs'][1]['state'] = 'posting'
+    path.write_text(json.dumps(saved))
+
+    resumed = StudyScheduler(client, path)
+    assert [job.state for job in resumed.jobs.values()] == ['in_flight', 'pending', 'pending']
+    assert resumed.cancel(batch='b') == 1
+    assert resumed.submit(**batch[0]) == 4
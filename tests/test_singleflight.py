@@ -0,0 +1,77 @@
+import threading
+import pytest
+from bbor_client.singleflight import SingleFlight, FlightTimeout
+
+
+def call_while_in_flight(flights: SingleFlight, func, n_waiters: int) -> list:
+    '''Calls func through flights, and calls it from n_waiters threads more while the first call is running.'''
+    entered, release = threading.Event(), threading.Event()
+    results: list = [None] * (n_waiters + 1)
+
+    def leader_func():
+        entered.set()
+        release.wait(5.)
+        return func()
+
+    def call(i, f):
+        try:
+            results[i] = flights.do('key', f)
+        except ValueError as e:
+            results[i] = e
+
+    leader = threading.Thread(target=call, args=(0, leader_func))
+    leader.start()
+    entered.wait(5.)
+    waiters = [threading.Thread(target=call, args=(i + 1, func)) for i in range(n_waiters)]
+    for thread in waiters:
+        thread.start()
+    while flights._calls['key'].waiters < n_waiters:
+        pass
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join()
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    def func():
+        calls.append(1)
+        return 'result'
+
+    results = call_while_in_flight(flights, func, 3)
+    assert len(calls) == 1
+    assert results == [('result', False)] + [('result', True)] * 3
+    assert flights.in_flight() == 0
+
+
+def test_error_is_shared_and_not_kept():
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError('failed')
+
+    results = call_while_in_flight(flights, fail, 2)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.do('key', lambda: 1) == (1, False)
+
+
+def test_waiter_times_out():
+    flights = SingleFlight()
+    entered, release = threading.Event(), threading.Event()
+
+    def slow():
+        entered.set()
+        release.wait(5.)
+
+    leader = threading.Thread(target=flights.do, args=('key', slow))
+    leader.start()
+    entered.wait(5.)
+    try:
+        with pytest.raises(FlightTimeout):
+            flights.do('key', lambda: None, timeout=0.05)
+    finally:
+        release.set()
+        leader.join()
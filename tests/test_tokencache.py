@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+import threading
+import time
+import pytest
+from bbor_client.tokencache import TokenCache, token_expiry
+
+SERVER = 'https://server'
+
+
+def jwt(exp: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({'sub': 'user', 'exp': exp}).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+@pytest.fixture
+def cache(tmp_path) -> TokenCache:
+    return TokenCache(tmp_path / 'cache' / 'tokens.json')
+
+
+def test_token_expiry():
+    assert token_expiry(jwt(1234)) == 1234.
+    assert token_expiry('opaque-token') is None
+    assert token_expiry('a.!!!.c') is None
+
+
+def test_save_and_load(cache):
+    token = jwt(time.time() + 3600)
+    cache.save(SERVER, 'user', token)
+    assert cache.load(SERVER, 'user') == token
+    assert cache.load(SERVER, 'other') is None
+    assert TokenCache(cache.path).load(SERVER, 'user') == token
+    if os.name != 'nt':
+        assert cache.path.stat().st_mode & 0o777 == 0o600
+        assert cache.path.parent.stat().st_mode & 0o777 == 0o700
+
+
+def test_expiring_tokens_are_not_reused(cache):
+    cache.save(SERVER, 'user', jwt(time.time() + 10))
+    assert cache.load(SERVER, 'user') is None
+    cache.save(SERVER, 'expired', jwt(time.time() - 10))
+    cache.save(SERVER, 'user', jwt(time.time() + 3600))
+    # Expired tokens are dropped when saving
+    assert list(json.loads(cache.path.read_text())) == ['user@https://server']
+
+
+def test_discard_only_the_rejected_token(cache):
+    token = jwt(time.time() + 3600)
+    cache.save(SERVER, 'user', token)
+    cache.discard(SERVER, 'user', 'another-token')
+    assert cache.load(SERVER, 'user') == token
+    cache.discard(SERVER, 'user', token)
+    assert cache.load(SERVER, 'user') is None
+
+
+def test_corrupted_file_is_ignored(cache):
+    cache.path.parent.mkdir(parents=True)
+    cache.path.write_text('{not json')
+    assert cache.load(SERVER, 'user') is None
+
+
+def test_lock_is_reentrant_and_exclusive(cache):
+    entered = threading.Event()
+    with cache.locked():
+        with cache.locked():
+            cache.save(SERVER, 'user', 'token')
+        other = TokenCache(cache.path)
+
+        def wait_for_lock():
+            with other.locked():
+                entered.set()
+
+        thread = threading.Thread(target=wait_for_lock)
+        thread.start()
+        assert not entered.wait(0.2)
+    thread.join(5.)
+    assert entered.is_set()